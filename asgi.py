@@ -0,0 +1,4 @@
+from lostify import create_app
+from lostify.asgi import create_asgi_app
+
+app = create_asgi_app(create_app())
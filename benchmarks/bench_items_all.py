@@ -0,0 +1,102 @@
+"""
+*file: benchmarks/bench_items_all.py*
+
+------
+Benchmark `GET /items/all` with each available JSON backend, uncached, and
+served from the response cache.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_items_all --posts 10000 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+from lostify import create_app, formats
+from lostify.db import get_db, init_db
+
+def seed(app, posts: int):
+    """
+    Create a user `bench` (password `bench`) and `posts` posts.
+    """
+
+    with app.app_context():
+        init_db()
+        db = get_db()
+
+        with db:
+            db.execute(
+                "INSERT INTO users (id, username, password, role) VALUES (?, ?, ?, ?)",
+                (1, "bench", generate_password_hash("bench"), 0)
+            )
+            db.executemany(
+                "INSERT INTO posts (type, creator, title, description, location1, location2, image, date) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        i % 2, 1, f"Post {i}", "Lost near the library. " * 4,
+                        "Library", "Second floor", b"aW1hZ2U=" * 16, 1743769999 + i
+                    )
+                    for i in range(posts)
+                )
+            )
+
+def bench(app, repeat: int) -> float:
+    """
+    Return the best time (in seconds) of `repeat` requests to `/items/all`.
+    """
+
+    client = app.test_client()
+    client.post("/auth/login", json = {"username": "bench", "password": "bench"})
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get("/items/all")
+        best = min(best, time.perf_counter() - start)
+
+        assert response.status_code == 200
+
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[4])
+    parser.add_argument("--posts", type = int, nargs = "+", default = [10_000, 100_000])
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    backends = ["stdlib"] + ([] if formats.orjson is None else ["orjson"])
+
+    for posts in args.posts:
+        db_fd, db_path = tempfile.mkstemp()
+
+        try:
+            app = create_app({
+                "TESTING": True,
+                "SECRET_KEY": "bench",
+                "DATABASE": db_path,
+                "RATELIMIT_ENABLED": False,
+                "RESPONSE_CACHE_SIZE": 0
+            })
+            seed(app, posts)
+
+            for backend in backends:
+                app.config["JSON_BACKEND"] = backend
+                app.json = formats.make_json_provider(app)
+
+                print(f"{posts:>8} posts  {backend:<8} {bench(app, args.repeat) * 1000:9.1f} ms")
+
+            app.extensions["response_cache"].max_entries = 32
+
+            print(f"{posts:>8} posts  {'cached':<8} {bench(app, args.repeat) * 1000:9.1f} ms")
+        finally:
+            os.close(db_fd)
+            os.unlink(db_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+*file: benchmarks/bench_mailer.py*
+
+------
+Compare the per-send overhead of a new email client (and a fresh parse of
+`.env`) for every send with the process-wide client of `mailer.send`,
+against a local stub of the Azure Communication Services email endpoint.
+
+The stub serves HTTPS with a self-signed certificate created by the
+`openssl` command, since the SDK always connects over HTTPS.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_mailer --sends 50
+"""
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from dotenv import dotenv_values
+
+from lostify import create_app, mailer
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Accepts every send (`POST /emails:send`) and reports it as succeeded on
+    the first poll of its operation.
+    """
+
+    protocol_version = "HTTP/1.1"       # Keep-alive
+    disable_nagle_algorithm = True
+
+    connections: set = set()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, body: dict, headers: dict = {}):
+        self.connections.add(self.client_address)
+        data = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        host, port = self.server.server_address
+        self.reply(202, {"id": "stub", "status": "Running"}, {
+            "Operation-Location": f"https://{host}:{port}/emails/operations/stub",
+            "Retry-After": "0"
+        })
+
+    def do_GET(self):
+        self.reply(200, {"id": "stub", "status": "Succeeded"})
+
+def stub_server(directory: str) -> http.server.ThreadingHTTPServer:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+            "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", key, "-out", cert
+        ],
+        check = True, capture_output = True
+    )
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.socket = context.wrap_socket(server.socket, server_side = True)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    return server
+
+def send_with_new_client(message: dict, connection_string: str, options: dict):
+    """
+    A send as before `mailer`: configuration and client created per send.
+    """
+
+    from azure.communication.email import EmailClient
+
+    dotenv_values(".env")
+    client = EmailClient.from_connection_string(connection_string, **options)
+    client.begin_send(message).result()
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[4])
+    parser.add_argument("--sends", type = int, default = 50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = stub_server(directory)
+        host, port = server.server_address
+
+        app = create_app({
+            "AZURE_CONNECTION_STRING": f"endpoint=https://{host}:{port}/;accesskey=c3R1Yg==",
+            "AZURE_SENDER_EMAIL": "noreply@example.com",
+            "MAIL_CLIENT_OPTIONS": {"connection_verify": os.path.join(directory, "cert.pem")}
+        })
+
+        with app.app_context():
+            message = mailer.otp_message(1234, "test@example.com", "Test")
+
+            # Warm up (imports, template compilation)
+            with contextlib.redirect_stdout(io.StringIO()):
+                mailer.send(message)
+
+            for name, send in (
+                ("new client per send", lambda: send_with_new_client(
+                    message, app.config["AZURE_CONNECTION_STRING"], app.config["MAIL_CLIENT_OPTIONS"]
+                )),
+                ("shared client", lambda: mailer.send(message)),
+            ):
+                StubHandler.connections.clear()
+
+                # The status lines printed by the sends are discarded
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    for _ in range(args.sends):
+                        send()
+                    elapsed = time.perf_counter() - start
+
+                print(
+                    f"{name:<20} {elapsed / args.sends * 1000:7.2f} ms/send  "
+                    f"{len(StubHandler.connections)} connections for {args.sends} sends"
+                )
+
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
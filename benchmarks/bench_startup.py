@@ -0,0 +1,72 @@
+"""
+*file: benchmarks/bench_startup.py*
+
+------
+Measure the startup of a worker process: the wall time of fresh
+interpreters importing `app` (which calls `create_app`), and a report of
+the slowest imports from `python -X importtime`.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_startup --runs 10 --top 15
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+def importtime(statement: str = "import app") -> list[tuple[int, int, str]]:
+    """
+    Run `statement` in a fresh interpreter with `-X importtime` and return
+    the `(self, cumulative, module)` times (in microseconds) it reports.
+    The module names keep their indentation, which shows the nesting.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output = True, text = True, check = True
+    )
+
+    times = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        own, cumulative, module = line[len("import time:"):].split("|")
+        times.append((int(own), int(cumulative), module.rstrip()))
+
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[4])
+    parser.add_argument("--runs", type = int, default = 10, help = "Interpreters to start.")
+    parser.add_argument("--top", type = int, default = 15, help = "Imports to report.")
+    args = parser.parse_args()
+
+    wall = []
+
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import app"], check = True)
+        wall.append(time.perf_counter() - start)
+
+    baseline = []
+
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check = True)
+        baseline.append(time.perf_counter() - start)
+
+    print(f"interpreter            {statistics.median(baseline) * 1000:8.1f} ms (median of {args.runs})")
+    print(f"interpreter + app      {statistics.median(wall) * 1000:8.1f} ms (median of {args.runs})")
+    print()
+    print(f"{'self [us]':>10} {'cumulative':>10}  module")
+
+    for own, cumulative, module in sorted(importtime(), key = lambda x: x[1], reverse = True)[:args.top]:
+        print(f"{own:>10} {cumulative:>10} {module}")
+
+if __name__ == "__main__":
+    main()
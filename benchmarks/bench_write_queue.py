@@ -0,0 +1,73 @@
+"""
+*file: benchmarks/bench_write_queue.py*
+
+------
+Compare small writes (report toggles) committed one by one with the same
+writes coalesced by `db.WriteQueue`, from several concurrent threads.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_write_queue --threads 16 --writes 200
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lostify.db import WriteQueue
+
+def toggle(db: sqlite3.Connection, postid: int):
+    db.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = ?", (postid,))
+
+def direct(path: str, writes: int):
+    db = sqlite3.connect(path, timeout = 30)
+
+    for i in range(writes):
+        with db:
+            toggle(db, i % 100)
+
+    db.close()
+
+def queued(write_queue: WriteQueue, writes: int):
+    for i in range(writes):
+        write_queue.submit(toggle, i % 100).result()
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[4])
+    parser.add_argument("--threads", type = int, default = 16)
+    parser.add_argument("--writes", type = int, default = 200, help = "Writes per thread.")
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp()
+
+    try:
+        db = sqlite3.connect(db_path)
+        db.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, reportCount INTEGER NOT NULL DEFAULT 0)")
+        db.executemany("INSERT INTO posts (id) VALUES (?)", ((i,) for i in range(100)))
+        db.commit()
+        db.close()
+
+        total = args.threads * args.writes
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(lambda _: direct(db_path, args.writes), range(args.threads)))
+        elapsed = time.perf_counter() - start
+        print(f"direct   {total} writes  {total} commits  {total / elapsed:8.0f} writes/s")
+
+        write_queue = WriteQueue(db_path)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(lambda _: queued(write_queue, args.writes), range(args.threads)))
+        elapsed = time.perf_counter() - start
+        print(f"queued   {total} writes  {write_queue.commits} commits  {total / elapsed:8.0f} writes/s")
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
+import functools
 import os
 from flask import Flask
 from dotenv import dotenv_values
 
+@functools.cache
+def load_env(path: str = ".env") -> dict[str, str | None]:
+    """
+    Parse the environment file at `path` (once per process; later calls
+    return the cached values).
+    """
+
+    return dotenv_values(path)
+
 def create_app(test_config = None):
-    env = dotenv_values(".env")                     # Load environment variables from .env file
+    env = load_env()                                # Load environment variables from .env file
 
     # Create the app
     app = Flask(__name__, instance_relative_config = True)
@@ -11,7 +21,12 @@ def create_app(test_config = None):
     # Configure the app
     app.config.from_mapping(
         SECRET_KEY = env['FLASK_SECRET_KEY'],       # Used for signing cookies
-        DATABASE = os.path.join(app.instance_path, env['FLASK_DB_NAME'])    # Path to the SQLite database
+        DATABASE = os.path.join(app.instance_path, env['FLASK_DB_NAME']),   # Path to the SQLite database
+        JSON_BACKEND = "auto",                      # 'orjson' if installed, else 'stdlib'
+        MAX_CONTENT_LENGTH = 16 * 1024 * 1024,      # Bytes per request body, unless capped per endpoint
+        BODY_MAX_SIZE = 64 * 1024,                  # Bytes per request body without an image (see formats.limit_body)
+        AZURE_CONNECTION_STRING = env.get('AZURE_CONNECTION_STRING'),    # Email service (see mailer.py)
+        AZURE_SENDER_EMAIL = env.get('AZURE_SENDER_EMAIL')
     )
 
     if test_config is None:
@@ -28,6 +43,10 @@ def create_app(test_config = None):
         # Directory exists
         pass
 
+    # Install the JSON provider for responses and request bodies
+    from . import formats
+    app.json = formats.make_json_provider(app)
+
     # A simple page that says "Hello, world!" for testing purposes
     @app.route('/hello')
     def hello():
@@ -36,6 +55,21 @@ def create_app(test_config = None):
     from . import db
     db.init_app(app)
 
+    from . import backup
+    backup.init_app(app)
+
+    from . import archive
+    archive.init_app(app)
+
+    from . import mailer
+    mailer.init_app(app)
+
+    from . import images
+    images.init_app(app)
+
+    from . import cache
+    cache.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.auth_bp)
 
@@ -45,6 +79,13 @@ def create_app(test_config = None):
     from . import users
     app.register_blueprint(users.users_bp)
 
+    # After `auth`, whose `before_app_request` function loads the user
+    from . import ratelimit
+    ratelimit.init_app(app)
+
+    from . import compression
+    compression.init_app(app)
+
 
     # Uncomment the following lines if you are using a
     # reverse proxy (like Nginx) in front of your Flask app
@@ -0,0 +1,197 @@
+"""
+*file: lostify/archive.py*
+
+------
+Archival of posts that are no longer browsed: posts closed at least
+`ARCHIVE_CLOSED_AGE` seconds ago, and posts dated at least `ARCHIVE_AGE`
+seconds ago. Archived posts are moved, with their images, from `posts` to
+`posts_archive`, so that the table and indexes served by every list view
+only hold open, recent posts. `items.get` still finds archived posts.
+
+Posts are moved in batches of `ARCHIVE_BATCH_SIZE`, one short write
+transaction per batch, pausing between batches so that writers can make
+progress. Reports and pending confirmations of archived posts are deleted
+with them; the dashboard counters of their users (`user_stats`) are kept.
+
+Also registers the command-line command `db archive`, and a scheduled
+archive job if `ARCHIVE_INTERVAL` (seconds) is set (see `init_app`).
+"""
+
+import sqlite3
+import threading
+import time
+
+import click
+from flask import Flask, current_app
+
+from .migrate import db_cli
+
+ARCHIVE_COLUMNS = (
+    "id",
+    "type",
+    "creator",
+    "title",
+    "description",
+    "location1",
+    "location1_id",
+    "location2",
+    "image",
+    "imageVersion",
+    "date",
+    "closedBy",
+    "closedDate",
+    "reportCount"
+)
+"""Columns of `posts` copied to `posts_archive`."""
+
+ARCHIVE_SLEEP = 0.05
+"""Time (in seconds) to sleep between batches."""
+
+def archive_batch(db: sqlite3.Connection, closed_before: int, dated_before: int, batch_size: int) -> int:
+    """
+    Move a batch of posts due for archival to `posts_archive`. Return the
+    number of posts moved.
+
+    :param db:
+    Connection to the database, with foreign keys enabled.
+
+    :param closed_before:
+    Posts closed at or before this time (Unix timestamp) are due.
+
+    :param dated_before:
+    Posts dated at or before this time (Unix timestamp) are due.
+
+    :param batch_size:
+    Maximum number of posts moved.
+    """
+
+    columns = ", ".join(ARCHIVE_COLUMNS)
+
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+
+        ids = [
+            row[0] for row in db.execute(
+                "SELECT id FROM posts "
+                    "WHERE (closedBy IS NOT NULL AND closedDate <= ?) OR date <= ? LIMIT ?",
+                (closed_before, dated_before, batch_size)
+            )
+        ]
+
+        if not ids:
+            return 0
+
+        placeholders = ", ".join("?" * len(ids))
+
+        # Copied first, so that the delete triggers see the archived rows
+        db.execute(
+            f"INSERT INTO posts_archive ({columns}, archived) "
+                f"SELECT {columns}, ? FROM posts WHERE id IN ({placeholders})",
+            (int(time.time()), *ids)
+        )
+        db.execute(f"DELETE FROM posts WHERE id IN ({placeholders})", ids)
+
+    return len(ids)
+
+def archive(
+    db: sqlite3.Connection,
+    closed_age: int,
+    age: int,
+    batch_size: int = 100,
+    sleep: float = ARCHIVE_SLEEP
+) -> int:
+    """
+    Move every post due for archival to `posts_archive`, in batches. Return
+    the number of posts moved.
+
+    :param db:
+    Connection to the database, with foreign keys enabled.
+
+    :param closed_age:
+    Time (in seconds) after closing at which a post is archived.
+
+    :param age:
+    Time (in seconds) after its date at which a post is archived.
+
+    :param batch_size:
+    Maximum number of posts moved per transaction.
+
+    :param sleep:
+    Time (in seconds) to sleep between batches.
+    """
+
+    now = int(time.time())
+    total = 0
+
+    while True:
+        count = archive_batch(db, now - closed_age, now - age, batch_size)
+        total += count
+
+        if count < batch_size:
+            return total
+
+        time.sleep(sleep)
+
+def _scheduled_archive(app: Flask):
+    """
+    Body of the scheduled archive thread. Archives due posts every
+    `ARCHIVE_INTERVAL` seconds. Concurrent jobs of several worker processes
+    take turns through the write lock and never move a post twice.
+    """
+
+    while True:
+        time.sleep(app.config["ARCHIVE_INTERVAL"])
+
+        db = sqlite3.connect(app.config["DATABASE"])
+
+        try:
+            db.execute("PRAGMA foreign_keys = ON")
+            archive(
+                db,
+                app.config["ARCHIVE_CLOSED_AGE"],
+                app.config["ARCHIVE_AGE"],
+                app.config["ARCHIVE_BATCH_SIZE"]
+            )
+        except Exception as e:
+            app.logger.exception("Scheduled archival failed: %s", e)
+        finally:
+            db.close()
+
+@db_cli.command("archive")
+@click.option("--batch-size", type = int, default = None, help = "Posts moved per transaction.")
+def archive_command(batch_size: int | None):
+    """
+    Move closed and old posts to the archive.
+    """
+
+    from .db import get_db
+
+    config = current_app.config
+    count = archive(
+        get_db(),
+        config["ARCHIVE_CLOSED_AGE"],
+        config["ARCHIVE_AGE"],
+        batch_size or config["ARCHIVE_BATCH_SIZE"]
+    )
+
+    click.echo(f"Archived {count} post(s).")
+
+def init_app(app: Flask):
+    """
+    Initialise archival for the app. Sets the default configuration and, if
+    `ARCHIVE_INTERVAL` (seconds) is set, starts the scheduled archive thread.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("ARCHIVE_AGE", 365 * 24 * 60 * 60)           # Seconds after the date of a post
+    app.config.setdefault("ARCHIVE_CLOSED_AGE", 30 * 24 * 60 * 60)     # Seconds after the closing of a post
+    app.config.setdefault("ARCHIVE_BATCH_SIZE", 100)
+    app.config.setdefault("ARCHIVE_INTERVAL", None)
+
+    if app.config["ARCHIVE_INTERVAL"] and not app.testing:
+        threading.Thread(
+            target = _scheduled_archive, args = (app,),
+            name = "lostify-archive", daemon = True
+        ).start()
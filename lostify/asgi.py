@@ -0,0 +1,711 @@
+"""
+*file: lostify/asgi.py*
+
+------
+ASGI deployment mode. `create_asgi_app` wraps the Flask app (built by
+`create_app`) in an ASGI application, served by an ASGI server such as
+uvicorn or hypercorn (see `asgi.py` in the repository root):
+
+    uvicorn asgi:app
+
+Most routes of the blueprints are served by the Flask app through
+[asgiref](https://pypi.org/project/asgiref/)'s `WsgiToAsgi` adapter, which
+runs each request in a worker thread as before. Flask views are
+synchronous, so the adapter alone does not free a thread while a view
+waits.
+
+Routes that wait on slow external services or stay open are instead
+handled natively on the event loop, where waiting costs a coroutine rather
+than a thread:
+
+- Views that send an email (decorated with `mailer.sends_email`, such as
+  `auth.get_otp` and `auth.reset_password`): the view runs up to the send
+  in a worker thread, the email is awaited on the event loop with
+  `mailer.send_async`, and the rest of the view runs in a worker thread
+  again, in the same request context.
+- `GET /users/<id>/stats/events`: a server-sent event stream of the
+  counters of a user (see `users.stats`), sent on connection and whenever
+  they change.
+
+Native handlers run the `before_request` functions of the Flask app (which
+load the user from the session and apply rate limits) and its
+`after_request` functions, as a request through the adapter would.
+
+Native handlers reach the database through an `AsyncDBPool`, which runs
+queries on a small pool of threads and awaits writes committed by the
+`db.WriteQueue` of the process. A single watcher per process detects
+commits (from any connection or process) through `PRAGMA data_version`
+and wakes the streams, so idle streams do not poll the database.
+"""
+
+import asyncio
+import contextvars
+import copy
+import io
+import os
+import pathlib
+import re
+import sqlite3
+import sys
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, g, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from . import mailer
+from .db import WriteQueue, close_db, get_write_queue
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:     # pragma: no cover - depends on the environment
+    WsgiToAsgi = None
+
+class AsyncDBPool:
+    """
+    Asynchronous access to a SQLite3 database from an event loop.
+
+    Queries run on a pool of `size` threads, each with its own read-only
+    connection (`mode=ro`, as `db.get_read_db`), so the event loop never
+    blocks on the database. Writes are submitted to a `WriteQueue` and
+    awaited without holding a thread of the pool.
+    """
+
+    def __init__(
+            self,
+            database: str,
+            write_queue: WriteQueue | None = None,
+            size: int = 8,
+            poll_interval: float = 0.5
+    ):
+        """
+        :param database:
+        Path to the database.
+
+        :param write_queue:
+        Queue for `write`. If `None`, `write` is unavailable.
+
+        :param size:
+        Number of threads (and read-only connections).
+
+        :param poll_interval:
+        Interval (in seconds) at which the watcher checks for commits.
+        """
+
+        self.database = os.path.abspath(database)
+        self.write_queue = write_queue
+        self.poll_interval = poll_interval
+
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix = "lostify-async-db")
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        self.version = 0
+        """Number of commits detected by the watcher (see `watch`)."""
+
+        self._watcher: asyncio.Task | None = None
+        self._ready: asyncio.Future | None = None
+        self._changed: asyncio.Event | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Each connection is used by one thread at a time, but is closed by
+        # `close` from the event loop's thread
+        db = sqlite3.connect(
+            pathlib.Path(self.database).as_uri() + "?mode=ro",
+            uri = True,
+            detect_types = sqlite3.PARSE_DECLTYPES,
+            check_same_thread = False
+        )
+
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA query_only = ON")
+
+        with self._connections_lock:
+            self._connections.append(db)
+
+        return db
+
+    def _call(self, fn: t.Callable[..., t.Any], args: tuple) -> t.Any:
+        """
+        Call `fn` with the connection of the current thread of the pool.
+        """
+
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+
+        try:
+            return fn(db, *args)
+        finally:
+            if db.in_transaction:
+                db.rollback()
+
+    async def run(self, fn: t.Callable[..., t.Any], *args: t.Any) -> t.Any:
+        """
+        Await `fn(db, *args)` run on a thread of the pool with a read-only
+        connection `db`.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call, fn, args
+        )
+
+    async def fetchone(self, sql: str, params: t.Sequence | t.Mapping = ()) -> sqlite3.Row | None:
+        return await self.run(lambda db: db.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: t.Sequence | t.Mapping = ()) -> list[sqlite3.Row]:
+        return await self.run(lambda db: db.execute(sql, params).fetchall())
+
+    async def write(self, mutation: t.Callable[..., t.Any], *args: t.Any) -> t.Any:
+        """
+        Await a mutation applied by the write queue (see `db.execute_write`).
+        """
+
+        if self.write_queue is None:
+            raise RuntimeError("AsyncDBPool has no write queue")
+
+        return await asyncio.wrap_future(self.write_queue.submit(mutation, *args))
+
+    async def watch(self) -> int:
+        """
+        Start the watcher of commits, if it is not running, and return the
+        current version: a counter of the commits it has detected.
+        """
+
+        if self._watcher is None or self._watcher.done():
+            loop = asyncio.get_running_loop()
+
+            self._changed = asyncio.Event()
+            self._ready = loop.create_future()
+            self._watcher = loop.create_task(self._watch())
+
+        await asyncio.shield(self._ready)
+
+        return self.version
+
+    async def changed(self, version: int, timeout: float) -> int:
+        """
+        Wait until a transaction is committed to the database after
+        `version` (returned by `watch` or a previous call). Return the new
+        version, or `version` if no commit happened within `timeout`
+        seconds.
+
+        Read the database only after `watch` returned, so that no commit
+        falls between the read and the version it is compared with.
+        """
+
+        if await self.watch() == version:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.version
+
+    async def _watch(self):
+        """
+        Body of the watcher task: count the changes of `PRAGMA data_version`
+        of a dedicated connection and wake every waiter of `changed`.
+        """
+
+        loop = asyncio.get_running_loop()
+        db = self._connect()
+
+        def data_version() -> int:
+            return db.execute("PRAGMA data_version").fetchone()[0]
+
+        try:
+            last = await loop.run_in_executor(self._executor, data_version)
+        except Exception as e:
+            self._ready.set_exception(e)
+            raise
+
+        self._ready.set_result(None)
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = await loop.run_in_executor(self._executor, data_version)
+
+            if current != last:
+                last = current
+                self.version += 1
+
+                # Waiters wake on the old event and wait on a new one
+                event, self._changed = self._changed, asyncio.Event()
+                event.set()
+
+    async def close(self):
+        """
+        Stop the watcher and close every connection of the pool.
+        """
+
+        if self._watcher is not None:
+            self._watcher.cancel()
+
+            try:
+                await self._watcher
+            except (asyncio.CancelledError, Exception):
+                pass
+
+        self._executor.shutdown(wait = True)
+
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+
+            self._connections.clear()
+
+ASGIApp = t.Callable[[dict, t.Callable, t.Callable], t.Awaitable[None]]
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """
+    Build the WSGI environment of an HTTP request from its ASGI scope and
+    its body, as `WsgiToAsgi` does.
+    """
+
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+
+        value = value.decode("latin-1")
+
+        if key.startswith("HTTP_") and key in environ:
+            value = f"{environ[key]},{value}"
+
+        environ[key] = value
+
+    return environ
+
+class LostifyASGI:
+    """
+    ASGI application dispatching native asynchronous routes and passing
+    every other request to `fallback` (the Flask app behind `WsgiToAsgi`).
+    """
+
+    def __init__(self, app: Flask, pool: AsyncDBPool, fallback: ASGIApp):
+        """
+        :param app:
+        The Flask app, whose request handling the native routes share.
+
+        :param pool:
+        Database pool of the native routes.
+
+        :param fallback:
+        ASGI application for every other request.
+        """
+
+        self.app = app
+        self.pool = pool
+        self.fallback = fallback
+
+        self.routes: list[tuple[str, re.Pattern, t.Callable]] = [
+            ("GET", re.compile(r"^/users/(?P<id>\d+)/stats/events$"), self.stats_events),
+        ]
+
+    async def __call__(self, scope: dict, receive: t.Callable, send: t.Callable):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+
+        if scope["type"] == "http":
+            for method, pattern, handler in self.routes:
+                match = pattern.match(scope["path"])
+
+                if match is not None and scope["method"] == method:
+                    return await handler(scope, receive, send, **match.groupdict())
+
+            view = self.email_view(scope)
+
+            if view is not None:
+                return await self.send_email_view(scope, receive, send, view)
+
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive: t.Callable, send: t.Callable):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.pool.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def email_view(self, scope: dict) -> t.Callable | None:
+        """
+        Return the view of the Flask app routed to by a request if it sends
+        an email (see `mailer.sends_email`), else `None`.
+        """
+
+        adapter = self.app.url_map.bind("localhost", scope.get("root_path") or "/")
+
+        try:
+            endpoint, _ = adapter.match(scope["path"], scope["method"])
+        except HTTPException:
+            return None
+
+        view = self.app.view_functions.get(endpoint)
+
+        return view if hasattr(view, "prepare") else None
+
+    async def read_body(self, receive: t.Callable) -> bytes | None:
+        """
+        Read the body of a request, up to one byte more than
+        `MAX_CONTENT_LENGTH` (so that the Flask app rejects it as too large).
+        Return `None` if the client disconnects.
+        """
+
+        limit = self.app.config["MAX_CONTENT_LENGTH"]
+        body = bytearray()
+
+        while True:
+            message = await receive()
+
+            if message["type"] == "http.disconnect":
+                return None
+
+            body += message.get("body", b"")
+
+            if limit is not None and len(body) > limit:
+                return bytes(body[:limit + 1])
+
+            if not message.get("more_body", False):
+                return bytes(body)
+
+    def environ(self, scope: dict, body: bytes) -> dict:
+        """
+        Build the WSGI environment of a request, passed through the
+        `ProxyFix` middleware of the app if it has one, as a request
+        through `app.wsgi_app` would be.
+        """
+
+        environ = wsgi_environ(scope, body)
+
+        if isinstance(self.app.wsgi_app, ProxyFix):
+            middleware = copy.copy(self.app.wsgi_app)
+            middleware.app = lambda environ, start_response: environ
+            environ = middleware(environ, None)
+
+        return environ
+
+    async def in_context(self, context: contextvars.Context, fn: t.Callable, *args: t.Any) -> t.Any:
+        """
+        Await `fn(*args)` run in a worker thread, in `context` (which holds
+        the request context of a native request across threads).
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, fn, *args)
+
+    def _dispatch(self, fn: t.Callable[[], t.Any]) -> t.Any:
+        """
+        Call `fn` in the current request context with the error handling
+        of `Flask.full_dispatch_request`, and return the finalised response,
+        or the `PendingSend` returned by `fn`.
+        """
+
+        try:
+            try:
+                rv = fn()
+            except Exception as e:
+                rv = self.app.handle_user_exception(e)
+
+            if isinstance(rv, mailer.PendingSend):
+                return rv
+
+            return self.app.finalize_request(rv)
+        except Exception as e:
+            return self.app.handle_exception(e)
+
+    def _begin(self, environ: dict, prepare: t.Callable[[], t.Any]) -> tuple[t.Any, t.Any]:
+        """
+        Open the request context of a native request and dispatch it to
+        `prepare`, after the `before_request` functions of the app. Return
+        the context and the response, or the `PendingSend` of `prepare`, in
+        which case the context stays open.
+        """
+
+        ctx = self.app.request_context(environ)
+        ctx.push()
+
+        rv = None
+
+        try:
+            rv = self._dispatch(lambda: self.app.preprocess_request() or prepare())
+        finally:
+            if isinstance(rv, mailer.PendingSend):
+                # Connections are bound to this thread, and `finish` runs
+                # in another one
+                close_db()
+            else:
+                ctx.pop(sys.exc_info()[1])
+
+        return ctx, rv
+
+    def _finish(self, ctx: t.Any, pending: mailer.PendingSend, error: Exception | None) -> Response:
+        """
+        Finish a native request whose email was sent (or failed to be sent,
+        with `error`), and close its request context.
+        """
+
+        def finish() -> t.Any:
+            if error is not None:
+                raise error
+
+            return pending.finish()
+
+        try:
+            return self._dispatch(finish)
+        finally:
+            ctx.pop(sys.exc_info()[1])
+
+    async def send_response(self, send: t.Callable, environ: dict, response: Response):
+        """
+        Send a response of the Flask app.
+        """
+
+        body, status, headers = response.get_wsgi_response(environ)
+
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+        })
+
+        try:
+            for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send_email_view(self, scope: dict, receive: t.Callable, send: t.Callable, view: t.Callable):
+        """
+        Serve a view that sends an email (see `mailer.sends_email`): the view
+        runs up to its `PendingSend` in a worker thread, the message is
+        awaited with `mailer.send_async` on the event loop, and `finish`
+        runs in a worker thread, in the same request context.
+        """
+
+        body = await self.read_body(receive)
+
+        if body is None:
+            return
+
+        environ = self.environ(scope, body)
+        context = contextvars.Context()
+
+        def prepare() -> t.Any:
+            return view.prepare(**request.view_args)
+
+        ctx, rv = await self.in_context(context, self._begin, environ, prepare)
+
+        if isinstance(rv, mailer.PendingSend):
+            error = None
+
+            try:
+                # In the request context, for the configuration of the app
+                await asyncio.get_running_loop().create_task(
+                    mailer.send_async(rv.message), context = context
+                )
+            except Exception as e:
+                error = e
+
+            rv = await self.in_context(context, self._finish, ctx, rv, error)
+
+        await self.send_response(send, environ, rv)
+
+    def _authorise(self, environ: dict) -> Response | None:
+        """
+        Run the `before_request` functions of the app for a native request
+        (loading the user from the session and applying rate limits), and
+        return the response of the request if it is refused.
+        """
+
+        with self.app.request_context(environ):
+            try:
+                rv = self.app.preprocess_request()
+
+                if rv is None and g.user_id is None:
+                    # HTTP 401: Unauthorized
+                    rv = ({
+                        "error": "Unauthorized",
+                        "message": "User not logged in"
+                    }, 401, {
+                        "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
+                    })
+            except Exception as e:
+                rv = self.app.handle_user_exception(e)
+
+            return None if rv is None else self._dispatch(lambda: rv)
+
+    async def respond(self, send: t.Callable, status: int, body: dict, headers: t.Iterable = ()):
+        """
+        Send a complete JSON response.
+        """
+
+        data = self.app.json.dumps(body).encode()
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(data)).encode()),
+                *headers
+            ]
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    async def stats_events(self, scope: dict, receive: t.Callable, send: t.Callable, id: str):
+        """
+        Stream the counters of a user as server-sent events: a `stats` event
+        on connection and after every change, and a comment line every
+        `SSE_HEARTBEAT` seconds to keep the connection open.
+        """
+
+        environ = self.environ(scope, b"")
+        refused = await self.in_context(contextvars.Context(), self._authorise, environ)
+
+        if refused is not None:
+            return await self.send_response(send, environ, refused)
+
+        query = (
+            "SELECT userid, posts, openPosts, closedPosts, claimed, pending FROM user_stats WHERE userid = ?",
+            (int(id),)
+        )
+        version = await self.pool.watch()
+        row = await self.pool.fetchone(*query)
+
+        if row is None:
+            # HTTP 404: Not Found
+            return await self.respond(send, 404, {
+                "error": "Not Found",
+                "message": "User not found"
+            })
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no")      # Disable buffering by nginx
+            ]
+        })
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        disconnect = asyncio.ensure_future(disconnected())
+        heartbeat = self.app.config["SSE_HEARTBEAT"]
+        last = None
+
+        try:
+            while not disconnect.done():
+                if tuple(row) != last:
+                    last = tuple(row)
+                    data = self.app.json.dumps(dict(row))
+
+                    await send({
+                        "type": "http.response.body",
+                        "body": f"event: stats\ndata: {data}\n\n".encode(),
+                        "more_body": True
+                    })
+
+                change = asyncio.ensure_future(self.pool.changed(version, heartbeat))
+                await asyncio.wait((disconnect, change), return_when = asyncio.FIRST_COMPLETED)
+
+                if disconnect.done():
+                    change.cancel()
+                    break
+
+                if change.result() != version:
+                    version = change.result()
+                    row = await self.pool.fetchone(*query)
+
+                    if row is None:
+                        break
+                else:
+                    await send({"type": "http.response.body", "body": b": heartbeat\n\n", "more_body": True})
+
+            # The stream ends when the client disconnects (or the user is deleted)
+            if not disconnect.done():
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnect.cancel()
+
+def create_asgi_app(app: Flask, fallback: ASGIApp | None = None) -> LostifyASGI:
+    """
+    Create the ASGI application of the Flask app `app`. Requires asgiref,
+    unless `fallback` is given.
+
+    Sets the default configuration `ASYNC_DB_POOL_SIZE`,
+    `ASYNC_POLL_INTERVAL` (seconds between checks for commits) and
+    `SSE_HEARTBEAT` (seconds between heartbeats of event streams).
+
+    :param app:
+    `Flask` instance returned by `create_app`.
+
+    :param fallback:
+    ASGI application for the routes without a native handler. Defaults to
+    `app` behind `WsgiToAsgi`.
+    """
+
+    if fallback is None:
+        if WsgiToAsgi is None:
+            raise RuntimeError("The ASGI deployment mode requires asgiref")
+
+        fallback = WsgiToAsgi(app)
+
+    app.config.setdefault('ASYNC_DB_POOL_SIZE', 8)
+    app.config.setdefault('ASYNC_POLL_INTERVAL', 0.5)     # Seconds
+    app.config.setdefault('SSE_HEARTBEAT', 15)            # Seconds
+
+    with app.app_context():
+        write_queue = get_write_queue()
+
+    pool = AsyncDBPool(
+        app.config['DATABASE'],
+        write_queue,
+        app.config['ASYNC_DB_POOL_SIZE'],
+        app.config['ASYNC_POLL_INTERVAL']
+    )
+
+    return LostifyASGI(app, pool, fallback)
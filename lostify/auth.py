@@ -3,9 +3,11 @@ from flask import (
 )
 
 from werkzeug.security import check_password_hash, generate_password_hash
-from .db import get_db
-from .otp_sender import send_otp
-from .password_sender import send_password
+from . import images
+from .db import execute_write, get_db
+from .formats import limit_body
+from .mailer import PendingSend, otp_message, password_message, sends_email
+from .ratelimit import limit_username
 
 from secrets import SystemRandom, token_urlsafe
 from datetime import datetime, timedelta
@@ -21,10 +23,14 @@ auth_bp = Blueprint("auth", __name__, url_prefix = '/auth')
 """Blueprint for authentication."""
 
 @auth_bp.route('/signup/get_otp', methods = ('POST',))
+@sends_email
+@limit_body(images.body_limit)
+@limit_username
 def get_otp():
     """
     Open a sign-in request and send an OTP to the user. Collects the user's
-    username, password, and profile details.
+    username, password, and profile details. The request is stored once
+    the OTP is sent (see `mailer.sends_email`).
     """
 
     if request.method == 'POST':
@@ -112,42 +118,44 @@ def get_otp():
         # Generate otp
         otp = SystemRandom().randrange(10000)
 
-        # Send otp
-        # If OTP sending fails, a RuntimeError is raised.
-        send_otp(otp, f"{username}@iitk.ac.in", profile["name"])
-
-        # Update database
-        db.execute(
-            "INSERT INTO awaitOTP(username, password, otp, created, profile) "
-                "VALUES (?, ?, ?, ?, ?) "
-                "ON CONFLICT DO UPDATE "
-                "SET otp = excluded.otp, "
-                "created = excluded.created, "
-                "profile = excluded.profile",
-            (
-                username,
-                generate_password_hash(password),
-                otp,
-                int(datetime.now().timestamp()),
-                json.dumps(
-                    request.json["profile"],
-                    ensure_ascii = False,
-                    separators = (',', ':')
+        def finish():
+            # Update database
+            db = get_db()
+            db.execute(
+                "INSERT INTO awaitOTP(username, password, otp, created, profile) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT DO UPDATE "
+                    "SET otp = excluded.otp, "
+                    "created = excluded.created, "
+                    "profile = excluded.profile",
+                (
+                    username,
+                    generate_password_hash(password),
+                    otp,
+                    int(datetime.now().timestamp()),
+                    json.dumps(
+                        request.json["profile"],
+                        ensure_ascii = False,
+                        separators = (',', ':')
+                    )
                 )
             )
-        )
 
-        # Commit changes
-        db.commit()
+            # Commit changes
+            db.commit()
 
-        # HTTP 201: Created
-        return ({
-            "message": "OTP sent",
-            "email": f"{username}@iitk.ac.in",
-            "username": username
-        }, 201, {
-            "Location": f"{url_for('auth.verify_otp')}"
-        })
+            # HTTP 201: Created
+            return ({
+                "message": "OTP sent",
+                "email": f"{username}@iitk.ac.in",
+                "username": username
+            }, 201, {
+                "Location": f"{url_for('auth.verify_otp')}"
+            })
+
+        # Send otp, then update the database
+        # If OTP sending fails, a RuntimeError is raised.
+        return PendingSend(otp_message(otp, f"{username}@iitk.ac.in", profile["name"]), finish)
 
     # # HTTP 405: Method Not Allowed
     # return ({
@@ -158,6 +166,7 @@ def get_otp():
     # })
 
 @auth_bp.route('/signup/verify_otp', methods = ('POST',))
+@limit_body('BODY_MAX_SIZE')
 def verify_otp():
     """
     Verify the OTP sent to the user and sign them up if the OTP is correct.
@@ -301,6 +310,8 @@ def verify_otp():
     # })
 
 @auth_bp.route('/login', methods = ('POST',))
+@limit_body('BODY_MAX_SIZE')
+@limit_username
 def login():
     """
     Authenticate the user. Sets a session cookie on successful login.
@@ -362,21 +373,16 @@ def login():
                     "Retry-After": int((LOGIN_COUNTER_RESET_DELAY - (datetime.now() - datetime.fromtimestamp(row["lastAttempt"]))).total_seconds())
                 })
             else:
-                # Reset counter
-                db.execute(
-                    "UPDATE users SET counter = 0 WHERE username = ?",
-                    (username,)
-                )
-                db.commit()
+                # Reset counter (written below, together with the outcome
+                # of this attempt)
                 counter = 0
 
         if not check_password_hash(row["password"], password):
             # Incorrect password; increment counter for failed attempts
-            db.execute(
-                "UPDATE users SET counter = ?, lastAttempt = ? WHERE username = ?",
-                (counter + 1, int(datetime.now().timestamp()), username)
+            execute_write(
+                _set_login_counter,
+                username, counter + 1, int(datetime.now().timestamp())
             )
-            db.commit()
 
             # HTTP 401: Unauthorized
             return ({
@@ -386,10 +392,9 @@ def login():
                 "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
             })
         
-        db.execute(
-            "UPDATE users SET counter = ? WHERE username = ?", (0, username)
-        )
-        db.commit()
+        if row["counter"] != 0:
+            # Reset counter after failed attempts
+            execute_write(_set_login_counter, username, 0)
 
         # If successful, set session cookie
         session.clear()
@@ -411,6 +416,23 @@ def login():
     #     "Allow": ["POST"]
     # }) 
 
+def _set_login_counter(db, username: str, counter: int, last_attempt: int | None = None):
+    """
+    Set the failed login counter of a user (and the time of the last failed
+    attempt, if given). Applied through `execute_write`.
+    """
+
+    if last_attempt is None:
+        db.execute(
+            "UPDATE users SET counter = ? WHERE username = ?",
+            (counter, username)
+        )
+    else:
+        db.execute(
+            "UPDATE users SET counter = ?, lastAttempt = ? WHERE username = ?",
+            (counter, last_attempt, username)
+        )
+
 # Called before every handling request dispatched to the app.
 @auth_bp.before_app_request
 def load_logged_in_user():
@@ -435,6 +457,7 @@ def logout():
     return ('', 205)
 
 @auth_bp.route('/change_password', methods = ('POST',))
+@limit_body('BODY_MAX_SIZE')
 def change_password():
     """
     Change the account password.
@@ -509,9 +532,13 @@ def change_password():
     # })
 
 @auth_bp.route('/reset_password', methods = ('POST',))
+@sends_email
+@limit_body('BODY_MAX_SIZE')
+@limit_username
 def reset_password():
     """
-    Reset the account password.
+    Reset the account password. The new password is stored once it is
+    sent (see `mailer.sends_email`).
     """
 
     if request.method == 'POST':
@@ -549,17 +576,19 @@ def reset_password():
         ).fetchone()[0]
         new_password = token_urlsafe(12)  # Generate a new password (16 chars)
 
-        send_password(new_password, f'{username}@iitk.ac.in', name)
+        def finish():
+            # Update database
+            db = get_db()
+            db.execute(
+                "UPDATE users SET password = ? WHERE id = ?",
+                (generate_password_hash(new_password), row[0])
+            )
+            db.commit()
 
-        # Update database
-        db.execute(
-            "UPDATE users SET password = ? WHERE id = ?",
-            (generate_password_hash(new_password), row[0])
-        )
-        db.commit()
+            # HTTP 204: No Content
+            return ('', 204)
 
-        # HTTP 204: No Content
-        return ('', 204)
+        return PendingSend(password_message(new_password, f'{username}@iitk.ac.in', name), finish)
         
     # # HTTP 405: Method Not Allowed
     # return ({
@@ -0,0 +1,561 @@
+"""
+*file: lostify/backup.py*
+
+------
+Online backup and restore of the database with the SQLite backup API
+(`sqlite3.Connection.backup`).
+
+The database is copied a few pages at a time, sleeping between steps, so
+that writers can make progress while a backup is taken. Every snapshot is
+checked with `PRAGMA integrity_check`, optionally compressed with gzip, and
+written with a `sha256sum`-compatible checksum file (`<snapshot>.sha256`)
+that is verified before a restore.
+
+The same mechanism refreshes the optional read replica used by
+`db.get_read_db`.
+
+Also registers the command-line commands `db backup`, `db verify`,
+`db restore` and `db refresh-replica`, and scheduled backup and replica
+refresh jobs (see `init_app`).
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import Flask, current_app
+
+from .migrate import db_cli
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover - not available on Windows
+    fcntl = None
+
+BACKUP_PAGES = 256
+"""Number of pages copied per step of a backup."""
+
+BACKUP_SLEEP = 0.05
+"""Time (in seconds) to sleep between steps of a backup."""
+
+BACKUP_MAX_RESTARTS = 3
+"""
+Number of times a stepped backup may restart (because another connection
+wrote to the database between two steps) before the rest is copied in a
+single step.
+"""
+
+class _Restarted(Exception):
+    pass
+
+def _copy(
+    src: sqlite3.Connection,
+    dst: sqlite3.Connection,
+    pages: int,
+    sleep: float,
+    progress: t.Callable[[int, int], t.Any] | None
+):
+    """
+    Copy `src` to `dst` with the backup API in steps of `pages` pages.
+
+    SQLite restarts a backup whenever another connection writes to the
+    source between two steps. Under a steady stream of writes a stepped
+    backup would never finish, so after `BACKUP_MAX_RESTARTS` restarts the
+    copy is completed in a single step instead.
+    """
+
+    state = {"remaining": None, "restarts": 0}
+
+    def step(status: int, remaining: int, total: int):
+        # Every step copies at least one page unless the backup restarted
+        if state["remaining"] is not None and remaining >= state["remaining"]:
+            state["restarts"] += 1
+
+            if state["restarts"] > BACKUP_MAX_RESTARTS:
+                raise _Restarted
+
+        state["remaining"] = remaining
+
+        if progress is not None:
+            progress(total - remaining, total)
+
+        if remaining:
+            # Release the database between steps
+            time.sleep(sleep)
+
+    try:
+        src.backup(dst, pages = pages, progress = step)
+    except _Restarted:
+        src.backup(dst)
+
+def checksum(path: str) -> str:
+    """
+    Return the SHA-256 digest of a file as a hexadecimal string.
+
+    :param path:
+    Path to the file.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def _integrity_check(path: str):
+    """
+    Raise a `RuntimeError` if the database at `path` is corrupt.
+    """
+
+    db = sqlite3.connect(path)
+
+    try:
+        result = db.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        db.close()
+
+    if result != "ok":
+        raise RuntimeError(f"Integrity check of {path} failed: {result}")
+
+def backup(
+    database: str,
+    dest: str,
+    compress: bool = False,
+    pages: int = BACKUP_PAGES,
+    sleep: float = BACKUP_SLEEP,
+    progress: t.Callable[[int, int], t.Any] | None = None
+) -> str:
+    """
+    Take a consistent snapshot of a live database. Return the checksum of
+    the snapshot, which is also written to `<dest>.sha256`.
+
+    The snapshot is written to a temporary file next to `dest` and renamed
+    once complete, so `dest` never holds a partial backup.
+
+    :param database:
+    Path to the database.
+
+    :param dest:
+    Path of the snapshot.
+
+    :param compress:
+    Whether to compress the snapshot with gzip.
+
+    :param pages:
+    Number of pages copied per step.
+
+    :param sleep:
+    Time (in seconds) to sleep between steps.
+
+    :param progress:
+    Callback receiving the number of pages copied and the total number of
+    pages after every step.
+    """
+
+    directory = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(directory, exist_ok = True)
+    fd, snapshot = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    os.close(fd)
+
+    try:
+        src = sqlite3.connect(database)
+        dst = sqlite3.connect(snapshot)
+
+        try:
+            _copy(src, dst, pages, sleep, progress)
+        finally:
+            dst.close()
+            src.close()
+
+        _integrity_check(snapshot)
+
+        if compress:
+            compressed = snapshot + ".gz"
+
+            with open(snapshot, "rb") as f_in, gzip.open(compressed, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+
+            os.replace(compressed, snapshot)
+
+        digest = checksum(snapshot)
+        os.replace(snapshot, dest)
+    except BaseException:
+        for path in (snapshot, snapshot + ".gz"):
+            if os.path.exists(path):
+                os.unlink(path)
+        raise
+
+    with open(dest + ".sha256", "w", encoding = "utf8") as f:
+        f.write(f"{digest}  {os.path.basename(dest)}\n")
+
+    return digest
+
+def verify(path: str):
+    """
+    Verify a snapshot against its checksum file and check its integrity.
+    Raises a `RuntimeError` if either check fails.
+
+    :param path:
+    Path to the snapshot.
+    """
+
+    try:
+        with open(path + ".sha256", encoding = "utf8") as f:
+            expected = f.read().split()[0]
+    except (OSError, IndexError) as e:
+        raise RuntimeError(f"Checksum file for {path} is missing or empty") from e
+
+    if checksum(path) != expected:
+        raise RuntimeError(f"Checksum mismatch for {path}")
+
+    with _uncompressed(path) as snapshot:
+        _integrity_check(snapshot)
+
+@contextmanager
+def _uncompressed(path: str) -> t.Iterator[str]:
+    """
+    Context manager yielding the path to an uncompressed copy of a snapshot
+    (the snapshot itself if it is not compressed).
+    """
+
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"     # gzip magic number
+
+    if not compressed:
+        yield path
+        return
+
+    fd, temp = tempfile.mkstemp(suffix = ".sqlite")
+
+    try:
+        with os.fdopen(fd, "wb") as f_out, gzip.open(path, "rb") as f_in:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+
+        yield temp
+    finally:
+        os.unlink(temp)
+
+def restore(
+    path: str,
+    database: str,
+    pages: int = BACKUP_PAGES,
+    sleep: float = BACKUP_SLEEP,
+    progress: t.Callable[[int, int], t.Any] | None = None
+):
+    """
+    Restore a verified snapshot into the database, replacing its contents.
+
+    :param path:
+    Path to the snapshot (compressed or not).
+
+    :param database:
+    Path to the database.
+
+    :param pages:
+    Number of pages copied per step.
+
+    :param sleep:
+    Time (in seconds) to sleep between steps.
+
+    :param progress:
+    Callback receiving the number of pages copied and the total number of
+    pages after every step.
+    """
+
+    verify(path)
+
+    with _uncompressed(path) as snapshot:
+        src = sqlite3.connect(snapshot)
+        dst = sqlite3.connect(database)
+
+        try:
+            versions = _data_versions(dst)
+            _copy(src, dst, pages, sleep, progress)
+
+            # The snapshot has older data versions than those cached by the
+            # workers (see cache.py), which would keep serving the cached
+            # responses until the versions caught up; they are moved past
+            # the versions before the restore instead
+            with dst:
+                dst.executemany(
+                    "UPDATE data_versions SET version = max(version, ?) + 1 WHERE name = ?",
+                    [(version, name) for name, version in versions.items()]
+                )
+        finally:
+            dst.close()
+            src.close()
+
+def _data_versions(db: sqlite3.Connection) -> dict[str, int]:
+    """
+    Return the data versions of a database by name (none if it has no
+    table `data_versions`).
+    """
+
+    try:
+        return dict(db.execute("SELECT name, version FROM data_versions").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+def refresh_replica(
+    database: str,
+    replica: str,
+    pages: int = BACKUP_PAGES,
+    sleep: float = BACKUP_SLEEP
+):
+    """
+    Refresh a read replica of the database (see `db.get_read_db`). The copy
+    is written next to the replica and renamed over it once complete, so
+    readers always see a consistent replica; connections to the previous
+    replica are reopened by `get_read_db`.
+
+    :param database:
+    Path to the database.
+
+    :param replica:
+    Path to the replica.
+
+    :param pages:
+    Number of pages copied per step.
+
+    :param sleep:
+    Time (in seconds) to sleep between steps.
+    """
+
+    directory = os.path.dirname(os.path.abspath(replica))
+    os.makedirs(directory, exist_ok = True)
+    fd, copy = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    os.close(fd)
+
+    try:
+        src = sqlite3.connect(database)
+        dst = sqlite3.connect(copy)
+
+        try:
+            _copy(src, dst, pages, sleep, None)
+        finally:
+            dst.close()
+            src.close()
+
+        os.replace(copy, replica)
+    except BaseException:
+        os.unlink(copy)
+        raise
+
+def _scheduled_replica_refresh(app: Flask):
+    """
+    Body of the replica refresh thread. Refreshes `READ_REPLICA` every
+    `READ_REPLICA_INTERVAL` seconds.
+    """
+
+    while True:
+        try:
+            refresh_replica(app.config["DATABASE"], app.config["READ_REPLICA"])
+        except Exception as e:
+            app.logger.exception("Replica refresh failed: %s", e)
+
+        time.sleep(app.config["READ_REPLICA_INTERVAL"])
+
+def _snapshot_name(app: Flask, compress: bool) -> str:
+    """
+    Return a timestamped path for a snapshot in `app.config['BACKUP_DIR']`.
+    """
+
+    name = os.path.splitext(os.path.basename(app.config["DATABASE"]))[0]
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    return os.path.join(
+        app.config["BACKUP_DIR"],
+        f"{name}-{stamp}.sqlite" + (".gz" if compress else "")
+    )
+
+def _snapshots(app: Flask) -> list[str]:
+    """
+    Return the paths of the snapshots of the database in `BACKUP_DIR`,
+    oldest first.
+    """
+
+    directory = app.config["BACKUP_DIR"]
+    name = os.path.splitext(os.path.basename(app.config["DATABASE"]))[0]
+
+    return [
+        os.path.join(directory, f) for f in sorted(os.listdir(directory))
+        if f.startswith(f"{name}-") and not f.endswith((".sha256", ".tmp"))
+    ]
+
+def _prune(app: Flask):
+    """
+    Delete all but the `BACKUP_KEEP` newest snapshots in `BACKUP_DIR`.
+    """
+
+    snapshots = _snapshots(app)
+
+    for path in snapshots[:max(len(snapshots) - app.config["BACKUP_KEEP"], 0)]:
+        for f in (path, path + ".sha256"):
+            if os.path.exists(f):
+                os.unlink(f)
+
+def _last_backup(app: Flask) -> float | None:
+    """
+    Return the time (Unix timestamp) at which the newest snapshot in
+    `BACKUP_DIR` was written, or `None` if there is none.
+    """
+
+    snapshots = _snapshots(app)
+
+    return max(map(os.path.getmtime, snapshots)) if snapshots else None
+
+def _backup_if_due(app: Flask) -> bool:
+    """
+    Take a compressed snapshot and prune old ones, unless another worker
+    process took one less than `BACKUP_INTERVAL` seconds ago. Return whether
+    a snapshot was taken.
+
+    The check and the snapshot are made under a lock file in `BACKUP_DIR`,
+    so a worker waiting for the lock sees the snapshot of the worker that
+    held it.
+    """
+
+    lock_path = os.path.join(app.config["BACKUP_DIR"], ".lock")
+
+    with open(lock_path, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        last = _last_backup(app)
+
+        if last is not None and time.time() - last < app.config["BACKUP_INTERVAL"]:
+            return False
+
+        backup(app.config["DATABASE"], _snapshot_name(app, True), compress = True)
+        _prune(app)
+
+        return True
+
+def _scheduled_backups(app: Flask):
+    """
+    Body of the scheduled backup thread. Takes a compressed snapshot every
+    `BACKUP_INTERVAL` seconds. Every worker process sleeps until the newest
+    snapshot (by any of them) is `BACKUP_INTERVAL` seconds old, and only the
+    first of them to take the lock takes the next one (see `_backup_if_due`).
+    """
+
+    os.makedirs(app.config["BACKUP_DIR"], exist_ok = True)
+
+    # Time of the last attempt of this worker, so that a failed snapshot is
+    # retried after an interval
+    attempted = time.time()
+
+    while True:
+        due = max(_last_backup(app) or 0, attempted) + app.config["BACKUP_INTERVAL"]
+        time.sleep(max(due - time.time(), 0))
+
+        try:
+            _backup_if_due(app)
+        except Exception as e:
+            app.logger.exception("Scheduled backup failed: %s", e)
+
+        attempted = time.time()
+
+def init_app(app: Flask):
+    """
+    Initialise backups for the app. Sets the default configuration and, if
+    `BACKUP_INTERVAL` (seconds) is set, starts the scheduled backup thread.
+    If both `READ_REPLICA` and `READ_REPLICA_INTERVAL` (seconds) are set,
+    also starts the thread refreshing the read replica.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("BACKUP_DIR", os.path.join(app.instance_path, "backups"))
+    app.config.setdefault("BACKUP_INTERVAL", None)
+    app.config.setdefault("BACKUP_KEEP", 7)     # Snapshots kept by the scheduled job
+    app.config.setdefault("READ_REPLICA_INTERVAL", None)
+
+    if app.config["BACKUP_KEEP"] < 1:
+        raise ValueError("BACKUP_KEEP must be at least 1")
+
+    if app.config["BACKUP_INTERVAL"] and not app.testing:
+        threading.Thread(
+            target = _scheduled_backups, args = (app,),
+            name = "lostify-backup", daemon = True
+        ).start()
+
+    if app.config.get("READ_REPLICA") and app.config["READ_REPLICA_INTERVAL"] and not app.testing:
+        threading.Thread(
+            target = _scheduled_replica_refresh, args = (app,),
+            name = "lostify-replica", daemon = True
+        ).start()
+
+def _echo_progress(copied: int, total: int):
+    click.echo(f"\rCopied {copied}/{total} pages", nl = False)
+
+@db_cli.command("backup")
+@click.argument("dest", required = False)
+@click.option("--gzip", "compress", is_flag = True, help = "Compress the snapshot with gzip.")
+@click.option("--pages", type = int, default = BACKUP_PAGES, show_default = True, help = "Pages copied per step.")
+@click.option("--sleep", type = float, default = BACKUP_SLEEP, show_default = True, help = "Seconds to sleep between steps.")
+def backup_command(dest: str | None, compress: bool, pages: int, sleep: float):
+    """
+    Take an online snapshot of the database (by default, in BACKUP_DIR).
+    """
+
+    if dest is None:
+        dest = _snapshot_name(current_app, compress)
+
+    digest = backup(current_app.config["DATABASE"], dest, compress, pages, sleep, _echo_progress)
+    click.echo(f"\nBacked up the database to {dest} (sha256 {digest}).")
+
+@db_cli.command("verify")
+@click.argument("path")
+def verify_command(path: str):
+    """
+    Verify the checksum and integrity of a snapshot.
+    """
+
+    try:
+        verify(path)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"{path}: OK")
+
+@db_cli.command("restore")
+@click.argument("path")
+@click.option("--pages", type = int, default = BACKUP_PAGES, show_default = True, help = "Pages copied per step.")
+@click.option("--sleep", type = float, default = BACKUP_SLEEP, show_default = True, help = "Seconds to sleep between steps.")
+@click.confirmation_option(prompt = "This replaces the contents of the database. Continue?")
+def restore_command(path: str, pages: int, sleep: float):
+    """
+    Restore the database from a verified snapshot.
+    """
+
+    try:
+        restore(path, current_app.config["DATABASE"], pages, sleep, _echo_progress)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"\nRestored the database from {path}.")
+
+@db_cli.command("refresh-replica")
+def refresh_replica_command():
+    """
+    Refresh the read replica (READ_REPLICA) from the database.
+    """
+
+    if not current_app.config.get("READ_REPLICA"):
+        raise click.ClickException("READ_REPLICA is not configured")
+
+    refresh_replica(current_app.config["DATABASE"], current_app.config["READ_REPLICA"])
+    click.echo(f"Refreshed the read replica at {current_app.config['READ_REPLICA']}.")
@@ -0,0 +1,229 @@
+"""
+*file: lostify/cache.py*
+
+------
+Cache of whole serialised responses whose body depends only on the request
+parameters and on a data version of the database, such as the feed of
+`/items/all`, which is the same for every user.
+
+Data versions are counters in the table `data_versions`, bumped by triggers
+on every change to the tables a cached body is built from (see migration
+`0005_data_versions.sql`). A cached body is served as long as the data
+version has not changed; since the counters are stored in the database,
+a commit by any worker process invalidates the entries of every process.
+
+On a miss, a single request per key builds the body while concurrent
+requests for the same key wait for it (single flight). Each entry also
+holds the compressed variants of its body (see `compression.py`), so a hot
+body is compressed once per content coding.
+
+The cache is bounded both by its number of entries (`RESPONSE_CACHE_SIZE`)
+and by the size of their bodies and compressed variants
+(`RESPONSE_CACHE_BYTES`), since a body with full images (such as the feed
+without `?image=url`) can be large.
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+import typing as t
+
+from flask import Flask, Response, current_app
+
+from .db import read_db_path
+from .formats import BINARY_FORMATS
+
+class CachedResponse(t.NamedTuple):
+    """
+    An entry of the cache.
+    """
+
+    version: int
+    """Data version the body was built from."""
+
+    body: bytes
+    """Serialised body."""
+
+    mimetype: str
+    """Mimetype of the body."""
+
+    compressed_variants: dict[str, bytes]
+    """Compressed bodies by content coding, filled on demand."""
+
+    @property
+    def size(self) -> int:
+        """Size in bytes of the body and of its compressed variants."""
+        return len(self.body) + sum(len(variant) for variant in list(self.compressed_variants.values()))
+
+def data_version(db: sqlite3.Connection, name: str) -> int:
+    """
+    Return the current data version `name` of the database (*e.g.*,
+    `'posts'`).
+
+    :param db:
+    Connection to the database.
+
+    :param name:
+    Name of the data version.
+    """
+
+    return db.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()[0]
+
+def database_key() -> tuple[str, int]:
+    """
+    Return the path and inode of the database for reads (see
+    `db.read_db_path`), which distinguish its data versions from those of
+    any other database, such as a replaced replica.
+    """
+
+    path = read_db_path()
+
+    return path, os.stat(path).st_ino
+
+class ResponseCache:
+    """
+    Least recently used cache of at most `max_entries` responses, of at
+    most `max_bytes` bytes in total (see `CachedResponse.size`). The size
+    is checked when an entry is added, so compressed variants added to the
+    entries since then may exceed it until the next one.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_entries:
+        Maximum number of entries kept; `0` disables the cache.
+
+        :param max_bytes:
+        Maximum total size of the entries kept, in bytes. Larger bodies are
+        not cached.
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        """Number of requests served from the cache."""
+
+        self.misses = 0
+        """Number of bodies built."""
+
+        self._entries: collections.OrderedDict[t.Hashable, CachedResponse] = collections.OrderedDict()
+        self._fills: dict[t.Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: t.Hashable,
+        version: int,
+        build: t.Callable[[], tuple[int, bytes, str]]
+    ) -> CachedResponse:
+        """
+        Return the entry `key` if it was built from data version `version`
+        or later, else build it with `build`. Only one caller builds a
+        missing entry at a time; the others wait for it.
+
+        :param key:
+        Key of the entry, covering every parameter of the body.
+
+        :param version:
+        Current data version.
+
+        :param build:
+        Callable returning the body and mimetype of a new entry, with the
+        data version it was built from (read in the same transaction).
+        """
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+
+                if entry is not None and entry.version >= version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+
+                event = self._fills.get(key)
+
+                if event is None:
+                    event = self._fills[key] = threading.Event()
+                    break
+
+            # Another request is building the entry. If it fails, the next
+            # waiter builds it instead.
+            event.wait()
+
+        try:
+            entry = CachedResponse(*build(), {})
+
+            with self._lock:
+                self.misses += 1
+
+                if self.max_entries > 0 and entry.size <= self.max_bytes:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+
+                    size = sum(cached.size for cached in self._entries.values())
+
+                    while len(self._entries) > self.max_entries or size > self.max_bytes:
+                        size -= self._entries.popitem(last = False)[1].size
+                else:
+                    # Outdated once a new one is built
+                    self._entries.pop(key, None)
+        finally:
+            with self._lock:
+                del self._fills[key]
+
+            event.set()
+
+        return entry
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+def get_cache() -> ResponseCache:
+    """
+    Return the response cache of the current app.
+    """
+
+    return current_app.extensions["response_cache"]
+
+def respond(entry: CachedResponse) -> Response:
+    """
+    Return a response with the body of a cache entry.
+
+    :param entry:
+    Entry of the cache.
+    """
+
+    response = current_app.response_class(entry.body, mimetype = entry.mimetype)
+
+    if BINARY_FORMATS:
+        response.vary.add("Accept")
+
+    # Shared by every response of the entry (see `compression.compress`)
+    response.compressed_variants = entry.compressed_variants
+
+    return response
+
+def init_app(app: Flask):
+    """
+    Initialise the response cache for the app. Sets the default
+    configuration and creates the cache.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("RESPONSE_CACHE_SIZE", 32)                   # Entries; 0 disables the cache
+    app.config.setdefault("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024)    # Bodies and their compressed variants
+
+    app.extensions["response_cache"] = ResponseCache(
+        app.config["RESPONSE_CACHE_SIZE"],
+        app.config["RESPONSE_CACHE_BYTES"]
+    )
@@ -0,0 +1,219 @@
+"""
+*file: lostify/compression.py*
+
+------
+Compression of response bodies, negotiated through the `Accept-Encoding`
+header of the request.
+
+gzip is always available. Zstandard (`zstd`, with
+[zstandard](https://pypi.org/project/zstandard/)) and Brotli (`br`, with
+[brotli](https://pypi.org/project/Brotli/)) are used when installed and are
+preferred over gzip when the client accepts them with equal quality.
+
+Only textual and structured bodies (`COMPRESS_MIMETYPES`) of at least
+`COMPRESS_MIN_SIZE` bytes are compressed; images and other
+already-compressed bodies are sent as-is.
+
+A response may carry a `dict` in its attribute `compressed_variants`,
+mapping content codings to compressed bodies. Variants found there are used
+instead of compressing again, and new variants are stored in it. A response
+cache that shares one such `dict` between the responses it serves therefore
+compresses each hot payload once per coding.
+
+Streamed bodies (whose size is not known in advance, such as a JSON object
+streamed from a BLOB by `formats.stream_json`) are compressed chunk by chunk
+as they are sent (`STREAM_CODECS`), whatever their size.
+"""
+
+import gzip
+import typing as t
+import zlib
+
+from flask import Flask, Response, current_app, request
+
+try:
+    import zstandard
+except ImportError:     # pragma: no cover - depends on the environment
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:     # pragma: no cover - depends on the environment
+    brotli = None
+
+CODECS: dict[str, t.Callable[[bytes], bytes]] = {}
+"""Available content codings by name, in order of server preference."""
+
+if zstandard is not None:
+    CODECS["zstd"] = lambda data: zstandard.ZstdCompressor(level = 3).compress(data)
+
+if brotli is not None:
+    CODECS["br"] = lambda data: brotli.compress(data, quality = 4)
+
+CODECS["gzip"] = lambda data: gzip.compress(data, compresslevel = 6, mtime = 0)
+
+def _zstd_stream() -> tuple[t.Callable[[bytes], bytes], t.Callable[[], bytes]]:
+    compressor = zstandard.ZstdCompressor(level = 3).compressobj()
+    return compressor.compress, compressor.flush
+
+def _brotli_stream() -> tuple[t.Callable[[bytes], bytes], t.Callable[[], bytes]]:
+    compressor = brotli.Compressor(quality = 4)
+    return compressor.process, compressor.finish
+
+def _gzip_stream() -> tuple[t.Callable[[bytes], bytes], t.Callable[[], bytes]]:
+    # A window of 31 bits writes the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+STREAM_CODECS: dict[str, t.Callable[[], tuple[t.Callable[[bytes], bytes], t.Callable[[], bytes]]]] = {}
+"""
+Incremental compressors of the content codings of `CODECS`, by name. Each
+returns a function compressing the next chunk and a function ending the
+stream.
+"""
+
+if zstandard is not None:
+    STREAM_CODECS["zstd"] = _zstd_stream
+
+if brotli is not None:
+    STREAM_CODECS["br"] = _brotli_stream
+
+STREAM_CODECS["gzip"] = _gzip_stream
+
+COMPRESS_MIMETYPES = frozenset((
+    "application/json",
+    "application/msgpack",
+    "application/x-msgpack",
+    "application/cbor",
+    "application/x-ndjson",
+    "text/plain",
+    "text/html",
+    "text/csv"
+))
+"""Default mimetypes of response bodies that are worth compressing."""
+
+def negotiate() -> str | None:
+    """
+    Return the content coding to use for the current request, or `None` if
+    the client does not accept any of the available codings.
+    """
+
+    return request.accept_encodings.best_match(list(CODECS))
+
+def compress(data: bytes, coding: str, variants: dict | None = None) -> bytes:
+    """
+    Compress `data` with the content coding `coding`.
+
+    :param data:
+    Body to be compressed.
+
+    :param coding:
+    Name of the content coding (a key of `CODECS`).
+
+    :param variants:
+    Optional cache of compressed variants of `data`, by content coding. The
+    compressed body is taken from it if present, and stored in it otherwise.
+    """
+
+    if variants is not None and coding in variants:
+        return variants[coding]
+
+    compressed = CODECS[coding](data)
+
+    if variants is not None:
+        variants[coding] = compressed
+
+    return compressed
+
+def compress_stream(chunks: t.Iterable[bytes], coding: str) -> t.Iterator[bytes]:
+    """
+    Compress a streamed body chunk by chunk with the content coding
+    `coding`. Chunks that the compressor buffers are not sent empty.
+
+    :param chunks:
+    Iterable of the body, in pieces.
+
+    :param coding:
+    Name of the content coding (a key of `STREAM_CODECS`).
+    """
+
+    compress, flush = STREAM_CODECS[coding]()
+
+    for chunk in chunks:
+        data = compress(chunk)
+
+        if data:
+            yield data
+
+    yield flush()
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress the body of `response` if it is eligible and the client accepts
+    a supported content coding. Registered as an `after_request` function.
+
+    :param response:
+    Response to the current request.
+    """
+
+    if (
+        not current_app.config["COMPRESS_ENABLED"]
+        or response.direct_passthrough
+        or response.mimetype not in current_app.config["COMPRESS_MIMETYPES"]
+        or "Content-Encoding" in response.headers
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+    ):
+        return response
+
+    # The body depends on Accept-Encoding from here on, even if the client
+    # does not accept a compressed body.
+    response.vary.add("Accept-Encoding")
+
+    if response.is_streamed:
+        coding = negotiate()
+
+        if coding is not None:
+            body = response.response
+            response.response = compress_stream(response.iter_encoded(), coding)
+            response.headers["Content-Encoding"] = coding
+            response.headers.pop("Content-Length", None)
+
+            # Closing the compressed stream does not close the original one
+            if hasattr(body, "close"):
+                response.call_on_close(body.close)
+
+        return response
+
+    data = response.get_data()
+
+    if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    coding = negotiate()
+
+    if coding is None:
+        return response
+
+    response.set_data(
+        compress(data, coding, getattr(response, "compressed_variants", None))
+    )
+    response.headers["Content-Encoding"] = coding
+
+    return response
+
+def init_app(app: Flask):
+    """
+    Initialise response compression for the app. Sets the default
+    configuration and registers `compress_response` as an `after_request`
+    function.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("COMPRESS_ENABLED", True)
+    app.config.setdefault("COMPRESS_MIN_SIZE", 1024)    # Bytes
+    app.config.setdefault("COMPRESS_MIMETYPES", COMPRESS_MIMETYPES)
+
+    app.after_request(compress_response)
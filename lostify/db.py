@@ -7,13 +7,92 @@ Functions for database retrieval for the current request (handled through
 
 Also registers the command-line command `init-db` to initialise
 the database using a SQLite3 schema (retrieved from the file `schema.sql`)
-for first-time use.
+for first-time use, and the command group `db` for schema migrations (see
+`migrate.py`).
+
+Connections cache up to `STATEMENT_CACHE_SIZE` compiled statements each.
+With `STATEMENT_CACHE_STATS`, they also count how many statements of each
+request were found in that cache (see `StatementCountingConnection`).
 """
 
+import collections
+import os
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+import typing as t
+from concurrent.futures import Future
 from datetime import datetime
 import click
-from flask import Flask, current_app, g
+from flask import Flask, Response, current_app, g, has_app_context
+
+STATEMENT_CACHE_SIZE = 256  # Compiled statements cached per connection (`sqlite3` caches 128 by default)
+
+class StatementCountingConnection(sqlite3.Connection):
+    """
+    Connection that counts the statements found in its statement cache.
+
+    `sqlite3` keeps the `cached_statements` most recently used compiled
+    statements of each connection, by their text, but does not report hits;
+    this connection mirrors that cache with the statements passed to
+    `execute` and `executemany`. The counts are kept in `hits` and `misses`,
+    and, within an app context, also in `g.statement_cache` (`[hits,
+    misses]`) for the current request.
+    """
+
+    def __init__(self, *args: t.Any, **kwargs: t.Any):
+        super().__init__(*args, **kwargs)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._capacity = kwargs.get("cached_statements", 128)
+        self._statements: collections.OrderedDict[str, None] = collections.OrderedDict()
+
+    def _count(self, sql: str):
+        """
+        Count a statement as a hit or a miss of the statement cache.
+        """
+
+        hit = sql in self._statements
+
+        if hit:
+            self.hits += 1
+            self._statements.move_to_end(sql)
+        else:
+            self.misses += 1
+            self._statements[sql] = None
+
+            if len(self._statements) > self._capacity:
+                self._statements.popitem(last = False)
+
+        if has_app_context():
+            counts = g.setdefault("statement_cache", [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def execute(self, sql: str, parameters: t.Any = (), /) -> sqlite3.Cursor:
+        self._count(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: t.Iterable, /) -> sqlite3.Cursor:
+        self._count(sql)
+        return super().executemany(sql, parameters)
+
+def _statement_cache_options(stats: bool) -> dict[str, t.Any]:
+    """
+    Arguments to `sqlite3.connect` for the statement cache of a connection.
+
+    :param stats:
+    Whether the connection counts statement cache hits (see
+    `StatementCountingConnection`), which costs some work per statement.
+    """
+
+    if stats:
+        return {"cached_statements": STATEMENT_CACHE_SIZE, "factory": StatementCountingConnection}
+
+    return {"cached_statements": STATEMENT_CACHE_SIZE}
 
 def get_db() -> sqlite3.Connection:
     """
@@ -33,7 +112,8 @@ def get_db() -> sqlite3.Connection:
         # Create a connection
         g.db = sqlite3.connect(
             current_app.config['DATABASE'],
-            detect_types = sqlite3.PARSE_DECLTYPES
+            detect_types = sqlite3.PARSE_DECLTYPES,
+            **_statement_cache_options(current_app.config['STATEMENT_CACHE_STATS'])
         )
 
         g.db.row_factory = sqlite3.Row
@@ -43,9 +123,308 @@ def get_db() -> sqlite3.Connection:
     # Return the connection to the database
     return g.db
 
+def read_db_path() -> str:
+    """
+    Absolute path of the database for reads: the replica at `READ_REPLICA`
+    if it exists, else `DATABASE`.
+    """
+
+    path = current_app.config.get('READ_REPLICA')
+    if not path or not os.path.exists(path):
+        path = current_app.config['DATABASE']
+
+    return os.path.abspath(path)
+
+def open_read_db(path: str | None = None, **kwargs: t.Any) -> sqlite3.Connection:
+    """
+    Open a new read-only connection (`mode=ro`, with `PRAGMA query_only`).
+    Statement cache hits are counted if `STATEMENT_CACHE_STATS` is set in
+    the current app, if any.
+
+    :param path:
+    Path to the database; `read_db_path()` by default.
+
+    :param kwargs:
+    Further arguments to `sqlite3.connect`.
+    """
+
+    kwargs = {
+        **_statement_cache_options(has_app_context() and current_app.config['STATEMENT_CACHE_STATS']),
+        **kwargs
+    }
+
+    db = sqlite3.connect(
+        pathlib.Path(path or read_db_path()).as_uri() + "?mode=ro",
+        uri = True,
+        detect_types = sqlite3.PARSE_DECLTYPES,
+        **kwargs
+    )
+
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA query_only = ON")
+
+    return db
+
+_read_connections = threading.local()
+"""Read-only connections of the current thread, reused across requests."""
+
+def get_read_db() -> sqlite3.Connection:
+    """
+    Get a read-only SQLite3 database connection object for handlers that do
+    not write to the database. The connection is opened in `mode=ro` with
+    `PRAGMA query_only` and a page cache of `READ_CACHE_SIZE` KiB, and is
+    also cached in `g.read_db`.
+
+    If `READ_REPLICA` is set to the path of an existing replica of the
+    database (see `backup.refresh_replica`), the replica is opened instead
+    of `DATABASE`, so that reads do not contend with writes to the primary.
+    Reads from a replica are only as recent as its last refresh.
+
+    Unlike `get_db`, the connection is not closed at the end of the request;
+    each thread keeps its connection (and its page cache) for later
+    requests, and reopens it when the database file is replaced.
+    """
+
+    if "read_db" not in g:
+        path = read_db_path()
+        key = (path, os.stat(path).st_ino)
+        cached = getattr(_read_connections, "connection", None)
+
+        if cached is None or cached[0] != key:
+            if cached is not None:
+                cached[1].close()
+
+            db = open_read_db(path)
+            db.execute(f"PRAGMA cache_size = -{int(current_app.config['READ_CACHE_SIZE'])}")
+
+            cached = _read_connections.connection = (key, db)
+
+        g.read_db = cached[1]
+
+    return g.read_db
+
+class WriteQueue:
+    """
+    Write-coalescing queue for small, frequent mutations of a database.
+
+    A single writer thread per process takes the queued mutations and
+    applies them in batches: every batch is one transaction holding up to
+    `max_batch` mutations, collected for at most `max_delay` seconds after
+    the first one. Each mutation runs in its own savepoint, so a failing
+    mutation is rolled back without affecting the rest of its batch. The
+    future returned by `submit` is resolved once the batch is committed.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        max_batch: int = 64,
+        max_delay: float = 0.005,
+        statement_stats: bool = False
+    ):
+        """
+        :param database:
+        Path to the database.
+
+        :param max_batch:
+        Maximum number of mutations per transaction.
+
+        :param max_delay:
+        Maximum time (in seconds) to wait for more mutations before
+        committing a batch.
+
+        :param statement_stats:
+        Whether to count the statement cache hits of the writer thread (see
+        `StatementCountingConnection`).
+        """
+
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.statement_stats = statement_stats
+
+        self.commits = 0
+        """Number of transactions committed by the writer thread."""
+
+        self.statement_cache: tuple[int, int] | None = None
+        """
+        Statement cache hits and misses of the writer thread as of its last
+        commit, if counted (`statement_stats`).
+        """
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+    def submit(self, mutation: t.Callable[..., t.Any], *args: t.Any) -> Future:
+        """
+        Queue a mutation. Return a future resolved with the return value of
+        the mutation (or the exception it raised) after its batch commits.
+
+        :param mutation:
+        Callable taking a `sqlite3.Connection` and `args`. It must not
+        commit or roll back.
+
+        :param args:
+        Further arguments to `mutation`.
+        """
+
+        self._start()
+
+        future = Future()
+        self._queue.put((mutation, args, future))
+
+        return future
+
+    def _start(self):
+        """
+        Start the writer thread if it is not running in this process (*e.g.*,
+        after a fork of a worker process).
+        """
+
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(
+                    target = self._run, name = "lostify-writer", daemon = True
+                )
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        """
+        Body of the writer thread.
+        """
+
+        db = sqlite3.connect(
+            self.database,
+            detect_types = sqlite3.PARSE_DECLTYPES,
+            isolation_level = None,     # Transactions are managed explicitly
+            **_statement_cache_options(self.statement_stats)
+        )
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys = ON")
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(self._queue.get(timeout = timeout))
+                except queue.Empty:
+                    break
+
+            self._apply(db, batch)
+
+    def _apply(self, db: sqlite3.Connection, batch: list):
+        """
+        Apply a batch of mutations in one transaction and resolve their
+        futures.
+        """
+
+        results = []
+
+        try:
+            db.execute("BEGIN IMMEDIATE")
+
+            for mutation, args, future in batch:
+                db.execute("SAVEPOINT mutation")
+
+                try:
+                    results.append((future, mutation(db, *args), None))
+                except Exception as e:
+                    db.execute("ROLLBACK TO mutation")
+                    results.append((future, None, e))
+
+                db.execute("RELEASE mutation")
+
+            db.execute("COMMIT")
+            self.commits += 1
+
+            if self.statement_stats:
+                self.statement_cache = (db.hits, db.misses)
+        except Exception as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+
+            for _, _, future in batch:
+                future.set_exception(e)
+
+            return
+
+        for future, result, exception in results:
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+_write_queues: dict[str, WriteQueue] = {}
+_write_queues_lock = threading.Lock()
+
+def get_write_queue() -> WriteQueue:
+    """
+    Get the `WriteQueue` of this process for `current_app.config['DATABASE']`,
+    configured by `WRITE_BATCH_SIZE`, `WRITE_BATCH_DELAY` and
+    `STATEMENT_CACHE_STATS`.
+    """
+
+    database = current_app.config['DATABASE']
+
+    with _write_queues_lock:
+        if database not in _write_queues:
+            _write_queues[database] = WriteQueue(
+                database,
+                current_app.config['WRITE_BATCH_SIZE'],
+                current_app.config['WRITE_BATCH_DELAY'],
+                current_app.config['STATEMENT_CACHE_STATS']
+            )
+
+        return _write_queues[database]
+
+def execute_write(mutation: t.Callable[..., t.Any], *args: t.Any) -> t.Any:
+    """
+    Apply a small mutation to the database and return its return value once
+    it is committed.
+
+    If `WRITE_BATCHING` is enabled, the mutation is coalesced with those of
+    concurrent requests by the `WriteQueue` of this process. Otherwise (the
+    synchronous fallback, *e.g.*, for tests), it is applied and committed
+    directly on `get_db()`.
+
+    The caller must not hold an open write transaction on `get_db()`.
+
+    :param mutation:
+    Callable taking a `sqlite3.Connection` and `args`. It must not commit
+    or roll back.
+
+    :param args:
+    Further arguments to `mutation`.
+    """
+
+    if current_app.config['WRITE_BATCHING']:
+        return get_write_queue().submit(mutation, *args).result(
+            timeout = current_app.config['WRITE_TIMEOUT']
+        )
+
+    db = get_db()
+
+    with db:
+        return mutation(db, *args)
+
 def close_db(e = None):
     """
     Close the SQLite3 database connection object at `g.db` if it exists.
+    The read-only connection at `g.read_db` is released but kept open for
+    reuse by the thread.
 
     :param e:
     Exception or `None`.
@@ -55,17 +434,62 @@ def close_db(e = None):
     if db is not None:
         db.close()
 
+    read_db = g.pop('read_db', None)
+    if read_db is not None and read_db.in_transaction:
+        read_db.rollback()
+
+def report_statement_cache(response: Response) -> Response:
+    """
+    If `STATEMENT_CACHE_STATS` is set, log the statement cache hits and
+    misses of the request (see `StatementCountingConnection`) at debug level
+    and report them in the header `X-Statement-Cache`.
+
+    :param response:
+    Response to the request.
+    """
+
+    hits, misses = g.get("statement_cache", (0, 0))
+
+    if hits or misses:
+        current_app.logger.debug("Statement cache: %d hit(s), %d miss(es)", hits, misses)
+
+    if current_app.config['STATEMENT_CACHE_STATS']:
+        response.headers["X-Statement-Cache"] = f"hits={hits}, misses={misses}"
+
+    return response
+
 def init_db():
     """
-    Initialise the database from the schema at `schema.sql`. For use by
-    the command `init-db`.
+    Initialise the database from the schema at `schema.sql` and apply all
+    migrations. Every existing table (with its indexes and triggers),
+    including those created by migrations, is dropped first. For use by the
+    command `init-db`.
     """
 
+    from . import migrate
+
     db = get_db()
 
+    tables = [
+        row[0] for row in db.execute(
+            "SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+
+    # Without foreign key checks, tables can be dropped in any order
+    db.executescript(
+        "PRAGMA foreign_keys = OFF;\n"
+        + "".join(f'DROP TABLE "{table}";\n' for table in tables)
+    )
+
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode("utf8"))
 
+    migrate.set_version(db, migrate.BASELINE_VERSION)
+    db.commit()
+
+    migrate.upgrade(db)
+
 @click.command('init-db')
 def init_db_command():
     """
@@ -86,14 +510,32 @@ def init_app(app: Flask):
     """
     Initialise the app. Performs the following:
 
+    - Sets the default configuration for read-only connections
+      (`READ_REPLICA`, `READ_CACHE_SIZE`) and write batching
+      (`WRITE_BATCHING`, `WRITE_BATCH_SIZE`, `WRITE_BATCH_DELAY`,
+      `WRITE_TIMEOUT`), and `STATEMENT_CACHE_STATS`.
+
     - Registers `close_db` as a teardown function for the application context
-      (`app.app_context()`).
+      (`app.app_context()`), and `report_statement_cache` to run after each
+      request.
 
-    - Adds the `init-db` command to `app.cli`.
+    - Adds the `init-db` command and the `db` command group to `app.cli`.
 
     :param app:
     `Flask` instance corresponding to the current Flask application.
     """
 
+    app.config.setdefault('READ_REPLICA', None)
+    app.config.setdefault('READ_CACHE_SIZE', 64 * 1024)    # KiB per read-only connection
+    app.config.setdefault('WRITE_BATCHING', True)
+    app.config.setdefault('WRITE_BATCH_SIZE', 64)           # Mutations per transaction
+    app.config.setdefault('WRITE_BATCH_DELAY', 0.005)       # Seconds
+    app.config.setdefault('WRITE_TIMEOUT', 10)              # Seconds
+    app.config.setdefault('STATEMENT_CACHE_STATS', False)   # Header `X-Statement-Cache`
+
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.after_request(report_statement_cache)
+    app.cli.add_command(init_db_command)
+
+    from .migrate import db_cli
+    app.cli.add_command(db_cli)
\ No newline at end of file
@@ -0,0 +1,756 @@
+"""
+*file: lostify/images.py*
+
+------
+Resized variants of the images of posts and profiles.
+
+Images are stored in the database as uploaded (base64 text). After a post
+or profile image is written, `schedule` decodes it once in a bounded pool
+of worker threads and writes a JPEG file per variant in `VARIANTS` (such as
+a 64-pixel thumbnail for list views) under `IMAGE_DIR`. The variants are
+served by `/items/<id>/image/<variant>` and `/users/<id>/image/<variant>`;
+`original` serves the stored image itself.
+
+Variant files are sent through the WSGI server's file wrapper (`sendfile`
+where supported); stored images are streamed from their BLOBs in chunks of
+`CHUNK_SIZE` and decoded from base64 on the fly (see `BlobReader`). Both
+support `HEAD`, conditional and `Range` requests. `PUT` on
+`/items/<id>/image` and `/users/<id>/image` stores a raw image from the
+request stream in chunks (see `store`).
+
+Decoding and resizing need [Pillow](https://pypi.org/project/pillow/).
+Without it, or while a variant is not generated yet, the original image is
+served in its place.
+
+Configuration:
+
+- `IMAGE_DIR`: directory of the variant files;
+- `IMAGE_WORKERS`: number of worker threads (`0` processes images on the
+  request thread, *e.g.*, for tests);
+- `IMAGE_QUEUE`: maximum number of images waiting for a worker. Images
+  scheduled while the queue is full are skipped, and their variants are
+  generated when first requested;
+- `IMAGE_MAX_SIZE`: maximum size of an uploaded image, in bytes.
+"""
+
+import base64
+import binascii
+import io
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+import typing as t
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, current_app, request, send_file
+from werkzeug.exceptions import BadRequest, RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+
+from .db import get_db, open_read_db, read_db_path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:     # pragma: no cover - depends on the environment
+    Image = None
+
+VARIANTS: dict[str, int] = {
+    "medium": 512,
+    "thumbnail": 64
+}
+"""Generated variants by name, as their maximum width and height in pixels."""
+
+CHUNK_SIZE = 64 * 1024             # Bytes per read of a stored image
+UPLOAD_CHUNK_SIZE = 48 * 1024      # Bytes of an uploaded image encoded at once (a multiple of 3)
+
+_lock = threading.Lock()
+_generations: dict[tuple[str, int], int] = {}      # Latest scheduled image of each owner
+_counter = itertools.count(1)
+_pool: tuple[int, ThreadPoolExecutor, threading.BoundedSemaphore] | None = None
+
+ARCHIVES: dict[str, str] = {
+    "posts": "posts_archive"
+}
+"""
+Archives of the tables whose rows are moved with their images and ids (see
+`archive.py`), by table. Images not found in a table are read from its
+archive.
+"""
+
+ENCODING_CACHE_SIZE = 1024
+"""Number of stored images whose encoding is remembered (see `BlobReader`)."""
+
+# Whether each version of a stored image is base64, by database, table,
+# rowid, version and size, least recently used first
+_encodings: OrderedDict[tuple[str, str, int, int, int], bool] = OrderedDict()
+
+def mimetype(data: bytes) -> str:
+    """
+    Guess the mimetype of an image from its first bytes.
+    """
+
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+
+    return "application/octet-stream"
+
+def render_variants(image: bytes | t.BinaryIO) -> dict[str, bytes]:
+    """
+    Decode an image once and encode every variant of `VARIANTS` as JPEG.
+    Images are never enlarged.
+
+    :param image:
+    Encoded image (any format supported by Pillow), or a binary file
+    holding it.
+    """
+
+    with Image.open(io.BytesIO(image) if isinstance(image, bytes) else image) as image:
+        # Lets the JPEG decoder skip detail that no variant needs
+        image.draft("RGB", (max(VARIANTS.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ("RGBA", "LA", "PA", "P"):
+            # Transparent areas become white
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask = image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+
+    variants = {}
+
+    # Largest first, so that each variant is resized from the previous one
+    for variant, size in sorted(VARIANTS.items(), key = lambda item: -item[1]):
+        image.thumbnail((size, size))
+
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality = 85, optimize = True)
+        variants[variant] = buffer.getvalue()
+
+    return variants
+
+def variant_path(kind: str, id: int, variant: str) -> str:
+    """
+    Path of the file of a variant of the image of a post or profile.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+
+    :param variant:
+    Name of the variant (a key of `VARIANTS`).
+    """
+
+    return os.path.join(current_app.config["IMAGE_DIR"], kind, f"{id}-{variant}.jpg")
+
+def _remove(paths: t.Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _process(app: Flask, key: tuple[str, int], generation: int, paths: dict[str, str], database: str):
+    """
+    Generate the variants of the stored image of `key` and write them to
+    `paths`, unless the image was replaced in the meantime (*i.e.*,
+    `generation` is outdated).
+    """
+
+    reader = open_original(*key, database)
+
+    if reader is None:
+        return
+
+    try:
+        with reader:
+            variants = render_variants(reader)
+    except Exception as e:
+        app.logger.warning("Failed to generate variants of %s %d: %s", *key, e)
+        return
+
+    os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok = True)
+
+    for variant, data in variants.items():
+        temporary = f"{paths[variant]}.{threading.get_ident()}.tmp"
+
+        with open(temporary, "wb") as f:
+            f.write(data)
+
+        with _lock:
+            if _generations.get(key) != generation:
+                os.remove(temporary)
+                return
+
+            # Readers see either no file or a complete one
+            os.replace(temporary, paths[variant])
+
+def _get_pool() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    """
+    Get the worker pool of this process, configured by `IMAGE_WORKERS` and
+    `IMAGE_QUEUE`.
+    """
+
+    global _pool
+
+    with _lock:
+        if _pool is None or _pool[0] != os.getpid():
+            _pool = (
+                os.getpid(),
+                ThreadPoolExecutor(current_app.config["IMAGE_WORKERS"], thread_name_prefix = "lostify-images"),
+                threading.BoundedSemaphore(current_app.config["IMAGE_QUEUE"])
+            )
+
+        return _pool[1:]
+
+def schedule(kind: str, id: int):
+    """
+    Replace the variants of the image of a post or profile after the image
+    (or the post) was written or deleted. The outdated variants are removed
+    at once; the new ones are generated from the stored image off the
+    request thread, unless `IMAGE_WORKERS` is `0`.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+    """
+
+    key = (kind, id)
+    paths = {variant: variant_path(kind, id, variant) for variant in VARIANTS}
+
+    with _lock:
+        generation = _generations[key] = next(_counter)
+        _remove(paths.values())
+
+    if Image is None:
+        return
+
+    app = current_app._get_current_object()
+
+    # Read from the primary, which a replica may not have caught up with
+    database = app.config["DATABASE"]
+
+    if not app.config["IMAGE_WORKERS"]:
+        _process(app, key, generation, paths, database)
+        return
+
+    pool, slots = _get_pool()
+
+    if not slots.acquire(blocking = False):
+        # Generated on the first request for a variant instead
+        app.logger.warning("Image queue full; skipped variants of %s %d", kind, id)
+
+        with _lock:
+            if _generations.get(key) == generation:
+                del _generations[key]
+
+        return
+
+    future = pool.submit(_process, app, key, generation, paths, database)
+    future.add_done_callback(lambda _: slots.release())
+
+def _is_base64(blob: sqlite3.Blob) -> bool:
+    """
+    Whether a BLOB is valid base64 (with padding only at the end), read in
+    chunks of `CHUNK_SIZE` bytes.
+    """
+
+    length = len(blob)
+
+    if length == 0 or length % 4:
+        return False
+
+    for offset in range(0, length, CHUNK_SIZE):
+        chunk = blob[offset:offset + CHUNK_SIZE]
+        last = offset + CHUNK_SIZE >= length
+
+        try:
+            if b"=" in (chunk[:-2] if last else chunk):
+                return False
+
+            base64.b64decode(chunk, validate = True)
+        except binascii.Error:
+            return False
+
+    return True
+
+class BlobReader(io.RawIOBase):
+    """
+    Seekable, read-only file over a stored image, read incrementally from
+    its BLOB (`sqlite3.Blob`) so that memory use is bounded by the size of
+    the reads. Images stored as valid base64 are decoded on the fly, and
+    offsets refer to the decoded bytes; any other image is read as-is.
+
+    Whether an image is valid base64 takes a pass over its BLOB, which is
+    made once per version of the image (see `ENCODING_CACHE_SIZE`); the
+    entity tag is made of the version and the size of the BLOB, so that
+    conditional, `HEAD` and `Range` requests read no more of the image
+    than they send.
+
+    The BLOB is opened for each read only, so that a slow client does not
+    hold a read lock on the database (which would block writers) while the
+    image is sent. A read fails with an `OSError` if the image was replaced
+    by one of another size in the meantime.
+
+    The reader owns its connection, and closes it when closed.
+    """
+
+    def __init__(self, db: sqlite3.Connection, table: str, rowid: int, version: int, database: str):
+        self._db = db
+        self._table = table
+        self._rowid = rowid
+        self._position = 0
+
+        with self._open() as blob:
+            length = self._length = len(blob)
+            key = (database, table, rowid, version, length)
+
+            with _lock:
+                encoded = _encodings.get(key)
+
+                if encoded is not None:
+                    _encodings.move_to_end(key)
+
+            if encoded is None:
+                encoded = _is_base64(blob)
+
+                with _lock:
+                    _encodings[key] = encoded
+
+                    if len(_encodings) > ENCODING_CACHE_SIZE:
+                        _encodings.popitem(last = False)
+
+            self.encoded = encoded
+            """Whether the stored image is base64-encoded."""
+
+            self.size = length // 4 * 3 - blob[-2:].count(b"=") if encoded else length
+            """Size of the image in bytes."""
+
+        self.etag = f"{version}-{length}"
+        """Entity tag of the stored image."""
+
+    def _open(self) -> sqlite3.Blob:
+        try:
+            blob = self._db.blobopen(self._table, "image", self._rowid, readonly = True)
+        except sqlite3.Error as e:
+            raise OSError(f"Image of {self._table} {self._rowid} is gone") from e
+
+        if hasattr(self, "_length") and len(blob) != self._length:
+            blob.close()
+            raise OSError(f"Image of {self._table} {self._rowid} changed while being read")
+
+        return blob
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+
+        self._position = max(offset, 0)
+
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        start = self._position
+        end = min(start + len(buffer), self.size)
+
+        if start >= end:
+            return 0
+
+        with self._open() as blob:
+            if self.encoded:
+                # Every 4 characters of base64 decode to 3 bytes
+                first = start // 3
+                data = base64.b64decode(blob[first * 4:-(-end // 3) * 4])
+                data = data[start - first * 3:end - first * 3]
+            else:
+                data = blob[start:end]
+
+        buffer[:len(data)] = data
+        self._position = end
+
+        return len(data)
+
+    def stored_chunks(self) -> t.Iterator[bytes]:
+        """
+        Iterate over the stored image as it is stored (*e.g.*, base64 text),
+        in chunks of `CHUNK_SIZE` bytes.
+        """
+
+        for offset in range(0, self._length, CHUNK_SIZE):
+            with self._open() as blob:
+                yield blob[offset:offset + CHUNK_SIZE]
+
+    def close(self):
+        if not self.closed:
+            self._db.close()
+
+        super().close()
+
+def open_original(kind: str, id: int, database: str | None = None) -> BlobReader | None:
+    """
+    Open the stored image of a post or profile for reading, or return `None`
+    if there is none. The reader has its own connection.
+
+    :param kind:
+    `'posts'` (including archived posts, see `ARCHIVES`),
+    `'posts_archive'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+
+    :param database:
+    Path to the database; `db.read_db_path()` by default.
+    """
+
+    database = database or read_db_path()
+
+    # Used by the WSGI server after the request, possibly on another thread
+    db = open_read_db(database, isolation_level = None, check_same_thread = False)
+
+    try:
+        # The version and the BLOB are read in one transaction, so that
+        # they belong to the same image
+        db.execute("BEGIN")
+
+        for table in (kind, ARCHIVES[kind]) if kind in ARCHIVES else (kind,):
+            # The ids of the tables are aliases of the rowid
+            row = db.execute(f"SELECT image IS NOT NULL, imageVersion FROM {table} WHERE rowid = ?", (id,)).fetchone()
+
+            if row is not None:
+                break
+
+        if row is None or not row[0]:
+            db.close()
+            return None
+
+        reader = BlobReader(db, table, id, row[1], database)
+        db.execute("COMMIT")
+
+        return reader
+    except OSError:
+        # Deleted since
+        db.close()
+        return None
+    except BaseException:
+        db.close()
+        raise
+
+def _encode(stream: t.BinaryIO, length: int) -> t.Iterator[bytes]:
+    """
+    Read `length` bytes from `stream` and encode them to base64, in chunks
+    of `UPLOAD_CHUNK_SIZE` bytes.
+
+    :raises BadRequest:
+    If the stream ends before `length` bytes.
+    """
+
+    remaining = length
+
+    while remaining:
+        chunk = stream.read(min(UPLOAD_CHUNK_SIZE, remaining))
+
+        if not chunk:
+            raise BadRequest(f"Image ended after {length - remaining} of {length} bytes")
+
+        # Multiples of 3 bytes encode to base64 without padding
+        while len(chunk) % 3 and len(chunk) < remaining:
+            more = stream.read(3 - len(chunk) % 3)
+
+            if not more:
+                break
+
+            chunk += more
+
+        remaining -= len(chunk)
+        yield base64.b64encode(chunk)
+
+def write_image(db: sqlite3.Connection, kind: str, id: int, file: t.BinaryIO, length: int) -> bool:
+    """
+    Write an image of `length` bytes read from `file` as the image of a post
+    or profile, base64-encoded like images sent in JSON bodies, within the
+    current transaction of `db` (which the caller commits). The image is
+    written in chunks into a BLOB allocated with `zeroblob`, through
+    `blobopen`. Return `False` if the post or profile does not exist.
+
+    `file` should be local (such as a spooled upload), since the write lock
+    is held while it is read.
+
+    :param db:
+    Connection to the database.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+
+    :param file:
+    Binary file holding the image.
+
+    :param length:
+    Size of the image in bytes.
+    """
+
+    # The ids of both tables are aliases of the rowid
+    if not db.execute(
+        f"UPDATE {kind} SET image = zeroblob(?) WHERE rowid = ?", (-(-length // 3) * 4, id)
+    ).rowcount:
+        return False
+
+    with db.blobopen(kind, "image", id) as blob:
+        for chunk in _encode(file, length):
+            blob.write(chunk)
+
+    return True
+
+def store(db: sqlite3.Connection, kind: str, id: int, stream: t.BinaryIO, length: int) -> bool:
+    """
+    Store an image of `length` bytes read from `stream` (such as
+    `request.stream`) as the image of a post or profile, and commit. Return
+    `False` if the post or profile does not exist.
+
+    The image is copied to a temporary file as it is read, and then written
+    by `write_image`; memory use is bounded by the chunk size, and the write
+    lock is not held while a slow client sends the image.
+
+    :param db:
+    Connection to the database, not in a transaction.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+
+    :param stream:
+    Stream of the image.
+
+    :param length:
+    Size of the image in bytes.
+
+    :raises BadRequest:
+    If the stream ends before `length` bytes.
+    """
+
+    with tempfile.TemporaryFile() as spool:
+        remaining = length
+
+        while remaining:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+
+            if not chunk:
+                raise BadRequest(f"Image ended after {length - remaining} of {length} bytes")
+
+            spool.write(chunk)
+            remaining -= len(chunk)
+
+        spool.seek(0)
+
+        with db:
+            return write_image(db, kind, id, spool, length)
+
+def body_limit() -> int:
+    """
+    Cap on the size of request bodies that may carry an image, either as
+    base64 text in JSON (a third larger than the image) or as a part of a
+    `multipart/form-data` body, besides the other fields. For use with
+    `formats.limit_body`.
+    """
+
+    return current_app.config["IMAGE_MAX_SIZE"] * 4 // 3 + current_app.config["BODY_MAX_SIZE"]
+
+def uploaded_file() -> tuple[t.BinaryIO, int] | None:
+    """
+    The file of the part `image` of a `multipart/form-data` request, and
+    its size, or `None`. Werkzeug spools the parts of such requests to
+    temporary files as they are parsed, so the file is local.
+    """
+
+    if request.mimetype != "multipart/form-data" or "image" not in request.files:
+        return None
+
+    file = request.files["image"].stream
+    size = file.seek(0, io.SEEK_END)
+    file.seek(0)
+
+    return file, size
+
+def upload(kind: str, id: int) -> tuple:
+    """
+    Store the body of the current request (the raw image, of any type) as
+    the image of a post or profile, and schedule its variants. Respond with
+    `204 No Content`, or an error. The size of the body is capped by
+    decorating the view with `formats.limit_body('IMAGE_MAX_SIZE')`.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+    """
+
+    if request.mimetype != "application/octet-stream" and not request.mimetype.startswith("image/"):
+        # HTTP 415: Unsupported Media Type
+        return ({
+            "error": "Unsupported Media Type",
+            "message": "Body must be an image"
+        }, 415)
+
+    length = request.content_length
+
+    if length is None:
+        # HTTP 411: Length Required
+        return ({
+            "error": "Length Required",
+            "message": "Content-Length is required"
+        }, 411)
+
+    if length == 0:
+        # HTTP 400: Bad Request
+        return ({
+            "error": "Bad Request",
+            "message": "Image is empty"
+        }, 400)
+
+    if not store(get_db(), kind, id, request.stream, length):
+        # HTTP 404: Not Found
+        return ({
+            "error": "Not Found",
+            "message": "Post not found" if kind == "posts" else "User not found"
+        }, 404)
+
+    schedule(kind, id)
+
+    # HTTP 204: No Content
+    return ('', 204)
+
+def send_original(reader: BlobReader) -> Response:
+    """
+    Respond with a stored image, streamed from `reader`. Supports
+    conditional and `Range` requests.
+    """
+
+    head = reader.read(16)
+    reader.seek(0)
+
+    response = current_app.response_class(
+        wrap_file(request.environ, reader, CHUNK_SIZE),
+        mimetype = mimetype(head),
+        direct_passthrough = True
+    )
+
+    response.content_length = reader.size
+    response.set_etag(reader.etag)
+    response.cache_control.no_cache = True
+
+    # Also when the body is not sent (HEAD, 304)
+    response.call_on_close(reader.close)
+
+    try:
+        # Handles If-None-Match, If-Range and Range (206, 416)
+        return response.make_conditional(request.environ, accept_ranges = True, complete_length = reader.size)
+    except RequestedRangeNotSatisfiable:
+        reader.close()
+        raise
+
+def send_variant(kind: str, id: int, variant: str) -> Response | tuple:
+    """
+    Respond with a variant of the image of a post or profile. The variant
+    file is served if it exists, through the WSGI server's file wrapper
+    (`sendfile` where supported). Otherwise the stored image is streamed
+    in its place, and the variants are scheduled for generation.
+
+    Both support `HEAD`, conditional and `Range` requests.
+
+    :param kind:
+    `'posts'` or `'profiles'`.
+
+    :param id:
+    Id of the post, or user id of the profile.
+
+    :param variant:
+    `'original'` or a key of `VARIANTS`.
+    """
+
+    if variant != "original" and variant not in VARIANTS:
+        # HTTP 404: Not Found
+        return ({
+            "error": "Not Found",
+            "message": f"Unknown image variant '{variant}'"
+        }, 404)
+
+    if variant in VARIANTS:
+        path = variant_path(kind, id, variant)
+
+        if os.path.exists(path):
+            # HTTP 200: OK
+            return send_file(path, mimetype = "image/jpeg", conditional = True, max_age = 0)
+
+    reader = open_original(kind, id)
+
+    if reader is None:
+        # HTTP 404: Not Found
+        return ({
+            "error": "Not Found",
+            "message": "Image not found"
+        }, 404)
+
+    if variant in VARIANTS and Image is not None and (kind, id) not in _generations:
+        # Not generated by this process yet (such as images stored before
+        # the variants existed); the variants are not retried for images
+        # that failed to decode
+        schedule(kind, id)
+
+    # HTTP 200: OK (or 206, 304, 416)
+    response = send_original(reader)
+
+    if variant in VARIANTS:
+        # The variant itself is served once generated
+        response.cache_control.no_store = True
+
+    return response
+
+def variant_urls(prefix: str) -> dict[str, str]:
+    """
+    URLs of every variant (and the original) of an image, given the URL of
+    its owner (such as `/items/1`).
+    """
+
+    return {variant: f"{prefix}/image/{variant}" for variant in ("original", *VARIANTS)}
+
+def init_app(app: Flask):
+    """
+    Initialise image variants for the app. Sets the default configuration.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("IMAGE_DIR", os.path.join(app.instance_path, "images"))
+    app.config.setdefault("IMAGE_WORKERS", 2)
+    app.config.setdefault("IMAGE_QUEUE", 64)
+    app.config.setdefault("IMAGE_MAX_SIZE", 10 * 1024 * 1024)      # Bytes per uploaded image
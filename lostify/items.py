@@ -1,14 +1,105 @@
 from flask import (
-    Blueprint, g, request, url_for
+    Blueprint, current_app, g, request, url_for
 )
 
 from datetime import datetime
+import typing as t
 
-from .db import get_db
+import click
+
+from . import cache, images, queries
+from .db import execute_write, get_db, get_read_db
+from .formats import limit_body, request_body, response_mimetype, stream_json
 
 items_bp = Blueprint('items', __name__, url_prefix='/items')
 
+BULK_POST_LIMIT = 500       # Default maximum number of posts per bulk request (config `BULK_POST_LIMIT`)
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def _validate_post(body: t.Any) -> tuple[tuple | None, str | None]:
+    """
+    Validate the body of a new post. Return the values of its fields, as
+    `(type, title, description, location1, location2, image, date)` with
+    the image encoded as `bytes`, and `None`; or `None` and an error message.
+    """
+
+    if not isinstance(body, dict):
+        return None, "Post must be an object"
+
+    try:
+        posttype    : int = body['type']
+        title       : str = body['title']
+        description : str = body.get('description')
+        location1   : str = body['location1']
+        location2   : str = body.get('location2')
+        image       : str = body.get('image')
+        date        : int = body['date']
+    except KeyError as e:
+        return None, f"Field '{e.args[0]}' is required"
+
+    error = None
+
+    if not title:
+        error = 'Item name is required.'
+    elif not location1 or isinstance(location1, str) and location1.isspace():
+        error = 'Location 1 is required.' 
+    elif posttype not in (0, 1):
+        error = 'Type must be either 0 or 1.'
+    elif (
+        type(title) is not str
+        or type(description) not in (str, type(None))
+        or type(image) not in (str, type(None))
+        or type(location1) is not str
+        or type(location2) not in (str, type(None))
+        or type(date) is not int
+    ):
+        error = "Type mismatch for JSON field(s) in POST request"
+
+    if error is not None:
+        return None, error
+
+    if image is not None:
+        image = bytes(image, 'utf-8')
+
+    return (posttype, title, description, location1, location2, image, date), None
+
+def location_key(name: str) -> str:
+    """
+    Return the key by which a location name is resolved: the name without
+    case and with runs of whitespace collapsed, so that, *e.g.*,
+    `"main  Library "` and `"Main library"` resolve to the same location.
+    """
+
+    return ' '.join(name.split()).casefold()
+
+def resolve_location(db, name: str) -> int:
+    """
+    Return the id of the location a name resolves to (see `location_key`),
+    adding a location of that name if the name is new. Call within the
+    transaction that stores the id.
+    """
+
+    key = location_key(name)
+    row = db.execute(queries.LOCATION_BY_ALIAS, (key,)).fetchone()
+
+    if row is not None:
+        return row[0]
+
+    name = ' '.join(name.split())
+
+    db.execute('INSERT INTO locations (name) VALUES (?) ON CONFLICT (name) DO NOTHING', (name,))
+
+    # Ignored if another request added the name first; its location is used
+    db.execute(
+        'INSERT OR IGNORE INTO location_aliases (alias, locationid) '
+            'SELECT ?, id FROM locations WHERE name = ?',
+        (key, name)
+    )
+
+    return db.execute(queries.LOCATION_BY_ALIAS, (key,)).fetchone()[0]
+
 @items_bp.route('/post', methods = ('POST',))
+@limit_body(images.body_limit)
 def post():
     """
     Create a new post.
@@ -24,38 +115,14 @@ def post():
         })
 
     if request.method == 'POST':
-        try:
-            posttype    : int = request.json['type']
-            title       : str = request.json['title']
-            description : str = request.json.get('description')
-            location1   : str = request.json['location1']
-            location2   : str = request.json.get('location2')
-            image       : str = request.json.get('image')
-            date        : int = request.json['date']
-        except KeyError as e:
-            # HTTP 400: Bad Request
-            return ({
-                "error": "Bad Request",
-                "message": f"Field '{e.args[0]}' is required"
-            }, 400)
+        # JSON, MessagePack or CBOR body, or multipart with the image as a file
+        body = request_body()
+        upload = images.uploaded_file()
 
-        error = None
-
-        if not title:
-            error = 'Item name is required.'
-        elif not location1:
-            error = 'Location 1 is required.' 
-        elif posttype not in (0, 1):
-            error = 'Type must be either 0 or 1.'
-        elif (
-            type(title) is not str
-            or type(description) not in (str, type(None))
-            or type(image) not in (str, type(None))
-            or type(location1) is not str
-            or type(location2) not in (str, type(None))
-            or type(date) is not int
-        ):
-            error = "Type mismatch for JSON field(s) in POST request"
+        values, error = _validate_post(body)
+
+        if error is None and upload is not None and values[5] is not None:
+            error = 'Image must be sent either as a field or as a file.'
 
         if error is not None:
             # HTTP 400: Bad Request
@@ -63,27 +130,22 @@ def post():
                 "error": "Bad Request",
                 "message": error
             }, 400)
-        
-        if image is not None:
-            image = bytes(image, 'utf-8')
-        
+
+        posttype, title, description, location1, location2, image, date = values
+
         db = get_db()
 
-        db.execute(
-            'INSERT INTO posts ('
-                'title,'
-                'creator,'
-                'date,'
-                'description,'
-                'image,'
-                'type,'
-                'location1,'
-                'location2'
-                ') VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (title, g.user_id, date, description, image, posttype, location1, location2)
-        )
-        db.commit()
+        db.execute(queries.INSERT_POST, values + (g.user_id, resolve_location(db, location1)))
         post_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+        if upload is not None:
+            # Streamed from the spooled part into the new row
+            images.write_image(db, 'posts', post_id, *upload)
+
+        db.commit()
+
+        if image is not None or upload is not None:
+            images.schedule('posts', post_id)
         
         # HTTP 201: Created
         return ({
@@ -101,9 +163,144 @@ def post():
     #     "Allow": ["POST"]
     # })
 
+def _bulk_body() -> list:
+    """
+    Decode the posts of a bulk request: an array in any format accepted by
+    `request_body`, or newline-delimited JSON (one post per line). Lines of
+    NDJSON that are not valid JSON are returned as `None`, which fails
+    validation as a row of its own.
+    """
+
+    if request.mimetype not in NDJSON_MIMETYPES:
+        return request_body()
+
+    posts = []
+
+    for line in request.get_data().splitlines():
+        if line.strip():
+            try:
+                posts.append(current_app.json.loads(line))
+            except ValueError:
+                posts.append(None)
+
+    return posts
+
+def _insert_posts(db, creator: int, rows: list[tuple]) -> list[int]:
+    """
+    Insert validated posts (see `_validate_post`) in one transaction and
+    return their ids, in order.
+    """
+
+    with db:
+        # Take the write lock first, so that no other connection inserts
+        # posts between ours
+        db.execute('BEGIN IMMEDIATE')
+
+        # Each distinct name is resolved once
+        locations = {}
+
+        for row in rows:
+            if row[3] not in locations:
+                locations[row[3]] = resolve_location(db, row[3])
+
+        db.executemany(
+            queries.INSERT_POST,
+            (row + (creator, locations[row[3]]) for row in rows)
+        )
+
+        # Ids of AUTOINCREMENT rows inserted in one transaction are
+        # consecutive, ending at the last one
+        last = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+    return list(range(last - len(rows) + 1, last + 1))
+
+@items_bp.route('/bulk', methods = ('POST',))
+def bulk():
+    """
+    Create many posts at once (admins only), from an array of posts or an
+    NDJSON stream. Every post is validated like those of `/items/post`; the
+    valid ones are inserted in one transaction. Respond with the ids of the
+    posts, in the order of the request (`null` for rejected posts), and the
+    errors of the rejected posts by index.
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
+        })
+
+    if g.user_role != 1:
+        # HTTP 403: Forbidden
+        return ({
+            "error": "Forbidden",
+            "message": "User is not authorised to create posts in bulk"
+        }, 403)
+
+    body = _bulk_body()
+    limit = current_app.config.get('BULK_POST_LIMIT', BULK_POST_LIMIT)
+
+    if not isinstance(body, list):
+        # HTTP 400: Bad Request
+        return ({
+            "error": "Bad Request",
+            "message": "Body must be an array or NDJSON stream of posts"
+        }, 400)
+
+    if len(body) > limit:
+        # HTTP 413: Content Too Large
+        # Keeps the write lock of the insert short
+        return ({
+            "error": "Content Too Large",
+            "message": f"At most {limit} posts per request"
+        }, 413)
+
+    rows = []
+    indices = []
+    errors = []
+
+    for index, post in enumerate(body):
+        values, error = _validate_post(post)
+
+        if error is None:
+            rows.append(values)
+            indices.append(index)
+        else:
+            errors.append({
+                "index": index,
+                "message": error
+            })
+
+    if not rows:
+        # HTTP 400: Bad Request
+        return ({
+            "error": "Bad Request",
+            "message": "No valid posts",
+            "errors": errors
+        }, 400)
+
+    ids = [None] * len(body)
+
+    for index, post_id, values in zip(indices, _insert_posts(get_db(), g.user_id, rows), rows):
+        ids[index] = post_id
+
+        if values[5] is not None:
+            images.schedule('posts', post_id)
+
+    # HTTP 201: Created
+    return ({
+        "message": f"{len(rows)} posts created",
+        "ids": ids,
+        "errors": errors
+    }, 201)
+
 def get(id: int):
     """
-    Retrieve a post by its ID.
+    Retrieve a post by its ID, from the archive if it was archived (see
+    `archive.py`).
     """
 
     if g.user_id is None:
@@ -115,22 +312,28 @@ def get(id: int):
             "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
         })
 
-    db = get_db()
-    row = db.execute(
-        "SELECT "
-            "title,"
-            "creator,"
-            "description,"
-            "date,"
-            "location1,"
-            "location2,"
-            "type,"
-            "closedBy,"
-            "closedDate,"
-            "image"
-            " FROM posts WHERE id = ?",
-        (id,)
-    ).fetchone()
+    db = get_read_db()
+
+    for table in ('posts', 'posts_archive'):
+        row = db.execute(
+            "SELECT "
+                "id,"
+                "title,"
+                "creator,"
+                "description,"
+                "date,"
+                "location1,"
+                "location2,"
+                "type,"
+                "closedBy,"
+                "closedDate,"
+                "image IS NOT NULL AS hasImage"
+                f" FROM {table} WHERE id = ?",
+            (id,)
+        ).fetchone()
+
+        if row is not None:
+            break
 
     if row is None:
         # HTTP 404: Not Found
@@ -139,20 +342,31 @@ def get(id: int):
             "message": f"Post not found"
         }, 404)
 
+    post = dict(row)
+    post['archived'] = table == 'posts_archive'
+    has_image = post.pop('hasImage')
+
+    # URLs of the resized variants of the image
+    post['images'] = images.variant_urls(url_for('.post_actions', id = id)) if has_image else None
+
+    if has_image and response_mimetype() == 'application/json':
+        reader = images.open_original(table, id)
+
+        if reader is not None:
+            # HTTP 200: OK
+            # The image is streamed from its BLOB in chunks
+            response = stream_json(post, 'image', reader.stored_chunks())
+            response.call_on_close(reader.close)
+
+            return response
+
+    # Binary formats send the image as raw bytes, decoded in full
+    image = db.execute(f"SELECT image FROM {table} WHERE id = ?", (id,)).fetchone() if has_image else None
+    post['image'] = image[0] if image is not None else None
+
     # HTTP 200: OK
-    return ({
-        'id': id,
-        'title': row['title'],
-        'location1': row['location1'],
-        'location2': row['location2'],
-        'date': row['date'],
-        'image': None if row['image'] is None else row['image'].decode('utf-8'),
-        'type': row['type'],
-        'creator': row['creator'],
-        'description': row['description'],
-        'closedBy': row['closedBy'],
-        'closedDate': row['closedDate']
-    }, 200)
+    # Image bytes are serialised by the app's JSON provider
+    return (post, 200)
 
 def put(id: int):
     """
@@ -169,9 +383,7 @@ def put(id: int):
         })
     
     db = get_db()
-    row = db.execute(
-        "SELECT creator FROM posts WHERE id = ?", (id,)
-    ).fetchone()
+    row = db.execute(queries.POST_CREATOR, (id,)).fetchone()
 
     if row is None:
         # HTTP 404: Not Found
@@ -187,20 +399,26 @@ def put(id: int):
             "message": "User is not creator of post"
         }, 403)
 
-    title: str = request.json.get('title')
-    description: str = request.json.get('description')
-    image: str = request.json.get('image')
-    location1: str = request.json.get('location1')
-    location2: str = request.json.get('location2')
-    date: int = request.json.get('date')
+    # JSON, MessagePack or CBOR body, or multipart with the image as a file
+    body = request_body()
+    upload = images.uploaded_file()
+
+    title: str = body.get('title')
+    description: str = body.get('description')
+    image: str = body.get('image')
+    location1: str = body.get('location1')
+    location2: str = body.get('location2')
+    date: int = body.get('date')
 
     error = None
 
-    if title is description is image is location1 is location2 is date is None:
+    if title is description is image is location1 is location2 is date is upload is None:
         error = 'No fields to update.'
+    elif image is not None and upload is not None:
+        error = 'Image must be sent either as a field or as a file.'
     elif not title and title is not None:
         error = 'Item name is required.'
-    elif not location1 and location1 is not None:
+    elif location1 is not None and (not location1 or isinstance(location1, str) and location1.isspace()):
         error = 'Location 1 is required.'
     elif (
         type(title) not in (str, type(None))
@@ -222,18 +440,27 @@ def put(id: int):
         if image is not None:
             image = bytes(image, 'utf-8')
 
-        db.execute(
-            ('UPDATE posts SET '
-            + ('title = ?,' if title is not None else '')
-            + ('description = ?,' if description is not None else '')
-            + ('image = ?,' if image is not None else '')
-            + ('location1 = ?,' if location1 is not None else '')
-            + ('location2 = ?,' if location2 is not None else '')
-            + ('date = ?,' if date is not None else ''))[:-1]
-            + ' WHERE id = ?',
-            tuple(x for x in (title, description, image, location1, location2, date, id) if x is not None)
-        )
+        if not title is description is image is location1 is location2 is date is None:
+            # Fields that are not sent (`None`) are kept
+            db.execute(queries.UPDATE_POST, (
+                title,
+                description,
+                image,
+                location1,
+                resolve_location(db, location1) if location1 is not None else None,
+                location2,
+                date,
+                id
+            ))
+
+        if upload is not None:
+            # Streamed from the spooled part into the row
+            images.write_image(db, 'posts', id, *upload)
+
         db.commit()
+
+        if image is not None or upload is not None:
+            images.schedule('posts', id)
         
         # HTTP 204: No Content
         return ('', 204)
@@ -253,9 +480,7 @@ def delete(id: int):
         })
     
     db = get_db()
-    row = db.execute(
-        "SELECT creator FROM posts WHERE id = ?", (id,)
-    ).fetchone()
+    row = db.execute(queries.POST_CREATOR, (id,)).fetchone()
 
     if row is None:
         # HTTP 404: Not Found
@@ -274,10 +499,13 @@ def delete(id: int):
     db.execute('DELETE FROM posts WHERE id = ?', (id,))
     db.commit()
 
+    images.schedule('posts', id)
+
     # HTTP 204: No Content
     return ('', 204)
 
 @items_bp.route('/<int:id>', methods = ('GET', 'PUT', 'DELETE'))
+@limit_body(images.body_limit)
 def post_actions(id: int):
     """
     Perform an action on a post, determined by the HTTP method.
@@ -298,6 +526,59 @@ def post_actions(id: int):
     #         "Allow": ["GET", "PUT", "DELETE"]
     #     })
 
+@items_bp.route('/<int:id>/image', methods = ('PUT',))
+@limit_body('IMAGE_MAX_SIZE')
+def put_image(id: int):
+    """
+    Replace the image of a post with the body of the request (the raw
+    image, streamed into the database).
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
+        })
+
+    row = get_db().execute(queries.POST_CREATOR, (id,)).fetchone()
+
+    if row is None:
+        # HTTP 404: Not Found
+        return ({
+            "error": "Not Found",
+            "message": "Post not found"
+        }, 404)
+
+    if g.user_id != row[0]:
+        # HTTP 403: Forbidden
+        return ({
+            "error": "Forbidden",
+            "message": "User is not creator of post"
+        }, 403)
+
+    return images.upload('posts', id)
+
+@items_bp.route('/<int:id>/image/<variant>', methods = ('GET',))
+def image(id: int, variant: str):
+    """
+    Retrieve the image of a post, also once archived: `original`, or a
+    resized variant (see `images.VARIANTS`).
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
+        })
+
+    return images.send_variant('posts', id, variant)
+
 @items_bp.route('/all', methods = ('GET',))
 def get_all():
     """
@@ -314,43 +595,99 @@ def get_all():
         })
     
     if request.method == 'GET':
-        db = get_db()
-        rows = db.execute(
-            "SELECT "
-                "id,"
-                "title,"
-                "creator,"
-                "description,"
-                "date,"
-                "location1,"
-                "location2,"
-                "type,"
-                "closedBy,"
-                "closedDate,"
-                "reportCount,"
-                "image"
-                " FROM posts"
-        ).fetchall()
+        # With `?image=url`, each image is replaced by the URL of its
+        # thumbnail (`thumbnail`), for list views
+        image = request.args.get('image', 'full')
+
+        if image not in ('full', 'url'):
+            # HTTP 400: Bad Request
+            return ({
+                "error": "Bad Request",
+                "message": "Parameter 'image' must be 'full' or 'url'"
+            }, 400)
+
+        # With `?location=`, only the posts at the location the name resolves
+        # to (see `location_key`), newest first; with `?type=`, only lost (0)
+        # or found (1) posts. Both are served by `idx_posts_location`.
+        location = request.args.get('location')
+        posttype = request.args.get('type')
+
+        if posttype not in (None, '0', '1'):
+            # HTTP 400: Bad Request
+            return ({
+                "error": "Bad Request",
+                "message": "Parameter 'type' must be 0 or 1"
+            }, 400)
+
+        if image == 'url':
+            column = "CASE WHEN image IS NULL THEN NULL ELSE ? || id || '/image/thumbnail' END AS thumbnail"
+            params = (f"{request.script_root}{items_bp.url_prefix}/",)
+        else:
+            column = "image"
+            params = ()
+
+        conditions = []
+        order = ""
+
+        if location is not None:
+            conditions.append(
+                "location1_id = (SELECT locationid FROM location_aliases WHERE alias = ?)"
+            )
+            params += (location_key(location),)
+            order = " ORDER BY date DESC"
+
+        if posttype is not None:
+            conditions.append("type = ?")
+            params += (int(posttype),)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        db = get_read_db()
+
+        def build() -> tuple[int, bytes, str]:
+            # The version and the rows are read in one transaction
+            db.execute("BEGIN")
+
+            try:
+                version = cache.data_version(db, 'posts')
+                rows = db.execute(
+                    "SELECT "
+                        "id,"
+                        "title,"
+                        "creator,"
+                        "description,"
+                        "date,"
+                        "location1,"
+                        "location2,"
+                        "type,"
+                        "closedBy,"
+                        "closedDate,"
+                        "reportCount,"
+                        f"{column}"
+                        f" FROM posts{where}{order}",
+                    params
+                ).fetchall()
+            finally:
+                db.commit()
+
+            # The rows are serialised by the app's JSON provider (see
+            # `formats._default`)
+            response = current_app.json.response({
+                'posts': rows
+            })
+
+            return version, response.get_data(), response.mimetype
+
+        # The feed is the same for every user: it is cached by its query
+        # and format, until the posts change
+        entry = cache.get_cache().get(
+            (cache.database_key(), response_mimetype(), column, where, order, params),
+            cache.data_version(db, 'posts'),
+            build
+        )
 
         # HTTP 200: OK
-        return ({
-            'posts': [
-                {
-                    'id': row['id'],
-                    'title': row['title'],
-                    'location1': row['location1'],
-                    'location2': row['location2'],
-                    'date': row['date'],
-                    'image': None if row['image'] is None else row['image'].decode('utf-8'),
-                    'type': row['type'],
-                    'creator': row['creator'],
-                    'description': row['description'],
-                    'closedBy': row['closedBy'],
-                    'closedDate': row['closedDate'],
-                    'reportCount': row['reportCount']
-                } for row in rows
-            ]
-        }, 200)
+        return cache.respond(entry)
 
     # # HTTP 405: Method Not Allowed
     # return ({
@@ -359,9 +696,69 @@ def get_all():
     # }, 405, {
     #     "Allow": ["GET"]
     # })
-        
+
+@items_bp.route('/locations', methods = ('GET',))
+def locations():
+    """
+    Retrieve the locations, by name, with the number of open posts at each
+    (`openPosts`, maintained as posts are added, closed and deleted).
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
+        })
+
+    rows = get_read_db().execute(
+        "SELECT id, name, openPosts FROM locations ORDER BY name"
+    ).fetchall()
+
+    # HTTP 200: OK
+    return ({
+        'locations': rows
+    }, 200)
+
+@items_bp.cli.command('alias')
+@click.argument('name')
+@click.argument('location')
+def alias_command(name: str, location: str):
+    """
+    Make NAME resolve to the location LOCATION. A different location that
+    NAME resolved to is merged into LOCATION, with its posts and names.
+    """
+
+    if not location_key(name) or not location_key(location):
+        raise click.BadParameter("Names must not be empty")
+
+    db = get_db()
+
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+
+        target = resolve_location(db, location)
+        row = db.execute(queries.LOCATION_BY_ALIAS, (location_key(name),)).fetchone()
+
+        if row is None:
+            db.execute(
+                'INSERT INTO location_aliases (alias, locationid) VALUES (?, ?)',
+                (location_key(name), target)
+            )
+        elif row[0] != target:
+            # The open post counters follow the posts through the triggers
+            db.execute('UPDATE posts SET location1_id = ? WHERE location1_id = ?', (target, row[0]))
+            db.execute('UPDATE posts_archive SET location1_id = ? WHERE location1_id = ?', (target, row[0]))
+            db.execute('UPDATE location_aliases SET locationid = ? WHERE locationid = ?', (target, row[0]))
+            db.execute('DELETE FROM locations WHERE id = ?', (row[0],))
+
+    click.echo(f"'{name}' resolves to location {target}.")
+
 # Claim an item (post) by searching its id or scrolling through the found section
 @items_bp.route('/<int:id>/claim', methods = ('POST',))
+@limit_body('BODY_MAX_SIZE')
 def claim(id: int):
     if g.user_id is None:
         # HTTP 401: Unauthorized
@@ -415,8 +812,8 @@ def claim(id: int):
                 
                 # Check if the other user has already claimed the post
                 if db.execute("SELECT 1 FROM confirmations WHERE postid = ? AND initid = ?", (id, otherid)).fetchone() is not None:
-                    db.execute("UPDATE posts SET closedBy = ?, closedDate = ? WHERE id = ?", (otherid, int(datetime.now().timestamp()), id))
-                    db.execute("DELETE FROM confirmations WHERE postid = ?", (id,))
+                    db.execute(queries.CLOSE_POST, (otherid, int(datetime.now().timestamp()), id))
+                    db.execute(queries.DELETE_CONFIRMATIONS, (id,))
                     db.commit()
 
                     # HTTP 200: OK
@@ -448,8 +845,8 @@ def claim(id: int):
                     "SELECT 1 FROM confirmations WHERE postid = ? AND otherid = ?",
                     (id, g.user_id)
                 ).fetchone() is not None:
-                    db.execute("UPDATE posts SET closedBy = ?, closedDate = ? WHERE id = ?", (g.user_id, int(datetime.now().timestamp()), id))
-                    db.execute("DELETE FROM confirmations WHERE postid = ?", (id,))
+                    db.execute(queries.CLOSE_POST, (g.user_id, int(datetime.now().timestamp()), id))
+                    db.execute(queries.DELETE_CONFIRMATIONS, (id,))
                     db.commit()
 
                     # HTTP 200: OK
@@ -483,6 +880,7 @@ def claim(id: int):
     # })
         
 @items_bp.route("/<int:id>/report", methods=('GET', 'PUT', 'DELETE'))
+@limit_body('BODY_MAX_SIZE')
 def report_post(id: int):
     """
     Report a post or undo it.
@@ -497,11 +895,9 @@ def report_post(id: int):
             "WWW-Authenticate": "Basic"     # Relevant only if the request was sent through Basic Auth
         })
     
-    conn = get_db()
-
     if request.method == 'GET':
         if g.user_role == 1:
-            row = conn.execute("SELECT reportCount FROM posts WHERE id = ?", (id,)).fetchone()
+            row = get_read_db().execute("SELECT reportCount FROM posts WHERE id = ?", (id,)).fetchone()
             if row is None:
                 # HTTP 404: Not Found
                 return ({
@@ -520,33 +916,19 @@ def report_post(id: int):
                 "message": "User is not authorised to view report count"
             }, 403)
 
-    # Check if the post exists
-    if conn.execute("SELECT 1 FROM posts WHERE id = ?", (id,)).fetchone() is None:
-        # HTTP 404: Not Found
-        return ({
-            "error": "Not Found",
-            "message": "Post not found"
-        }, 404)
+    if request.method in ('PUT', 'DELETE'):
+        # Applied through the write queue; returns `False` if the post
+        # does not exist
+        if not execute_write(
+            _add_report if request.method == 'PUT' else _remove_report,
+            id, g.user_id
+        ):
+            # HTTP 404: Not Found
+            return ({
+                "error": "Not Found",
+                "message": "Post not found"
+            }, 404)
 
-    if request.method == 'PUT':
-        if conn.execute("SELECT 1 FROM reports WHERE postid = ? AND userid = ?", (id, g.user_id)).fetchone() is None:
-            # Insert a new report
-            conn.execute("INSERT INTO reports (postid, userid) VALUES (?, ?)", (id, g.user_id))
-            # Update the report count
-            conn.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = ?", (id,))
-            conn.commit()
-        
-        # HTTP 204: No content
-        return ('', 204)
-    
-    if request.method == 'DELETE':
-        if conn.execute("SELECT 1 FROM reports WHERE postid = ? AND userid = ?", (id, g.user_id)).fetchone() is not None:
-            # Remove the report
-            conn.execute("DELETE FROM reports WHERE postid = ? AND userid = ?", (id, g.user_id))
-            # Update the report count
-            conn.execute("UPDATE posts SET reportCount = reportCount - 1 WHERE id = ?", (id,))
-            conn.commit()
-        
         # HTTP 204: No content
         return ('', 204)
     
@@ -557,3 +939,39 @@ def report_post(id: int):
     # }, 405, {
     #     "Allow": ["GET", "PUT", "DELETE"]
     # })
+
+def _add_report(db, postid: int, userid: int) -> bool:
+    """
+    Record a report of a post by a user, unless already reported. Return
+    `False` if the post does not exist.
+    """
+
+    if db.execute("SELECT 1 FROM posts WHERE id = ?", (postid,)).fetchone() is None:
+        return False
+
+    # Insert a new report; ignored if the user already reported the post
+    if db.execute(
+        "INSERT OR IGNORE INTO reports (postid, userid) VALUES (?, ?)", (postid, userid)
+    ).rowcount:
+        # Update the report count
+        db.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = ?", (postid,))
+
+    return True
+
+def _remove_report(db, postid: int, userid: int) -> bool:
+    """
+    Remove the report of a post by a user, if any. Return `False` if the
+    post does not exist.
+    """
+
+    if db.execute("SELECT 1 FROM posts WHERE id = ?", (postid,)).fetchone() is None:
+        return False
+
+    # Remove the report
+    if db.execute(
+        "DELETE FROM reports WHERE postid = ? AND userid = ?", (postid, userid)
+    ).rowcount:
+        # Update the report count
+        db.execute("UPDATE posts SET reportCount = reportCount - 1 WHERE id = ?", (postid,))
+
+    return True
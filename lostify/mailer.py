@@ -0,0 +1,337 @@
+"""
+*file: lostify/mailer.py*
+
+------
+Email sending through Azure Communication Services, for the OTPs of sign
+ups (`send_otp`) and password resets (`send_password`).
+
+The configuration (`AZURE_CONNECTION_STRING`, `AZURE_SENDER_EMAIL`, and
+`MAIL_CLIENT_OPTIONS`, keyword arguments of the `EmailClient`) is read from
+`current_app.config`. Every send of the process reuses one `EmailClient`,
+whose HTTP pipeline keeps its connections (and TLS sessions) alive between
+sends; it is replaced if the connection string changes. The SDK is
+imported on the first send, as it takes longer to import than the rest of
+the app.
+
+The messages are rendered from the Jinja templates in `templates/email`
+(see its `README.md`), compiled once by `TemplateRegistry` when the app is
+created. HTML templates are autoescaped.
+
+Views that send an email before they respond are decorated with
+`sends_email`: they return the message to send and the rest of their work
+as a `PendingSend`. Served through WSGI, the message is sent by `send` in
+the thread handling the request; the ASGI app (see `asgi.py`) instead
+awaits `send_async` on its event loop, which reuses one asynchronous client
+per event loop, so no thread waits on the email service.
+"""
+
+import functools
+import os
+import threading
+import typing as t
+import weakref
+
+import jinja2
+from flask import Flask, current_app
+
+POLLER_WAIT_TIME = 10   # seconds
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "templates", "email")
+"""Directory of the email templates (see its `README.md`)."""
+
+class Rendered(t.NamedTuple):
+    subject: str
+    plain_text: str
+    html: str
+
+class TemplateRegistry:
+    """
+    Compiled email templates: a plain-text (`<type>.txt`) and an HTML
+    (`<type>.html`) template per message type, in `path`.
+
+    The templates are compiled once (by `load`, or on first use) and kept;
+    the environment does not check the files for changes afterwards.
+    """
+
+    def __init__(self, path: str = TEMPLATES_PATH):
+        self.environment = jinja2.Environment(
+            loader = jinja2.FileSystemLoader(path),
+            autoescape = jinja2.select_autoescape(("html",), default_for_string = False),
+            auto_reload = False,
+            cache_size = -1     # Never evict a compiled template
+        )
+
+        self._types: dict[str, tuple[str, jinja2.Template, jinja2.Template]] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Compile the templates of every message type.
+        """
+
+        for name in self.environment.list_templates(extensions = ("txt",)):
+            if not name.startswith("base."):
+                self.get(name[:-len(".txt")])
+
+    def get(self, type: str) -> tuple[str, jinja2.Template, jinja2.Template]:
+        """
+        Get the subject and the compiled plain-text and HTML templates of a
+        message type.
+        """
+
+        if type not in self._types:
+            with self._lock:
+                if type not in self._types:
+                    text = self.environment.get_template(f"{type}.txt")
+                    html = self.environment.get_template(f"{type}.html")
+
+                    self._types[type] = (text.module.subject, text, html)
+
+        return self._types[type]
+
+    def render(self, type: str, **context: t.Any) -> Rendered:
+        """
+        Render a message of a type with the variables `context`.
+        """
+
+        subject, text, html = self.get(type)
+
+        return Rendered(subject, text.render(context), html.render(context))
+
+    def render_many(self, type: str, contexts: t.Iterable[dict]) -> t.Iterator[Rendered]:
+        """
+        Render a message of a type for each of `contexts` (*e.g.*, one per
+        recipient of a bulk send). The templates are looked up once for all
+        the messages.
+        """
+
+        subject, text, html = self.get(type)
+
+        for context in contexts:
+            yield Rendered(subject, text.render(context), html.render(context))
+
+templates = TemplateRegistry()
+"""The email templates of the app."""
+
+_client: tuple[str, t.Any] | None = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Get the `EmailClient` of this process for the connection string of the
+    current app, creating it on first use.
+    """
+
+    global _client
+
+    connection_string = current_app.config['AZURE_CONNECTION_STRING']
+
+    with _client_lock:
+        if _client is None or _client[0] != connection_string:
+            from azure.communication.email import EmailClient
+
+            _client = (connection_string, EmailClient.from_connection_string(
+                connection_string, **current_app.config['MAIL_CLIENT_OPTIONS']
+            ))
+
+        return _client[1]
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+def get_async_client():
+    """
+    Get the asynchronous `EmailClient` of the running event loop for the
+    connection string of the current app, creating it on first use.
+    """
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    connection_string = current_app.config['AZURE_CONNECTION_STRING']
+    cached = _async_clients.get(loop)
+
+    if cached is None or cached[0] != connection_string:
+        from azure.communication.email.aio import EmailClient
+
+        cached = _async_clients[loop] = (connection_string, EmailClient.from_connection_string(
+            connection_string, **current_app.config['MAIL_CLIENT_OPTIONS']
+        ))
+
+    return cached[1]
+
+def message(rendered: Rendered, email: str, recipient_display_name: str) -> dict:
+    """
+    Build the message of a send to a single recipient.
+    """
+
+    return {
+        "content": {
+            "subject": rendered.subject,
+            "plainText": rendered.plain_text,
+            "html": rendered.html
+        },
+        "recipients": {
+            "to": [
+                {
+                    "address": email,
+                    "displayName": recipient_display_name
+                }
+            ]
+        },
+        "senderAddress": current_app.config['AZURE_SENDER_EMAIL']
+    }
+
+def send(message: dict):
+    """
+    Send a message and wait until it is delivered to the email service.
+    Raises `TimeoutError` if it is not done within `6 * POLLER_WAIT_TIME`
+    seconds, or `RuntimeError` if the service reports a failure.
+    """
+
+    try:
+        poller = get_client().begin_send(message)
+
+        time_elapsed = 0
+        while not poller.done():
+            print("Email send poller status: " + poller.status())
+
+            poller.wait(POLLER_WAIT_TIME)
+            time_elapsed += POLLER_WAIT_TIME
+
+            if time_elapsed > 6 * POLLER_WAIT_TIME:
+                raise TimeoutError("Polling timed out.")
+
+        if poller.result()["status"] == "Succeeded":
+            print(f"Successfully sent the email (operation id: {poller.result()['id']})")
+        else:
+            raise RuntimeError(str(poller.result()["error"]))
+    except Exception as ex:
+        print('Exception: ')
+        print(ex)
+        raise ex
+
+async def send_async(message: dict):
+    """
+    Asynchronous transport of `send`: the send is awaited instead of
+    blocking a thread.
+    """
+
+    import asyncio
+
+    try:
+        poller = await get_async_client().begin_send(message)
+
+        try:
+            result = await asyncio.wait_for(poller.result(), 6 * POLLER_WAIT_TIME)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Polling timed out.")
+
+        if result["status"] == "Succeeded":
+            print(f"Successfully sent the email (operation id: {result['id']})")
+        else:
+            raise RuntimeError(str(result["error"]))
+    except Exception as ex:
+        print('Exception: ')
+        print(ex)
+        raise ex
+
+class PendingSend(t.NamedTuple):
+    """
+    Email to send before a view decorated with `sends_email` responds.
+    """
+
+    message: dict
+    """Message to send (see `message`)."""
+
+    finish: t.Callable[[], t.Any]
+    """Rest of the view, called once the message is sent, in the same
+    request context. Returns the response of the view."""
+
+def sends_email(view: t.Callable) -> t.Callable:
+    """
+    Decorator for views that send an email before they respond. The view
+    returns either a response or a `PendingSend`, whose message is sent by
+    `send` before its `finish` is called. A failed send raises, so `finish`
+    is not called.
+
+    The undecorated view is kept as `prepare`, for the native handler of
+    the ASGI app (see `asgi.py`), which sends the message with `send_async`.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        rv = view(*args, **kwargs)
+
+        if isinstance(rv, PendingSend):
+            send(rv.message)
+            return rv.finish()
+
+        return rv
+
+    wrapper.prepare = view
+
+    return wrapper
+
+def otp_message(otp: int, email: str, recipient_display_name: str) -> dict:
+    return message(
+        templates.render("otp", name = recipient_display_name, code = str(otp).zfill(4)),
+        email,
+        recipient_display_name
+    )
+
+def password_message(password: str, email: str, recipient_display_name: str) -> dict:
+    return message(
+        templates.render("password", name = recipient_display_name, password = password),
+        email,
+        recipient_display_name
+    )
+
+def send_many(type: str, recipients: t.Iterable[tuple[str, str, dict]]):
+    """
+    Send a message of a type to many recipients: every message is rendered
+    from the same compiled templates and submitted before waiting for the
+    first one to be delivered.
+
+    :param type:
+    Message type (see `TemplateRegistry`).
+
+    :param recipients:
+    `(email, recipient_display_name, context)` per recipient, where
+    `context` holds the variables of the templates (other than `name`).
+    """
+
+    recipients = list(recipients)
+    rendered = templates.render_many(
+        type, ({"name": name, **context} for _, name, context in recipients)
+    )
+
+    client = get_client()
+    pollers = [
+        client.begin_send(message(body, email, name))
+        for body, (email, name, _) in zip(rendered, recipients)
+    ]
+
+    for poller in pollers:
+        result = poller.result(6 * POLLER_WAIT_TIME)
+
+        if result is None or result["status"] != "Succeeded":
+            raise RuntimeError(f"Email send failed: {result}")
+
+def send_otp(otp: int, email: str, recipient_display_name: str):
+    send(otp_message(otp, email, recipient_display_name))
+
+def send_password(password: str, email: str, recipient_display_name: str):
+    send(password_message(password, email, recipient_display_name))
+
+def init_app(app: Flask):
+    """
+    Initialise the app: sets the default configuration of the email client
+    (`MAIL_CLIENT_OPTIONS`) and compiles the email templates.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault('MAIL_CLIENT_OPTIONS', {})
+
+    templates.load()
@@ -0,0 +1,309 @@
+"""
+*file: lostify/migrate.py*
+
+------
+Versioned schema migrations. The schema version of a database is tracked in
+its header with `PRAGMA user_version`.
+
+Version 1 (`BASELINE_VERSION`) is the schema in `schema.sql`. Every later
+version is a numbered file in the directory `migrations`, named
+`<version>_<description>.sql` or `<version>_<description>.py`, *e.g.*,
+`0002_user_stats.py`:
+
+- A `.sql` migration is executed as a script in a single transaction,
+  together with the update of the schema version.
+
+- A `.py` migration defines a function `upgrade(db: sqlite3.Connection)`,
+  which manages its own transactions. Long-running data changes should use
+  `backfill`, which updates rows in short batches so that the write lock is
+  released between them. A `.py` migration must therefore be safe to rerun
+  if it is interrupted.
+
+Also registers the command-line commands `db upgrade` and `db status`.
+"""
+
+import importlib.util
+import os
+import re
+import sqlite3
+import typing as t
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+BASELINE_VERSION = 1
+"""Schema version of a database created from `schema.sql`."""
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(__file__), "migrations")
+"""Directory of the migration files."""
+
+_MIGRATION_NAME = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+class Migration(t.NamedTuple):
+    """
+    A migration file.
+    """
+
+    version: int
+    """Schema version after applying the migration."""
+
+    name: str
+    """Description of the migration (taken from the file name)."""
+
+    path: str
+    """Path to the migration file."""
+
+def discover() -> list[Migration]:
+    """
+    Return the migrations in `MIGRATIONS_PATH`, sorted by version.
+
+    Raises a `RuntimeError` if two migrations have the same version or if a
+    version does not follow `BASELINE_VERSION`.
+    """
+
+    migrations = []
+
+    for filename in os.listdir(MIGRATIONS_PATH):
+        match = _MIGRATION_NAME.match(filename)
+        if match is not None:
+            migrations.append(Migration(
+                int(match[1]), match[2], os.path.join(MIGRATIONS_PATH, filename)
+            ))
+
+    migrations.sort()
+
+    for i, migration in enumerate(migrations):
+        if migration.version != BASELINE_VERSION + i + 1:
+            raise RuntimeError(
+                f"Migration {os.path.basename(migration.path)} is out of sequence"
+            )
+
+    return migrations
+
+def current_version(db: sqlite3.Connection) -> int:
+    """
+    Return the schema version of the database.
+
+    A database without a schema version that already has the tables of
+    `schema.sql` (*i.e.*, one created before schema versions were tracked)
+    is at `BASELINE_VERSION`.
+
+    :param db:
+    Connection to the database.
+    """
+
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+
+    if version == 0 and db.execute(
+        "SELECT 1 FROM sqlite_schema WHERE type = 'table' AND name = 'users'"
+    ).fetchone() is not None:
+        version = BASELINE_VERSION
+
+    return version
+
+def set_version(db: sqlite3.Connection, version: int):
+    """
+    Set the schema version of the database. Takes effect when the current
+    transaction, if any, is committed.
+
+    :param db:
+    Connection to the database.
+
+    :param version:
+    New schema version.
+    """
+
+    # PRAGMA arguments cannot be bound as parameters
+    db.execute(f"PRAGMA user_version = {int(version)}")
+
+def _apply(db: sqlite3.Connection, migration: Migration):
+    """
+    Apply a single migration and update the schema version.
+    """
+
+    if migration.path.endswith(".sql"):
+        with open(migration.path, encoding = "utf8") as f:
+            script = f.read()
+
+        try:
+            db.executescript(
+                "BEGIN IMMEDIATE;\n"
+                f"{script}\n;\n"
+                f"PRAGMA user_version = {migration.version};\n"
+                "COMMIT;"
+            )
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+    else:
+        spec = importlib.util.spec_from_file_location(
+            f"lostify.migrations.m{migration.version:04}", migration.path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        module.upgrade(db)
+
+        set_version(db, migration.version)
+        db.commit()
+
+def upgrade(
+    db: sqlite3.Connection,
+    target: int | None = None,
+    echo: t.Callable[[str], t.Any] = lambda message: None
+) -> int:
+    """
+    Apply all pending migrations up to the version `target` (the latest
+    version if `None`). Return the number of migrations applied.
+
+    An empty database is first initialised from `schema.sql`.
+
+    :param db:
+    Connection to the database.
+
+    :param target:
+    Schema version to upgrade to.
+
+    :param echo:
+    Callback for progress messages.
+    """
+
+    version = current_version(db)
+
+    if version == 0:
+        with current_app.open_resource("schema.sql") as f:
+            db.executescript(f.read().decode("utf8"))
+
+        set_version(db, BASELINE_VERSION)
+        db.commit()
+        version = BASELINE_VERSION
+        echo(f"Initialised schema version {BASELINE_VERSION} from schema.sql.")
+
+    applied = 0
+
+    for migration in discover():
+        if migration.version <= version:
+            continue
+        if target is not None and migration.version > target:
+            break
+
+        echo(f"Applying {os.path.basename(migration.path)} ...")
+        _apply(db, migration)
+        applied += 1
+
+    return applied
+
+def backfill(
+    db: sqlite3.Connection,
+    table: str,
+    assignments: str,
+    where: str,
+    params: t.Sequence = (),
+    batch_size: int = 1000
+) -> int:
+    """
+    Update the rows of a table in batches of at most `batch_size` rows, one
+    transaction per batch, so that writers are never locked out for long.
+    Return the number of rows updated.
+
+    The statement executed per batch is
+
+        UPDATE <table> SET <assignments>
+        WHERE rowid IN (SELECT rowid FROM <table> WHERE <where> LIMIT ?)
+
+    so `where` must no longer match a row once it has been updated
+    (*e.g.*, `newcol IS NULL`). The table must be a rowid table.
+
+    :param db:
+    Connection to the database.
+
+    :param table:
+    Name of the table.
+
+    :param assignments:
+    `SET` clause, *e.g.*, `"newcol = lower(oldcol)"`.
+
+    :param where:
+    Condition selecting the rows still to be updated.
+
+    :param params:
+    Parameters bound to the placeholders in `assignments` and `where`, in
+    that order.
+
+    :param batch_size:
+    Maximum number of rows updated per transaction.
+    """
+
+    total = 0
+
+    while True:
+        with db:
+            count = db.execute(
+                f"UPDATE {table} SET {assignments} "
+                    f"WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+                (*params, batch_size)
+            ).rowcount
+
+        total += count
+
+        if count < batch_size:
+            return total
+
+def add_column(db: sqlite3.Connection, table: str, column: str, definition: str):
+    """
+    Add a column to a table unless it already exists. Adding a column
+    only changes the table definition; existing rows are not rewritten.
+
+    :param db:
+    Connection to the database.
+
+    :param table:
+    Name of the table.
+
+    :param column:
+    Name of the new column.
+
+    :param definition:
+    Type and constraints of the new column, *e.g.*, `"INTEGER"`.
+    """
+
+    columns = [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+    if column not in columns:
+        with db:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+db_cli = AppGroup("db", help = "Manage the database schema.")
+"""Command group `db`."""
+
+@db_cli.command("upgrade")
+@click.option("--to", "target", type = int, default = None, help = "Schema version to upgrade to.")
+def upgrade_command(target: int | None):
+    """
+    Apply pending migrations to the database.
+    """
+
+    from .db import get_db
+
+    applied = upgrade(get_db(), target, click.echo)
+    click.echo(f"Applied {applied} migration(s); schema version {current_version(get_db())}.")
+
+@db_cli.command("status")
+def status_command():
+    """
+    Show the schema version and any pending migrations.
+    """
+
+    from .db import get_db
+
+    version = current_version(get_db())
+    migrations = discover()
+    latest = migrations[-1].version if migrations else BASELINE_VERSION
+
+    click.echo(f"Schema version: {version} (latest: {latest})")
+
+    for migration in migrations:
+        if migration.version > version:
+            click.echo(f"Pending: {os.path.basename(migration.path)}")
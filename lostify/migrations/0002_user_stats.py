@@ -0,0 +1,153 @@
+"""
+Per-user dashboard counters (`user_stats`), maintained by triggers on
+`users`, `posts` and `confirmations`, so that every write path (including
+bulk imports and cascading deletes) keeps them up to date.
+
+Existing users are backfilled in batches after the triggers are in place;
+a user whose counters were already created by a trigger is skipped.
+"""
+
+BATCH_SIZE = 500
+
+SCHEMA = """
+-- Dashboard counters of each user
+CREATE TABLE IF NOT EXISTS user_stats (
+    userid      INTEGER PRIMARY KEY,                -- The user id of the user in users table
+    posts       INTEGER NOT NULL DEFAULT 0,         -- Posts created by the user
+    openPosts   INTEGER NOT NULL DEFAULT 0,         -- Posts created by the user and not yet closed
+    closedPosts INTEGER NOT NULL DEFAULT 0,         -- Posts created by the user and closed
+    claimed     INTEGER NOT NULL DEFAULT 0,         -- Posts closed in favour of the user (closedBy)
+    pending     INTEGER NOT NULL DEFAULT 0,         -- Confirmations awaiting the user (otherid)
+    FOREIGN KEY (userid) REFERENCES users (id) ON DELETE CASCADE
+) STRICT;
+
+-- Supports the backfill below and lookups of a user's posts
+CREATE INDEX IF NOT EXISTS idx_posts_creator ON posts (creator);
+
+CREATE TRIGGER IF NOT EXISTS user_stats_users_insert AFTER INSERT ON users
+BEGIN
+    INSERT OR IGNORE INTO user_stats (userid) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_posts_insert AFTER INSERT ON posts
+BEGIN
+    UPDATE user_stats SET
+        posts = posts + 1,
+        openPosts = openPosts + (NEW.closedBy IS NULL),
+        closedPosts = closedPosts + (NEW.closedBy IS NOT NULL)
+    WHERE userid = NEW.creator;
+
+    UPDATE user_stats SET claimed = claimed + 1 WHERE userid = NEW.closedBy;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_posts_delete AFTER DELETE ON posts
+BEGIN
+    UPDATE user_stats SET
+        posts = posts - 1,
+        openPosts = openPosts - (OLD.closedBy IS NULL),
+        closedPosts = closedPosts - (OLD.closedBy IS NOT NULL)
+    WHERE userid = OLD.creator;
+
+    UPDATE user_stats SET claimed = claimed - 1 WHERE userid = OLD.closedBy;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_posts_update AFTER UPDATE OF creator, closedBy ON posts
+BEGIN
+    UPDATE user_stats SET
+        posts = posts - 1,
+        openPosts = openPosts - (OLD.closedBy IS NULL),
+        closedPosts = closedPosts - (OLD.closedBy IS NOT NULL)
+    WHERE userid = OLD.creator;
+
+    UPDATE user_stats SET
+        posts = posts + 1,
+        openPosts = openPosts + (NEW.closedBy IS NULL),
+        closedPosts = closedPosts + (NEW.closedBy IS NOT NULL)
+    WHERE userid = NEW.creator;
+
+    UPDATE user_stats SET claimed = claimed - 1 WHERE userid = OLD.closedBy;
+    UPDATE user_stats SET claimed = claimed + 1 WHERE userid = NEW.closedBy;
+END;
+
+-- Confirmations use ON CONFLICT REPLACE, which deletes the replaced row
+-- without firing delete triggers (recursive_triggers is off), so the
+-- replaced row is accounted for before the insert.
+CREATE TRIGGER IF NOT EXISTS user_stats_confirmations_replace BEFORE INSERT ON confirmations
+BEGIN
+    UPDATE user_stats SET pending = pending - 1
+    WHERE userid = (
+        SELECT otherid FROM confirmations
+        WHERE postid = NEW.postid AND initid = NEW.initid
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_confirmations_insert AFTER INSERT ON confirmations
+BEGIN
+    UPDATE user_stats SET pending = pending + 1 WHERE userid = NEW.otherid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_confirmations_delete AFTER DELETE ON confirmations
+BEGIN
+    UPDATE user_stats SET pending = pending - 1 WHERE userid = OLD.otherid;
+END;
+"""
+
+def upgrade(db):
+    db.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA}\nCOMMIT;")
+
+    # Backfill existing users in batches of consecutive ids, one transaction
+    # per batch. Each batch is counted with one range aggregate per counter
+    # rather than one lookup per user.
+    last = -1
+
+    while True:
+        with db:
+            # Count and insert in one write transaction, so that no change
+            # falls between the count and the insert
+            db.execute("BEGIN IMMEDIATE")
+
+            ids = [
+                row[0] for row in db.execute(
+                    "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (last, BATCH_SIZE)
+                )
+            ]
+
+            if not ids:
+                return
+
+            stats = {id: [0, 0, 0, 0, 0] for id in ids}
+            bounds = (ids[0], ids[-1])
+
+            for userid, *counts in db.execute(
+                "SELECT creator, count(*), sum(closedBy IS NULL), sum(closedBy IS NOT NULL) "
+                    "FROM posts WHERE creator BETWEEN ? AND ? GROUP BY creator",
+                bounds
+            ):
+                if userid in stats:
+                    stats[userid][0:3] = counts
+
+            for userid, count in db.execute(
+                "SELECT closedBy, count(*) FROM posts "
+                    "WHERE closedBy BETWEEN ? AND ? GROUP BY closedBy",
+                bounds
+            ):
+                if userid in stats:
+                    stats[userid][3] = count
+
+            for userid, count in db.execute(
+                "SELECT otherid, count(*) FROM confirmations "
+                    "WHERE otherid BETWEEN ? AND ? GROUP BY otherid",
+                bounds
+            ):
+                if userid in stats:
+                    stats[userid][4] = count
+
+            # Users whose counters a trigger created meanwhile are skipped
+            db.executemany(
+                "INSERT OR IGNORE INTO user_stats (userid, posts, openPosts, closedPosts, claimed, pending) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                ((userid, *counts) for userid, counts in stats.items())
+            )
+
+        last = ids[-1]
@@ -0,0 +1,6 @@
+-- Lookups of the confirmations addressed to or initiated by a user, which
+-- the primary key (postid, initid) cannot serve. The table is WITHOUT ROWID,
+-- so each index also carries (postid, initid) in order, which the inbox
+-- uses as its keyset.
+CREATE INDEX idx_confirmations_otherid ON confirmations (otherid);
+CREATE INDEX idx_confirmations_initid ON confirmations (initid);
@@ -0,0 +1,114 @@
+"""
+Normalised coarse locations (`locations`), with the names that resolve to
+them (`location_aliases`), and `posts.location1_id`, so that posts can be
+browsed by location through the index `idx_posts_location` instead of by
+comparing free text.
+
+The number of open posts at each location is maintained by triggers on
+`posts`. Existing posts are resolved in batches after the triggers are in
+place, so the backfill itself brings the counters up to date.
+"""
+
+from lostify.migrate import add_column, backfill
+
+TABLES = """
+-- Canonical coarse locations
+CREATE TABLE IF NOT EXISTS locations (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT UNIQUE NOT NULL,               -- Canonical name, as shown to users
+    openPosts   INTEGER NOT NULL DEFAULT 0          -- Posts at the location and not yet closed
+) STRICT;
+
+-- Names resolving to a location, by key (see `items.location_key`)
+CREATE TABLE IF NOT EXISTS location_aliases (
+    alias       TEXT PRIMARY KEY,                   -- Key of the name
+    locationid  INTEGER NOT NULL,                   -- Id of the location in locations table
+    FOREIGN KEY (locationid) REFERENCES locations (id) ON DELETE CASCADE
+) WITHOUT ROWID, STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_location_aliases_locationid ON location_aliases (locationid);
+"""
+
+SCHEMA = """
+-- Posts of a type at a location, by date
+CREATE INDEX IF NOT EXISTS idx_posts_location ON posts (location1_id, type, date);
+
+CREATE TRIGGER IF NOT EXISTS locations_posts_insert AFTER INSERT ON posts
+WHEN NEW.closedBy IS NULL
+BEGIN
+    UPDATE locations SET openPosts = openPosts + 1 WHERE id = NEW.location1_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS locations_posts_delete AFTER DELETE ON posts
+WHEN OLD.closedBy IS NULL
+BEGIN
+    UPDATE locations SET openPosts = openPosts - 1 WHERE id = OLD.location1_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS locations_posts_update AFTER UPDATE OF location1_id, closedBy ON posts
+BEGIN
+    UPDATE locations SET openPosts = openPosts - 1
+    WHERE id = OLD.location1_id AND OLD.closedBy IS NULL;
+
+    UPDATE locations SET openPosts = openPosts + 1
+    WHERE id = NEW.location1_id AND NEW.closedBy IS NULL;
+END;
+"""
+
+# The normalisation of names is copied from `items.location_key` and
+# `items.resolve_location` as they were when this migration was written, so
+# that later changes to them do not change what the migration does
+
+def _location_key(name: str) -> str:
+    return ' '.join(name.split()).casefold()
+
+def _resolve_location(db, name: str) -> int:
+    key = _location_key(name)
+    row = db.execute("SELECT locationid FROM location_aliases WHERE alias = ?", (key,)).fetchone()
+
+    if row is not None:
+        return row[0]
+
+    name = ' '.join(name.split())
+
+    db.execute("INSERT INTO locations (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
+    db.execute(
+        "INSERT OR IGNORE INTO location_aliases (alias, locationid) "
+            "SELECT ?, id FROM locations WHERE name = ?",
+        (key, name)
+    )
+
+    return db.execute("SELECT locationid FROM location_aliases WHERE alias = ?", (key,)).fetchone()[0]
+
+def upgrade(db):
+    db.executescript(f"BEGIN IMMEDIATE;\n{TABLES}\nCOMMIT;")
+    add_column(db, "posts", "location1_id", "INTEGER REFERENCES locations (id)")
+    db.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA}\nCOMMIT;")
+
+    # Resolve every distinct name once, then point the posts at their
+    # locations through a temporary map of the names
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS location_map (name TEXT PRIMARY KEY, locationid INTEGER NOT NULL)")
+
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+
+        names = [
+            row[0] for row in db.execute(
+                "SELECT DISTINCT location1 FROM posts WHERE location1_id IS NULL"
+            )
+        ]
+
+        db.executemany(
+            "INSERT OR REPLACE INTO location_map (name, locationid) VALUES (?, ?)",
+            [(name, _resolve_location(db, name)) for name in names if _location_key(name)]
+        )
+
+    # Only names in the map are matched, so that a post added meanwhile
+    # with a new name cannot keep a batch from completing
+    backfill(
+        db, "posts",
+        "location1_id = (SELECT locationid FROM temp.location_map WHERE name = location1)",
+        "location1_id IS NULL AND location1 IN (SELECT name FROM temp.location_map)"
+    )
+
+    db.execute("DROP TABLE temp.location_map")
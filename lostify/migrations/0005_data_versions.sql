@@ -0,0 +1,39 @@
+-- Data versions (see cache.py), bumped by triggers on every change to the
+-- tables that cached responses are built from. 'posts' covers the posts and
+-- the names their locations are found by.
+CREATE TABLE IF NOT EXISTS data_versions (
+    name        TEXT PRIMARY KEY,                   -- Name of the data version
+    version     INTEGER NOT NULL DEFAULT 0          -- Bumped on every change
+) WITHOUT ROWID, STRICT;
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('posts');
+
+CREATE TRIGGER IF NOT EXISTS data_versions_posts_insert AFTER INSERT ON posts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS data_versions_posts_update AFTER UPDATE ON posts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS data_versions_posts_delete AFTER DELETE ON posts
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS data_versions_location_aliases_insert AFTER INSERT ON location_aliases
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS data_versions_location_aliases_update AFTER UPDATE ON location_aliases
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS data_versions_location_aliases_delete AFTER DELETE ON location_aliases
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'posts';
+END;
@@ -0,0 +1,40 @@
+-- Posts moved out of posts by the archive job (see archive.py): closed
+-- posts and old posts, with their images. Ids are those of the posts,
+-- which AUTOINCREMENT never reuses.
+CREATE TABLE IF NOT EXISTS posts_archive (
+    id          INTEGER PRIMARY KEY,        -- Id of the post in posts
+    type        INTEGER NOT NULL,           -- 0 for lost, 1 for found
+    creator     INTEGER NOT NULL,           -- User id of the post creator
+    title       TEXT NOT NULL,              -- Post title
+    description TEXT,                       -- Post description
+    location1   TEXT NOT NULL,              -- Coarse location of find/loss
+    location1_id INTEGER,                   -- Id of the coarse location in locations table
+    location2   TEXT,                       -- Fine location of find/loss
+    image       BLOB,                       -- Image of post
+    date        INTEGER NOT NULL,           -- Date of loss/find
+    closedBy    INTEGER,                    -- User id of claimant
+    closedDate  INTEGER,                    -- Date of closing post
+    reportCount INTEGER NOT NULL DEFAULT 0, -- Count of reports
+    archived    INTEGER NOT NULL,           -- Time of archival (Unix timestamp)
+    FOREIGN KEY (creator) REFERENCES users (id),
+    FOREIGN KEY (closedBy) REFERENCES users (id)
+) STRICT;
+
+-- Selection of the posts due for archival
+CREATE INDEX IF NOT EXISTS idx_posts_date ON posts (date);
+CREATE INDEX IF NOT EXISTS idx_posts_closed ON posts (closedDate) WHERE closedBy IS NOT NULL;
+
+-- Archived posts still count towards the dashboard of their users
+DROP TRIGGER IF EXISTS user_stats_posts_delete;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_posts_delete AFTER DELETE ON posts
+WHEN NOT EXISTS (SELECT 1 FROM posts_archive WHERE id = OLD.id)
+BEGIN
+    UPDATE user_stats SET
+        posts = posts - 1,
+        openPosts = openPosts - (OLD.closedBy IS NULL),
+        closedPosts = closedPosts - (OLD.closedBy IS NOT NULL)
+    WHERE userid = OLD.creator;
+
+    UPDATE user_stats SET claimed = claimed - 1 WHERE userid = OLD.closedBy;
+END;
@@ -0,0 +1,7 @@
+-- Indexes on the child keys of foreign keys that had none. Without them,
+-- every update or delete of a user row looks for the rows that
+-- reference it by scanning these tables (found by tests/test_query_plans.py).
+CREATE INDEX idx_reports_userid ON reports (userid);
+CREATE INDEX idx_posts_closedby ON posts (closedBy);
+CREATE INDEX idx_posts_archive_creator ON posts_archive (creator);
+CREATE INDEX idx_posts_archive_closedby ON posts_archive (closedBy);
@@ -0,0 +1,24 @@
+-- Versions of the images of posts and profiles, bumped by triggers on every
+-- update that changes the image. The fixed partial updates of queries.py set
+-- every column, so the triggers compare the images instead of firing on any
+-- update of the column (an update reads the old row in full anyway). Stored
+-- images are served with an entity tag made of the version and the size, so
+-- that conditional and Range requests need not read the whole image (see
+-- images.BlobReader). Ids are never reused, and archived posts keep their
+-- version (see archive.ARCHIVE_COLUMNS), so a version is never seen twice
+-- for different images at the same URL.
+ALTER TABLE posts ADD COLUMN imageVersion INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts_archive ADD COLUMN imageVersion INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE profiles ADD COLUMN imageVersion INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER image_versions_posts_update AFTER UPDATE OF image ON posts
+WHEN OLD.image IS NOT NEW.image
+BEGIN
+    UPDATE posts SET imageVersion = imageVersion + 1 WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER image_versions_profiles_update AFTER UPDATE OF image ON profiles
+WHEN OLD.image IS NOT NEW.image
+BEGIN
+    UPDATE profiles SET imageVersion = imageVersion + 1 WHERE userid = NEW.userid;
+END;
@@ -0,0 +1,69 @@
+"""
+*file: lostify/queries.py*
+
+------
+Named SQL statements shared by the handlers.
+
+Every statement has one fixed text, whatever the request: `sqlite3` caches
+compiled statements per connection by their text (see
+`db.STATEMENT_CACHE_SIZE`), so a statement built from the fields present in
+a request would be compiled again for every combination of fields. Partial
+updates therefore set every column with `COALESCE(?, column)`, where `None`
+keeps the value of the column.
+
+Statements used by a single handler stay with it; the statements here are
+those used in several places, or whose text would otherwise vary.
+"""
+
+INSERT_POST = (
+    "INSERT INTO posts ("
+        "type,"
+        "title,"
+        "description,"
+        "location1,"
+        "location2,"
+        "image,"
+        "date,"
+        "creator,"
+        "location1_id"
+        ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+"""Insert a post: the values of `items._validate_post`, the creator and the location id."""
+
+POST_CREATOR = "SELECT creator FROM posts WHERE id = ?"
+"""Creator of a post."""
+
+UPDATE_POST = (
+    "UPDATE posts SET "
+        "title = COALESCE(?, title),"
+        "description = COALESCE(?, description),"
+        "image = COALESCE(?, image),"
+        "location1 = COALESCE(?, location1),"
+        "location1_id = COALESCE(?, location1_id),"
+        "location2 = COALESCE(?, location2),"
+        "date = COALESCE(?, date)"
+        " WHERE id = ?"
+)
+"""Update the fields of a post that are not `None`."""
+
+CLOSE_POST = "UPDATE posts SET closedBy = ?, closedDate = ? WHERE id = ?"
+"""Close a post in favour of a user."""
+
+DELETE_CONFIRMATIONS = "DELETE FROM confirmations WHERE postid = ?"
+"""Delete the confirmations of a post."""
+
+LOCATION_BY_ALIAS = "SELECT locationid FROM location_aliases WHERE alias = ?"
+"""Location a key of a name resolves to (see `items.location_key`)."""
+
+UPDATE_PROFILE = (
+    "UPDATE profiles SET "
+        "name = COALESCE(?, name),"
+        "phone = COALESCE(?, phone),"
+        "email = COALESCE(?, email),"
+        "address = COALESCE(?, address),"
+        "designation = COALESCE(?, designation),"
+        "roll = COALESCE(?, roll),"
+        "image = COALESCE(?, image)"
+        " WHERE userid = ?"
+)
+"""Update the fields of a profile that are not `None`."""
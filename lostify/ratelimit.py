@@ -0,0 +1,354 @@
+"""
+*file: lostify/ratelimit.py*
+
+------
+Rate limiting of requests with token buckets.
+
+Every request is charged one token from a bucket of its client: the
+logged-in user (`g.user_id`), or the client IP (`request.remote_addr`, as
+set by `ProxyFix`) for anonymous requests. Endpoints listed in `RATELIMITS`
+have buckets of their own, with their own budget; all other endpoints share
+a bucket with the budget `RATELIMIT_DEFAULT`. A budget `(requests, seconds)`
+allows bursts of up to `requests` requests, refilled at `requests` per
+`seconds` seconds.
+
+Since every client has its own buckets, a client polling in a tight loop
+only exhausts its own budget, and expensive endpoints (such as those
+sending email) stay available to everyone else. Rejected requests get
+HTTP 429 with `Retry-After`.
+
+Many users share an address behind the campus NAT, so the endpoints that
+act on an account named in the body (logging in, sending an OTP or a new
+password) have loose budgets per client, and are also charged to a bucket
+of the named account with a strict budget (`RATELIMITS_BY_USERNAME`, see
+`limit_username`).
+
+Buckets are kept in memory by each process (`MemoryStore`), or, if
+`RATELIMIT_STORAGE` is set to a path, in a SQLite database shared by the
+worker processes (`SQLiteStore`). A path on a memory-backed file system,
+*e.g.*, `/dev/shm/lostify-ratelimit.db`, keeps the shared buckets in
+shared memory.
+"""
+
+import collections
+import functools
+import math
+import sqlite3
+import threading
+import time
+import typing as t
+
+from flask import Flask, current_app, g, request
+
+class Limit(t.NamedTuple):
+    """
+    Budget of a bucket.
+    """
+
+    requests: int
+    """Size of the bucket: requests allowed in a burst."""
+
+    seconds: float
+    """Time (in seconds) to refill the bucket from empty."""
+
+    @property
+    def rate(self) -> float:
+        """Tokens added per second."""
+        return self.requests / self.seconds
+
+RATELIMIT_DEFAULT = Limit(300, 60)
+"""Default budget of the endpoints without a budget of their own."""
+
+RATELIMITS: dict[str, Limit | None] = {
+    "auth.get_otp": Limit(30, 600),         # Per address; see RATELIMITS_BY_USERNAME
+    "auth.reset_password": Limit(30, 600),  # Per address; see RATELIMITS_BY_USERNAME
+    "auth.verify_otp": Limit(10, 600),
+    "auth.login": Limit(200, 300),          # Per address; see RATELIMITS_BY_USERNAME
+    "items.get_all": Limit(30, 60),
+    "items.bulk": Limit(10, 60),
+    "static": None                          # Not limited
+}
+"""Default budgets of endpoints, by endpoint name (`None` for no limit)."""
+
+RATELIMITS_BY_USERNAME: dict[str, Limit] = {
+    "auth.get_otp": Limit(3, 600),          # Sends an email
+    "auth.reset_password": Limit(3, 600),   # Sends an email
+    "auth.login": Limit(20, 300)
+}
+"""
+Default budgets of the endpoints charged to the account named by the field
+`username` of their JSON body, by endpoint name (see `limit_username`).
+"""
+
+def _take(
+    state: tuple[float, float] | None,
+    limit: Limit,
+    now: float
+) -> tuple[tuple[float, float], float]:
+    """
+    Take a token from a bucket. Return the new state of the bucket and `0`
+    if a token was taken, or the time (in seconds) until one is available.
+
+    :param state:
+    Tokens in the bucket and time of its last update, or `None` for a full
+    bucket.
+
+    :param limit:
+    Budget of the bucket.
+
+    :param now:
+    Current time (Unix timestamp).
+    """
+
+    if state is None:
+        tokens = limit.requests
+    else:
+        tokens = min(limit.requests, state[0] + (now - state[1]) * limit.rate)
+
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+
+    return (tokens, now), (1 - tokens) / limit.rate
+
+def _full_at(state: tuple[float, float], limit: Limit) -> float:
+    """
+    Return the time at which a bucket is full again, after which it need
+    not be stored.
+    """
+
+    return state[1] + (limit.requests - state[0]) / limit.rate
+
+class MemoryStore:
+    """
+    Buckets in the memory of the process.
+
+    At most `max_keys` buckets are kept. When there are more, the buckets
+    that have refilled are dropped first, then the least recently used ones,
+    down to nine tenths of `max_keys`.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        """
+        :param max_keys:
+        Maximum number of buckets kept.
+        """
+
+        self.max_keys = max_keys
+
+        # Key -> (state, time at which the bucket is full), by last use
+        self._buckets: collections.OrderedDict[str, tuple[tuple[float, float], float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """
+        Take a token from the bucket `key`. Return `0` if a token was taken,
+        or the time (in seconds) until one is available.
+
+        :param key:
+        Key of the bucket.
+
+        :param limit:
+        Budget of the bucket.
+
+        :param now:
+        Current time (Unix timestamp).
+        """
+
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            state, wait = _take(bucket[0] if bucket is not None else None, limit, now)
+
+            self._buckets[key] = (state, _full_at(state, limit))
+
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+
+        return wait
+
+    def _prune(self, now: float):
+        for key in [key for key, (_, full) in self._buckets.items() if full <= now]:
+            del self._buckets[key]
+
+        # Leaves room for new buckets before the next pruning
+        while len(self._buckets) > self.max_keys * 9 // 10:
+            self._buckets.popitem(last = False)
+
+class SQLiteStore:
+    """
+    Buckets in a SQLite database, shared by every process that opens it.
+    Each take is one short write transaction. Buckets that have refilled
+    are deleted every `prune_interval` takes.
+    """
+
+    def __init__(self, path: str, prune_interval: int = 1000):
+        """
+        :param path:
+        Path to the database, created if it does not exist.
+
+        :param prune_interval:
+        Number of takes (per process) between deletions of refilled buckets.
+        """
+
+        self.path = path
+        self.prune_interval = prune_interval
+
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return the connection of the current thread.
+        """
+
+        db = getattr(self._local, "connection", None)
+
+        if db is None:
+            db = sqlite3.connect(self.path, timeout = 5, isolation_level = None)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = OFF")     # The buckets need not survive a crash
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                    "key TEXT PRIMARY KEY,"
+                    "tokens REAL NOT NULL,"
+                    "updated REAL NOT NULL,"
+                    "full REAL NOT NULL"
+                    ") WITHOUT ROWID"
+            )
+
+            self._local.connection = db
+
+        return db
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """
+        Take a token from the bucket `key`; see `MemoryStore.take`.
+        """
+
+        db = self._connect()
+
+        db.execute("BEGIN IMMEDIATE")
+
+        try:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            state, wait = _take(row, limit, now)
+
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full) VALUES (?, ?, ?, ?)",
+                (key, *state, _full_at(state, limit))
+            )
+
+            self._takes += 1
+
+            if self._takes % self.prune_interval == 0:
+                db.execute("DELETE FROM buckets WHERE full <= ?", (now,))
+
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        return wait
+
+def get_store() -> MemoryStore | SQLiteStore:
+    """
+    Return the store of the buckets of the current app.
+    """
+
+    return current_app.extensions["ratelimit"]
+
+def limit_request():
+    """
+    Charge the current request to the bucket of its client and endpoint.
+    Registered as a `before_request` function, after the user is loaded.
+    """
+
+    config = current_app.config
+
+    if not config["RATELIMIT_ENABLED"] or request.endpoint is None:
+        return None
+
+    if request.endpoint in config["RATELIMITS"]:
+        limit = config["RATELIMITS"][request.endpoint]
+        bucket = request.endpoint
+    else:
+        limit = config["RATELIMIT_DEFAULT"]
+        bucket = "default"
+
+    if limit is None:
+        return None
+
+    if g.get("user_id") is not None:
+        client = f"user:{g.user_id}"
+    else:
+        client = f"ip:{request.remote_addr}"
+
+    wait = get_store().take(f"{bucket}:{client}", Limit(*limit), time.time())
+
+    if wait > 0:
+        return _too_many_requests(wait)
+
+    return None
+
+def limit_username(view: t.Callable) -> t.Callable:
+    """
+    Decorator charging the requests of a view to the bucket of the account
+    named by the field `username` of their JSON body, with the budget of
+    the endpoint in `RATELIMITS_BY_USERNAME`, in addition to the bucket of
+    their client (see `limit_request`). Apply below `formats.limit_body`, so
+    that the body is capped before it is read. Requests without a username
+    are left to the view to reject.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        config = current_app.config
+        limit = config["RATELIMITS_BY_USERNAME"].get(request.endpoint)
+
+        if config["RATELIMIT_ENABLED"] and limit is not None:
+            body = request.get_json(silent = True)
+            username = body.get("username") if isinstance(body, dict) else None
+
+            if isinstance(username, str) and username:
+                wait = get_store().take(
+                    f"{request.endpoint}:username:{username.strip().casefold()}", Limit(*limit), time.time()
+                )
+
+                if wait > 0:
+                    return _too_many_requests(wait)
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+def _too_many_requests(wait: float) -> tuple:
+    # HTTP 429: Too Many Requests
+    return ({
+        "error": "Too Many Requests",
+        "message": "Rate limit exceeded"
+    }, 429, {
+        "Retry-After": str(math.ceil(wait))
+    })
+
+def init_app(app: Flask):
+    """
+    Initialise rate limiting for the app. Sets the default configuration,
+    creates the store of the buckets and registers `limit_request` as a
+    `before_request` function. Must be called after the blueprint `auth` is
+    registered, so that the user of the request is known.
+
+    :param app:
+    `Flask` instance corresponding to the current Flask application.
+    """
+
+    app.config.setdefault("RATELIMIT_ENABLED", True)
+    app.config.setdefault("RATELIMIT_DEFAULT", RATELIMIT_DEFAULT)
+    app.config.setdefault("RATELIMITS", RATELIMITS)
+    app.config.setdefault("RATELIMITS_BY_USERNAME", RATELIMITS_BY_USERNAME)
+    app.config.setdefault("RATELIMIT_STORAGE", None)    # Path of a shared store, e.g. in /dev/shm
+
+    if app.config["RATELIMIT_STORAGE"]:
+        app.extensions["ratelimit"] = SQLiteStore(app.config["RATELIMIT_STORAGE"])
+    else:
+        app.extensions["ratelimit"] = MemoryStore()
+
+    app.before_request(limit_request)
@@ -1,9 +1,26 @@
-from flask import Blueprint, request, g
-from .db import get_db
+import csv
+import itertools
+import json
+import os
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from secrets import token_urlsafe
+import click
+from flask import Blueprint, request, g, url_for
+from werkzeug.security import generate_password_hash
+from . import images, queries
+from .db import execute_write, get_db, get_read_db
+from .formats import limit_body, request_body, response_mimetype, stream_json
 
 users_bp = Blueprint("users", __name__, url_prefix = "/users")
 
+CONFIRMATIONS_PAGE_SIZE = 50                        # Default page size of the confirmations inbox
+CONFIRMATIONS_MAX_PAGE_SIZE = 200
+IMPORT_BATCH_SIZE = 1000                            # Users per transaction of `flask users import`
+PROFILE_FIELDS = ("phone", "email", "address", "designation")
+
 @users_bp.route("/<int:id>/profile", methods = ("PUT", "GET"))
+@limit_body(images.body_limit)
 def profile(id: int):
     """
     Update a user profile."
@@ -28,29 +45,36 @@ def profile(id: int):
                 "message": "Profile does not belong to user"
             }, 403)
 
-        if not request.json:
+        # JSON, MessagePack or CBOR body, or multipart with the image as a file
+        body = request_body()
+        upload = images.uploaded_file()
+
+        if not body and upload is None:
             # HTTP 400: Bad Request
             return ({
                 "error": "Bad Request",
                 "message": "No fields being updated"
             }, 400)
 
-        name: str = request.json.get("name")
-        phone: str = request.json.get("phone")
-        email: str = request.json.get("email")
-        address: str = request.json.get("address")
-        designation: str = request.json.get("designation")
-        roll: str = request.json.get("roll")
-        image: str = request.json.get("image")
+        name: str = body.get("name")
+        phone: str = body.get("phone")
+        email: str = body.get("email")
+        address: str = body.get("address")
+        designation: str = body.get("designation")
+        roll: str = body.get("roll")
+        image: str = body.get("image")
 
         error = None
 
         if not name and name is not None:
             error = "Name is required"
 
-        if name is None and phone is None and email is None and address is None and designation is None and roll is None and image is None:
+        if name is None and phone is None and email is None and address is None and designation is None and roll is None and image is None and upload is None:
             error = "At least one field is required"
 
+        if image is not None and upload is not None:
+            error = "Image must be sent either as a field or as a file"
+
         if image is not None:
             if not isinstance(image, str):
                 error = "Image must be a string"
@@ -67,24 +91,19 @@ def profile(id: int):
         db = get_db()
 
         with db:
-            db.execute(
-                (
-                    "UPDATE profiles SET "
-                    + ("name = ?," if name is not None else "")
-                    + ("phone = ?," if phone is not None else "")
-                    + ("email = ?," if email is not None else "")
-                    + ("address = ?," if address is not None else "")
-                    + ("designation = ?," if designation is not None else "")
-                    + ("roll = ?," if roll is not None else "")
-                    + ("image = ?," if image is not None else "")
-                )[:-1]
-                + " WHERE userid = ?",
-                tuple(
-                    x
-                    for x in (name, phone, email, address, designation, roll, image, id)
-                    if x is not None
-                ),
-            )
+            if not name is phone is email is address is designation is roll is image is None:
+                # Fields that are not sent (`None`) are kept
+                db.execute(
+                    queries.UPDATE_PROFILE,
+                    (name, phone, email, address, designation, roll, image, id)
+                )
+
+            if upload is not None:
+                # Streamed from the spooled part into the row
+                images.write_image(db, "profiles", id, *upload)
+
+        if image is not None or upload is not None:
+            images.schedule("profiles", id)
 
         # HTTP 204: No Content
         return ('', 204)
@@ -92,8 +111,12 @@ def profile(id: int):
     if request.method == "GET":
         # Any user can view any profile
 
-        db = get_db()
-        row = db.execute("SELECT * FROM profiles WHERE userid = ?", (id,)).fetchone()
+        db = get_read_db()
+        row = db.execute(
+            "SELECT userid, name, phone, email, address, designation, roll, playerId, online, "
+                "image IS NOT NULL AS hasImage FROM profiles WHERE userid = ?",
+            (id,)
+        ).fetchone()
 
         if row is None:
             # HTTP 404: Not Found
@@ -102,12 +125,33 @@ def profile(id: int):
                 "message": "User not found"
             }, 404)
 
-        body = dict(row)
-        if body["image"] is not None:
-            body["image"] = body["image"].decode("utf-8")
+        profile = dict(row)
+        has_image = profile.pop("hasImage")
+
+        # URLs of the resized variants of the image
+        profile["images"] = (
+            images.variant_urls(url_for(".profile", id = id).removesuffix("/profile"))
+            if has_image else None
+        )
+
+        if has_image and response_mimetype() == "application/json":
+            reader = images.open_original("profiles", id)
+
+            if reader is not None:
+                # HTTP 200: OK
+                # The image is streamed from its BLOB in chunks
+                response = stream_json(profile, "image", reader.stored_chunks())
+                response.call_on_close(reader.close)
+
+                return response
+
+        # Binary formats send the image as raw bytes, decoded in full
+        image = db.execute("SELECT image FROM profiles WHERE userid = ?", (id,)).fetchone() if has_image else None
+        profile["image"] = image[0] if image is not None else None
 
         # HTTP 200: OK
-        return (body, 200)
+        # Image bytes are serialised by the app's JSON provider
+        return (profile, 200)
 
     # # HTTP 405: Method Not Allowed
     # return ({
@@ -117,7 +161,53 @@ def profile(id: int):
     #     "Allow": ["GET", "PUT"]
     # })
 
+@users_bp.route("/<int:id>/image", methods = ("PUT",))
+@limit_body("IMAGE_MAX_SIZE")
+def put_image(id: int):
+    """
+    Replace the profile image of a user with the body of the request (the
+    raw image, streamed into the database).
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"  # Relevant only if the request was sent through Basic Auth
+        })
+
+    # Only the user associated with the profile can update it
+    if g.user_id != id:
+        # HTTP 403: Forbidden
+        return ({
+            "error": "Forbidden",
+            "message": "Profile does not belong to user"
+        }, 403)
+
+    return images.upload("profiles", id)
+
+@users_bp.route("/<int:id>/image/<variant>", methods = ("GET",))
+def image(id: int, variant: str):
+    """
+    Retrieve the profile image of a user: `original`, or a resized variant
+    (see `images.VARIANTS`).
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"  # Relevant only if the request was sent through Basic Auth
+        })
+
+    return images.send_variant("profiles", id, variant)
+
 @users_bp.route("/<int:id>/online", methods = ("GET", "PUT"))
+@limit_body("BODY_MAX_SIZE")
 def online(id: int):
     if g.user_id is None:
         # HTTP 401: Unauthorized
@@ -151,20 +241,20 @@ def online(id: int):
                 "message": error
             }, 400)
 
-        db = get_db()
-
-        with db:
-            db.execute(
+        # Presence flips are frequent; coalesce them through the write queue
+        execute_write(
+            lambda db: db.execute(
                 "UPDATE profiles SET online = ? WHERE userid = ?",
                 (int(status), id),
             )
+        )
 
         # HTTP 204: No Content
         return ('', 204)
     
     if request.method == "GET":
         # Any user can view any user's online status
-        db = get_db()
+        db = get_read_db()
         row = db.execute("SELECT online FROM profiles WHERE userid = ?", (id,)).fetchone()
 
         if row is None:
@@ -177,4 +267,300 @@ def online(id: int):
         # HTTP 200: OK
         return ({
             "online": bool(row["online"])
-        }, 200)
\ No newline at end of file
+        }, 200)
+
+@users_bp.route("/<int:id>/stats", methods = ("GET",))
+def stats(id: int):
+    """
+    Retrieve the dashboard counters of a user: posts created (open and
+    closed), posts claimed by the user and confirmations awaiting the user.
+    The counters are maintained by triggers on every write, so this is a
+    single primary-key lookup.
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"  # Relevant only if the request was sent through Basic Auth
+        })
+
+    # Any user can view any user's counters
+    db = get_read_db()
+    row = db.execute(
+        "SELECT userid, posts, openPosts, closedPosts, claimed, pending FROM user_stats WHERE userid = ?",
+        (id,)
+    ).fetchone()
+
+    if row is None:
+        # HTTP 404: Not Found
+        return ({
+            "error": "Not Found",
+            "message": "User not found"
+        }, 404)
+
+    # HTTP 200: OK
+    return (dict(row), 200)
+
+@users_bp.route("/<int:id>/confirmations", methods = ("GET",))
+def confirmations(id: int):
+    """
+    Retrieve the pending confirmations addressed to (`incoming`) or
+    initiated by the user, with a summary of each post.
+
+    Keyset-paginated on (postid, initid): pass the `next` cursor of a page
+    as `after` to fetch the following page; `limit` sets the page size.
+    """
+
+    if g.user_id is None:
+        # HTTP 401: Unauthorized
+        return ({
+            "error": "Unauthorized",
+            "message": "User not logged in"
+        }, 401, {
+            "WWW-Authenticate": "Basic"  # Relevant only if the request was sent through Basic Auth
+        })
+
+    # Only the user or an admin can view the confirmations
+    if g.user_id != id and g.user_role != 1:
+        # HTTP 403: Forbidden
+        return ({
+            "error": "Forbidden",
+            "message": "Confirmations do not belong to user"
+        }, 403)
+
+    try:
+        limit = int(request.args.get("limit", CONFIRMATIONS_PAGE_SIZE))
+        after = tuple(int(x) for x in request.args.get("after", "-1:-1").split(":"))
+
+        if len(after) != 2 or not 0 < limit <= CONFIRMATIONS_MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        # HTTP 400: Bad Request
+        return ({
+            "error": "Bad Request",
+            "message": f"Expected 'after' as 'postid:initid' and 'limit' between 1 and {CONFIRMATIONS_MAX_PAGE_SIZE}"
+        }, 400)
+
+    # Each branch seeks its own index from the cursor and reads at most one
+    # page; one extra row tells whether there is a next page
+    db = get_read_db()
+    rows = db.execute(
+        "SELECT "
+            "c.postid,"
+            "c.initid,"
+            "c.otherid,"
+            "c.otherid = :id AS incoming,"
+            "p.title,"
+            "p.type,"
+            "p.date,"
+            "p.location1,"
+            "p.creator"
+            " FROM ("
+                "SELECT * FROM ("
+                    "SELECT postid, initid, otherid FROM confirmations "
+                        "WHERE otherid = :id AND (postid, initid) > (:postid, :initid) "
+                        "ORDER BY postid, initid LIMIT :limit"
+                ") UNION SELECT * FROM ("
+                    "SELECT postid, initid, otherid FROM confirmations "
+                        "WHERE initid = :id AND (postid, initid) > (:postid, :initid) "
+                        "ORDER BY postid, initid LIMIT :limit"
+                ")"
+            ") AS c"
+            " JOIN posts AS p ON p.id = c.postid"
+            " ORDER BY c.postid, c.initid"
+            " LIMIT :limit",
+        {"id": id, "postid": after[0], "initid": after[1], "limit": limit + 1}
+    ).fetchall()
+
+    page = [dict(row, incoming = bool(row["incoming"])) for row in rows[:limit]]
+
+    # HTTP 200: OK
+    return ({
+        "confirmations": page,
+        "next": f"{page[-1]['postid']}:{page[-1]['initid']}" if len(rows) > limit else None
+    }, 200)
+
+def _read_roster(path: str, format: str | None) -> t.Iterator[tuple[int, dict | ValueError]]:
+    """
+    Stream the records of a roster, with the number of the line each ends
+    on: a CSV file with a header row, or newline-delimited JSON (one object
+    per line). The format is taken from the extension of `path` unless
+    given. A line of NDJSON that is not valid JSON is yielded as the
+    `ValueError` raised by decoding it, so that the rest of the roster is
+    still read.
+    """
+
+    if format is None:
+        format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+    with open(path, newline = "", encoding = "utf-8") as f:
+        if format == "csv":
+            reader = csv.DictReader(f)
+
+            for record in reader:
+                # Empty cells are missing values
+                yield reader.line_num, {key: value for key, value in record.items() if value not in ("", None)}
+        else:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as e:
+                        yield number, e
+
+def _import_batch(db, batch: list[tuple[dict, str]]) -> tuple[list[dict], list[str]]:
+    """
+    Insert a batch of `(record, password hash)` in one transaction. Records
+    whose username or roll number is already taken are skipped. Return the
+    records of the users created and the messages of the skipped records.
+    """
+
+    skipped = []
+
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+
+        usernames = [record["username"] for record, _ in batch]
+        rolls = [record["roll"] for record, _ in batch]
+        placeholders = ",".join("?" * len(batch))
+
+        taken_usernames = {row[0] for row in db.execute(
+            f"SELECT username FROM users WHERE username IN ({placeholders})", usernames
+        )}
+        taken_rolls = {row[0] for row in db.execute(
+            f"SELECT roll FROM profiles WHERE roll IN ({placeholders})", rolls
+        )}
+
+        accepted = []
+
+        for record, password in batch:
+            if record["username"] in taken_usernames:
+                skipped.append(f"{record['username']}: username already exists")
+            elif record["roll"] in taken_rolls:
+                skipped.append(f"{record['username']}: roll number {record['roll']} already exists")
+            else:
+                # Duplicates within the batch are skipped after their first record
+                taken_usernames.add(record["username"])
+                taken_rolls.add(record["roll"])
+                accepted.append((record, password))
+
+        db.executemany(
+            "INSERT INTO users(username, password, role) VALUES (?, ?, ?)",
+            ((record["username"], password, record.get("role", 0)) for record, password in accepted)
+        )
+
+        ids = dict(db.execute(
+            f"SELECT username, id FROM users WHERE username IN ({placeholders})", usernames
+        ).fetchall())
+
+        db.executemany(
+            "INSERT INTO profiles(userid, name, phone, email, address, designation, roll, online) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (
+                (ids[record["username"]], record["name"], *(record.get(field) for field in PROFILE_FIELDS), record["roll"])
+                for record, _ in accepted
+            )
+        )
+
+    return [record for record, _ in accepted], skipped
+
+@users_bp.cli.command("import")
+@click.argument("roster", type = click.Path(exists = True, dir_okay = False))
+@click.option("--format", type = click.Choice(("csv", "ndjson")), help = "Format of the roster (default: by extension).")
+@click.option("--credentials", type = click.Path(dir_okay = False, writable = True), help = "CSV file for generated passwords.")
+@click.option("--batch-size", type = int, default = IMPORT_BATCH_SIZE, show_default = True, help = "Users per transaction.")
+@click.option("--workers", type = int, default = os.cpu_count(), show_default = True, help = "Processes hashing passwords.")
+def import_command(roster: str, format: str | None, credentials: str | None, batch_size: int, workers: int):
+    """
+    Create users and their profiles from a roster (CSV or NDJSON).
+
+    Each record has a username, name and roll number, and optionally a
+    password, role (0 or 1), phone, email, address and designation. Records
+    without a password get a generated one, written with the username to
+    CREDENTIALS (which is required for them) once the user is created.
+    """
+
+    db = get_db()
+    created = 0
+    skipped = 0
+    generated = None
+
+    def valid(records: t.Iterable[tuple[int, dict | ValueError]]) -> t.Iterator[tuple[dict, str, bool]]:
+        """
+        Yield `(record, password, whether the password is generated)` for
+        the valid records.
+        """
+
+        nonlocal skipped
+
+        for line, record in records:
+            try:
+                if isinstance(record, ValueError):
+                    raise record
+
+                record["roll"] = int(record["roll"])
+                record["role"] = int(record.get("role", 0))
+
+                if not record["username"] or not record["name"]:
+                    raise ValueError("username and name are required")
+
+                if record["role"] not in (0, 1):
+                    raise ValueError("role must be 0 or 1")
+
+                if not isinstance(record.get("password", ""), str):
+                    raise ValueError("password must be a string")
+            except (KeyError, TypeError, ValueError) as e:
+                click.echo(f"Skipped line {line}: invalid ({e!r})", err = True)
+                skipped += 1
+                continue
+
+            password = record.get("password")
+
+            if password is None:
+                if generated is None:
+                    click.echo(f"Skipped {record['username']}: no password and no --credentials", err = True)
+                    skipped += 1
+                    continue
+
+                yield record, token_urlsafe(12), True
+            else:
+                yield record, password, False
+
+    with (
+        open(os.open(credentials, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", newline = "")
+        if credentials else open(os.devnull, "w")
+    ) as credentials_file, ProcessPoolExecutor(max(workers, 1)) as pool:
+        if credentials:
+            generated = csv.writer(credentials_file)
+            generated.writerow(("username", "password"))
+
+        records = valid(_read_roster(roster, format))
+
+        while batch := list(itertools.islice(records, batch_size)):
+            # Hashing dominates the import, so it is spread across processes
+            hashes = pool.map(
+                generate_password_hash,
+                (password for _, password, _ in batch),
+                chunksize = max(len(batch) // (4 * max(workers, 1)), 1)
+            )
+
+            accepted, messages = _import_batch(db, [(record, hash) for (record, _, _), hash in zip(batch, hashes)])
+
+            # Only the passwords of the users created are written
+            accepted = {id(record) for record in accepted}
+
+            for record, password, is_generated in batch:
+                if is_generated and id(record) in accepted:
+                    generated.writerow((record["username"], password))
+
+            for message in messages:
+                click.echo(f"Skipped {message}", err = True)
+
+            created += len(accepted)
+            skipped += len(messages)
+            click.echo(f"Created {created} users ({skipped} skipped)")
+
+    click.echo(f"Imported {roster}: {created} users created, {skipped} skipped.")
@@ -1,4 +1,5 @@
 import os
+import shutil
 import tempfile
 
 import pytest
@@ -18,12 +19,17 @@ def app():
     """
 
     db_fd, db_path = tempfile.mkstemp()
+    image_dir = tempfile.mkdtemp()
 
     from app import app
     app.config.update(
         TESTING = True,
         SECRET_KEY = "dev",
-        DATABASE = db_path
+        DATABASE = db_path,
+        WRITE_BATCHING = False,     # Apply writes synchronously
+        IMAGE_DIR = image_dir,
+        IMAGE_WORKERS = 0,          # Generate image variants synchronously
+        RATELIMIT_ENABLED = False   # Enabled by the tests of rate limiting only
     )
 
     with app.app_context():
@@ -35,6 +41,7 @@ def app():
     # Cleanup after tests
     os.close(db_fd)
     os.unlink(db_path)
+    shutil.rmtree(image_dir)
 
 @pytest.fixture
 def client(app: Flask):
@@ -0,0 +1,68 @@
+import base64
+import time
+
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import archive
+from lostify.db import get_db
+
+def test_archive(client: FlaskClient, app: Flask):
+    now = int(time.time())
+
+    with app.app_context():
+        db = get_db()
+
+        # Post 0 closed long ago, post 1 closed recently, post 2 old, the
+        # rest recent
+        db.execute("UPDATE posts SET date = ?", (now,))
+        db.execute("UPDATE posts SET closedBy = 1, closedDate = ? WHERE id = 0", (now - 100,))
+        db.execute("UPDATE posts SET closedBy = 1, closedDate = ? WHERE id = 1", (now,))
+        db.execute("UPDATE posts SET date = ?, image = X'61626364' WHERE id = 2", (now - 1000,))
+        db.execute("INSERT INTO reports (postid, userid) VALUES (2, 1)")
+        db.commit()
+
+        stats = db.execute("SELECT * FROM user_stats ORDER BY userid").fetchall()
+
+        assert archive.archive(db, closed_age = 50, age = 500, batch_size = 1, sleep = 0) == 2
+
+        assert [row[0] for row in db.execute("SELECT id FROM posts_archive ORDER BY id")] == [0, 2]
+        assert db.execute("SELECT count(*) FROM posts WHERE id IN (0, 2)").fetchone()[0] == 0
+        assert db.execute("SELECT count(*) FROM reports WHERE postid = 2").fetchone()[0] == 0
+
+        # The counters of the users still include archived posts
+        assert db.execute("SELECT * FROM user_stats ORDER BY userid").fetchall() == stats
+
+        # Nothing left to archive
+        assert archive.archive(db, closed_age = 50, age = 500, sleep = 0) == 0
+
+    client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+    assert 2 not in [post["id"] for post in client.get("/items/all").json["posts"]]
+
+    # Archived posts are still found by id, with their images
+    response = client.get("/items/2")
+
+    assert response.status_code == 200
+    assert response.json["archived"] is True
+    assert response.json["title"] == "Third Post"
+    assert response.json["image"] == "abcd"
+    assert response.json["images"]["original"] == "/items/2/image/original"
+
+    for variant in ("original", "thumbnail"):
+        response = client.get(f"/items/2/image/{variant}")
+
+        assert response.status_code == 200
+        assert response.data == base64.b64decode("abcd")
+
+    assert client.get("/items/3").json["archived"] is False
+    assert client.get("/items/999").status_code == 404
+
+def test_archive_command(runner, monkeypatch):
+    monkeypatch.setitem(runner.app.config, "ARCHIVE_AGE", 0)
+
+    result = runner.invoke(args = ("db", "archive", "--batch-size", "4"))
+
+    assert "Archived 10 post(s)." in result.output
+
+    with runner.app.app_context():
+        assert get_db().execute("SELECT count(*) FROM posts").fetchone()[0] == 0
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import mailer
+from lostify.asgi import AsyncDBPool, create_asgi_app
+from lostify.db import WriteQueue, get_db
+
+def login(client: FlaskClient) -> bytes:
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    return cookie.split(";")[0].encode()
+
+def http_scope(path: str, cookie: bytes | None = None, method: str = "GET", headers: list = ()) -> dict:
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": ([(b"cookie", cookie)] if cookie else []) + list(headers)
+    }
+
+def test_pool(app: Flask):
+    async def main():
+        pool = AsyncDBPool(app.config["DATABASE"], WriteQueue(app.config["DATABASE"]), size = 2, poll_interval = 0.01)
+
+        try:
+            rows = await asyncio.gather(*(
+                pool.fetchone("SELECT title FROM posts WHERE id = ?", (i,)) for i in range(10)
+            ))
+            assert all(row is not None for row in rows)
+
+            # Connections of the pool are read-only
+            with pytest.raises(sqlite3.OperationalError):
+                await pool.run(lambda db: db.execute("DELETE FROM posts"))
+
+            # A write through the queue wakes the waiters
+            version = await pool.watch()
+            waiter = asyncio.ensure_future(pool.changed(version, 5))
+
+            await pool.write(lambda db: db.execute("UPDATE posts SET reportCount = 7 WHERE id = 0"))
+
+            version, previous = await waiter, version
+            assert version > previous
+            assert (await pool.fetchone("SELECT reportCount FROM posts WHERE id = 0"))[0] == 7
+
+            # No commit within the timeout
+            assert await pool.changed(version, 0.05) == version
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+def test_stats_events(client: FlaskClient, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "ASYNC_POLL_INTERVAL", 0.01)
+    monkeypatch.setitem(app.config, "SSE_HEARTBEAT", 0.05)
+
+    cookie = login(client)
+
+    async def fallback(scope, receive, send):
+        raise AssertionError("Native route passed to the fallback")
+
+    async def main():
+        asgi = create_asgi_app(app, fallback)
+        messages = asyncio.Queue()
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await messages.put(message)
+
+        async def next_event() -> dict:
+            while True:
+                body = (await messages.get())["body"]
+                if body.startswith(b"event: stats"):
+                    return json.loads(body.split(b"data: ")[1])
+
+        async def event() -> dict:
+            # Skips heartbeats
+            return await asyncio.wait_for(next_event(), 5)
+
+        stream = asyncio.ensure_future(asgi(http_scope("/users/0/stats/events", cookie), receive, send))
+
+        start = await messages.get()
+        assert start["status"] == 200
+        assert (b"content-type", b"text/event-stream") in start["headers"]
+
+        assert (await event())["posts"] == 5
+
+        # A commit by another connection is pushed to the stream
+        db = sqlite3.connect(app.config["DATABASE"])
+        db.execute("INSERT INTO posts (title, creator, date, type, location1) VALUES ('Pen', 0, 0, 0, 'Hall')")
+        db.commit()
+        db.close()
+
+        assert (await event())["posts"] == 6
+
+        disconnect.set()
+        await asyncio.wait_for(stream, 5)
+
+        await asgi.pool.close()
+
+    asyncio.run(main())
+
+def test_native_routes_and_fallback(client: FlaskClient, app: Flask):
+    calls = []
+
+    async def fallback(scope, receive, send):
+        calls.append(scope["path"])
+
+    async def main():
+        asgi = create_asgi_app(app, fallback)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        # Without a session cookie
+        await asgi(http_scope("/users/0/stats/events"), None, send)
+        assert messages[0]["status"] == 401
+
+        # A user without counters
+        messages.clear()
+        await asgi(http_scope("/users/100/stats/events", login(client)), None, send)
+        assert messages[0]["status"] == 404
+
+        # Every other route is served by the Flask app
+        await asgi(http_scope("/items/all"), None, send)
+        assert calls == ["/items/all"]
+
+        # The pool is closed on shutdown
+        lifespan = iter(({"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}))
+
+        async def receive():
+            return next(lifespan)
+
+        messages.clear()
+        await asgi({"type": "lifespan"}, receive, send)
+        assert [m["type"] for m in messages] == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+    asyncio.run(main())
+
+def test_email_views(app: Flask, monkeypatch):
+    sent = []
+
+    async def send_async(message):
+        # Awaited on the event loop, not in a worker thread
+        assert threading.current_thread() is threading.main_thread()
+
+        if message["recipients"]["to"][0]["address"].startswith("other@"):
+            raise RuntimeError("Email send failed")
+
+        sent.append(message)
+
+    def send(message):
+        raise AssertionError("Email sent synchronously")
+
+    monkeypatch.setattr(mailer, "send_async", send_async)
+    monkeypatch.setattr(mailer, "send", send)
+
+    async def fallback(scope, receive, send):
+        raise AssertionError("Email view passed to the fallback")
+
+    async def request(path: str, body: dict) -> list[dict]:
+        messages = []
+        data = json.dumps(body).encode()
+
+        async def receive():
+            return {"type": "http.request", "body": data, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = http_scope(path, method = "POST", headers = [(b"content-type", b"application/json")])
+        await asgi(scope, receive, send)
+
+        return messages
+
+    with app.app_context():
+        password = get_db().execute("SELECT password FROM users WHERE username = 'test'").fetchone()[0]
+
+    asgi = create_asgi_app(app, fallback)
+
+    # The new password is stored once it is sent
+    messages = asyncio.run(request("/auth/reset_password", {"username": "test"}))
+    assert messages[0]["status"] == 204
+    assert sent[0]["recipients"]["to"][0]["address"] == "test@iitk.ac.in"
+
+    with app.app_context():
+        assert get_db().execute("SELECT password FROM users WHERE username = 'test'").fetchone()[0] != password
+
+    # Views that do not send are answered directly
+    messages = asyncio.run(request("/auth/reset_password", {"username": "nobody"}))
+    assert messages[0]["status"] == 404
+    assert json.loads(messages[1]["body"])["message"] == "Username not found"
+    assert len(sent) == 1
+
+    # A failed send leaves the database unchanged
+    with app.app_context():
+        password = get_db().execute("SELECT password FROM users WHERE username = 'other'").fetchone()[0]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(request("/auth/reset_password", {"username": "other"}))
+
+    with app.app_context():
+        assert get_db().execute("SELECT password FROM users WHERE username = 'other'").fetchone()[0] == password
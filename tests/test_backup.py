@@ -0,0 +1,126 @@
+import os
+import sqlite3
+
+import pytest
+from flask import Flask
+from lostify import backup, create_app
+from lostify.cache import ResponseCache
+from lostify.db import get_db
+
+@pytest.mark.parametrize("compress", (False, True))
+def test_backup_restore(app: Flask, client, tmp_path, compress, monkeypatch):
+    dest = str(tmp_path / ("snapshot.sqlite" + (".gz" if compress else "")))
+    steps = []
+
+    digest = backup.backup(
+        app.config["DATABASE"], dest, compress,
+        pages = 1, sleep = 0, progress = lambda copied, total: steps.append(copied)
+    )
+
+    # Copied in several steps of one page
+    assert len(steps) > 1
+    assert (tmp_path / (dest + ".sha256")).read_text().startswith(digest)
+
+    backup.verify(dest)
+
+    # Change the database, then restore the snapshot
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM posts")
+        db.commit()
+
+    with app.app_context():
+        version = get_db().execute("SELECT version FROM data_versions WHERE name = 'posts'").fetchone()[0]
+
+    # The feed of the changed database is cached
+    monkeypatch.setitem(app.extensions, "response_cache", ResponseCache())
+    client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+    assert client.get("/items/all").json["posts"] == []
+
+    backup.restore(dest, app.config["DATABASE"], sleep = 0)
+
+    with app.app_context():
+        db = get_db()
+
+        assert db.execute("SELECT count(*) FROM posts").fetchone()[0] == 10
+
+        # Cached responses of the data before the restore are outdated
+        assert db.execute("SELECT version FROM data_versions WHERE name = 'posts'").fetchone()[0] > version
+
+    assert client.get("/items/all").json["posts"] != []
+
+def test_verify_detects_tampering(app: Flask, tmp_path):
+    dest = str(tmp_path / "snapshot.sqlite")
+    backup.backup(app.config["DATABASE"], dest, sleep = 0)
+
+    with open(dest, "ab") as f:
+        f.write(b"\0")
+
+    with pytest.raises(RuntimeError):
+        backup.verify(dest)
+
+    # A tampered snapshot is never restored
+    with pytest.raises(RuntimeError):
+        backup.restore(dest, app.config["DATABASE"])
+
+def test_backup_during_writes(app: Flask, tmp_path):
+    """
+    Writers can commit between the steps of a backup.
+    """
+
+    writer = sqlite3.connect(app.config["DATABASE"], timeout = 0)
+    committed = []
+
+    def progress(copied, total):
+        # Fails with 'database is locked' if the backup holds the lock
+        with writer:
+            writer.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = 0")
+        committed.append(copied)
+
+    backup.backup(app.config["DATABASE"], str(tmp_path / "snapshot.sqlite"), pages = 1, sleep = 0, progress = progress)
+    writer.close()
+
+    assert len(committed) > 1
+
+def test_backup_commands(runner, tmp_path):
+    dest = str(tmp_path / "snapshot.sqlite.gz")
+
+    result = runner.invoke(args = ("db", "backup", dest, "--gzip", "--sleep", "0"))
+    assert "Backed up" in result.output
+
+    result = runner.invoke(args = ("db", "verify", dest))
+    assert "OK" in result.output
+
+    result = runner.invoke(args = ("db", "restore", dest, "--yes", "--sleep", "0"))
+    assert "Restored" in result.output
+
+    result = runner.invoke(args = ("db", "verify", str(tmp_path / "missing")))
+    assert result.exit_code != 0
+
+def test_scheduled_backup(app: Flask, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "BACKUP_INTERVAL", 3600)
+    monkeypatch.setitem(app.config, "BACKUP_KEEP", 2)
+
+    assert backup._backup_if_due(app)
+
+    # Another worker waking in the same interval finds the snapshot
+    assert not backup._backup_if_due(app)
+    assert len(backup._snapshots(app)) == 1
+
+    # Older snapshots are pruned down to BACKUP_KEEP
+    name = os.path.splitext(os.path.basename(app.config["DATABASE"]))[0]
+    old = tmp_path / f"{name}-20000101-000000.sqlite.gz"
+    old.write_bytes(b"")
+    os.utime(old, (0, 0))
+    monkeypatch.setitem(app.config, "BACKUP_KEEP", 1)
+
+    backup._prune(app)
+
+    assert not old.exists()
+    assert len(backup._snapshots(app)) == 1
+
+def test_backup_keep_validated():
+    with pytest.raises(ValueError):
+        create_app({"TESTING": True, "BACKUP_KEEP": 0})
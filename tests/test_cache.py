@@ -0,0 +1,138 @@
+import gzip
+import threading
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import cache
+from lostify.cache import ResponseCache
+from lostify.db import get_db
+
+def test_single_flight():
+    response_cache = ResponseCache()
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return 1, b"body", "application/json"
+
+    results = []
+    threads = [
+        threading.Thread(target = lambda: results.append(response_cache.get("key", 1, build)))
+        for _ in range(4)
+    ]
+
+    threads[0].start()
+    started.wait(5)
+
+    for thread in threads[1:]:
+        thread.start()
+
+    release.set()
+
+    for thread in threads:
+        thread.join(5)
+
+    # Built once; the waiters get the same entry
+    assert len(builds) == 1
+    assert len(results) == 4 and all(entry is results[0] for entry in results)
+    assert response_cache.misses == 1
+
+    # A later version is built again
+    assert response_cache.get("key", 1, build) is results[0]
+    assert response_cache.get("key", 2, lambda: (2, b"new", "application/json")).body == b"new"
+
+def test_failed_build():
+    response_cache = ResponseCache(max_entries = 1)
+
+    def fail():
+        raise RuntimeError("build failed")
+
+    with pytest.raises(RuntimeError):
+        response_cache.get("key", 1, fail)
+
+    # The next request builds the entry instead
+    assert response_cache.get("key", 1, lambda: (1, b"a", "text/plain")).body == b"a"
+
+    # The least recently used entry is evicted
+    response_cache.get("other", 1, lambda: (1, b"b", "text/plain"))
+
+    assert list(response_cache._entries) == ["other"]
+
+def test_byte_budget():
+    response_cache = ResponseCache(max_entries = 8, max_bytes = 10)
+
+    response_cache.get("a", 1, lambda: (1, b"aaaa", "text/plain"))
+    response_cache.get("b", 1, lambda: (1, b"bbbb", "text/plain")).compressed_variants["gzip"] = b"bb"
+
+    # Evicted by size, least recently used first
+    response_cache.get("c", 1, lambda: (1, b"cccc", "text/plain"))
+
+    assert list(response_cache._entries) == ["b", "c"]
+
+    # Too large to be cached at all
+    assert response_cache.get("d", 1, lambda: (1, b"d" * 11, "text/plain")).body == b"d" * 11
+    assert list(response_cache._entries) == ["b", "c"]
+
+    # Variants count towards the budget
+    response_cache.get("e", 1, lambda: (1, b"e", "text/plain"))
+
+    assert list(response_cache._entries) == ["c", "e"]
+
+def test_feed_cache(client: FlaskClient, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.extensions, "response_cache", ResponseCache())
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 0)
+
+    response_cache = app.extensions["response_cache"]
+
+    client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+    first = client.get("/items/all")
+    second = client.get("/items/all", headers = {"Accept-Encoding": "gzip"})
+
+    assert response_cache.misses == 1 and response_cache.hits == 1
+    assert second.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(second.data) == first.data
+
+    # The compressed body is kept with the entry
+    assert "gzip" in next(iter(response_cache._entries.values())).compressed_variants
+
+    # Parameters are part of the key
+    client.get("/items/all?image=url")
+    client.get("/items/all?type=1")
+
+    assert response_cache.misses == 3
+
+    # A change to the posts invalidates the entries
+    client.put("/items/0", json = {"title": "Renamed"})
+
+    posts = {post["id"]: post for post in client.get("/items/all").json["posts"]}
+
+    assert posts[0]["title"] == "Renamed"
+    assert response_cache.misses == 4
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE posts SET reportCount = 3 WHERE id = 1")
+        db.commit()
+
+    posts = {post["id"]: post for post in client.get("/items/all").json["posts"]}
+
+    assert posts[1]["reportCount"] == 3
+
+def test_data_versions(app: Flask):
+    with app.app_context():
+        db = get_db()
+        version = cache.data_version(db, "posts")
+
+        db.execute("DELETE FROM posts WHERE id = 9")
+        db.execute("INSERT INTO locations (id, name) VALUES (1, 'Z')")
+        db.execute("INSERT INTO location_aliases (alias, locationid) VALUES ('z', 1)")
+        db.commit()
+
+        # The posts found by a location name change with its aliases
+        assert cache.data_version(db, "posts") == version + 2
@@ -0,0 +1,127 @@
+import base64
+import gzip
+
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import compression
+
+def login(client: FlaskClient) -> str:
+    return client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+def test_compress_feed(client: FlaskClient):
+    cookie = login(client)
+
+    plain = client.get(
+        "/items/all",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.vary
+
+    response = client.get(
+        "/items/all",
+        headers = {
+            "Cookie": cookie,
+            "Accept-Encoding": "gzip"
+        }
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
+
+def test_compress_threshold(client: FlaskClient, app: Flask, monkeypatch):
+    cookie = login(client)
+
+    # The body of an online status is far below the threshold
+    response = client.get(
+        "/users/0/online",
+        headers = {
+            "Cookie": cookie,
+            "Accept-Encoding": "gzip"
+        }
+    )
+
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 0)
+    response = client.get(
+        "/users/0/online",
+        headers = {
+            "Cookie": cookie,
+            "Accept-Encoding": "gzip"
+        }
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+
+def test_compress_skips_images(app: Flask):
+    with app.test_request_context(headers = {"Accept-Encoding": "gzip"}):
+        response = app.response_class(b"\x89PNG" * 1024, mimetype = "image/png")
+        assert "Content-Encoding" not in compression.compress_response(response).headers
+
+def test_compressed_variants(app: Flask, monkeypatch):
+    calls = []
+    monkeypatch.setitem(
+        compression.CODECS, "gzip", lambda data: calls.append(data) or gzip.compress(data)
+    )
+
+    variants = {}
+    body = b'{"posts":[]}' * 256
+
+    with app.test_request_context(headers = {"Accept-Encoding": "gzip"}):
+        for _ in range(3):
+            response = app.response_class(body, mimetype = "application/json")
+            response.compressed_variants = variants
+            response = compression.compress_response(response)
+
+            assert gzip.decompress(response.data) == body
+
+    # Compressed once; served from the variants afterwards
+    assert len(calls) == 1
+    assert set(variants) == {"gzip"}
+
+def test_compress_stream(client: FlaskClient):
+    cookie = login(client)
+
+    # The image of a post is streamed into its JSON
+    client.put(
+        "/items/0",
+        json = {
+            "image": base64.b64encode(b"\x89PNG" * 2048).decode("ascii")
+        },
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    plain = client.get(
+        "/items/0",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    response = client.get(
+        "/items/0",
+        headers = {
+            "Cookie": cookie,
+            "Accept-Encoding": "gzip"
+        }
+    )
+
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert gzip.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
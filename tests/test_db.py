@@ -1,7 +1,10 @@
 import sqlite3
+import threading
 
 import pytest
-from lostify.db import get_db
+from lostify import db
+from lostify.backup import refresh_replica
+from lostify.db import WriteQueue, get_db, get_read_db, get_write_queue, init_db
 
 def test_get_close_db(app):
     """
@@ -31,4 +34,206 @@ def test_init_db_command(runner, monkeypatch):
     monkeypatch.setattr('lostify.db.init_db', fake_init_db)
     result = runner.invoke(args = ('init-db',))
     assert 'Initial' in result.output
-    assert Recorder.called
\ No newline at end of file
+    assert Recorder.called
+
+def test_init_db_twice(app):
+    """
+    Ensure that `init_db` resets a database that is already initialised,
+    including the tables created by migrations.
+    """
+
+    with app.app_context():
+        init_db()
+
+        db = get_db()
+        db.execute("INSERT INTO users (id, username, password, role) VALUES (0, 'test', 'x', 0)")
+        db.execute("INSERT INTO posts (type, creator, title, location1, date) VALUES (0, 0, 'Pen', 'Hall', 0)")
+        db.commit()
+
+        init_db()
+
+        db = get_db()
+
+        assert db.execute("SELECT count(*) FROM users").fetchone()[0] == 0
+        assert db.execute("SELECT count(*) FROM user_stats").fetchone()[0] == 0
+        assert db.execute("SELECT count(*) FROM locations").fetchone()[0] == 0
+        assert [tuple(row) for row in db.execute("SELECT version FROM data_versions")] == [(0,)]
+
+def test_get_read_db(app):
+    """
+    Ensure that the read-only connection rejects writes and is reused by
+    the thread across application contexts.
+    """
+
+    with app.app_context():
+        db = get_read_db()
+        assert db is get_read_db()
+        assert db.execute("SELECT count(*) FROM posts").fetchone()[0] == 10
+
+        with pytest.raises(sqlite3.OperationalError) as e:
+            db.execute("DELETE FROM posts")
+
+        assert 'readonly' in str(e.value).replace(' ', '')
+
+    with app.app_context():
+        assert get_read_db() is db
+
+def test_get_read_db_replica(app, tmp_path, monkeypatch):
+    """
+    Ensure that reads go to the replica when one is configured, and that a
+    refreshed replica is picked up.
+    """
+
+    replica = str(tmp_path / "replica.sqlite")
+    monkeypatch.setitem(app.config, "READ_REPLICA", replica)
+
+    with app.app_context():
+        # No replica yet: reads go to the primary
+        assert get_read_db().execute("SELECT count(*) FROM posts").fetchone()[0] == 10
+
+        refresh_replica(app.config["DATABASE"], replica)
+
+        get_db().execute("DELETE FROM posts")
+        get_db().commit()
+
+    with app.app_context():
+        # The replica lags behind the primary until it is refreshed
+        assert get_read_db().execute("SELECT count(*) FROM posts").fetchone()[0] == 10
+
+    refresh_replica(app.config["DATABASE"], replica)
+
+    with app.app_context():
+        assert get_read_db().execute("SELECT count(*) FROM posts").fetchone()[0] == 0
+
+def test_write_queue_batches(app):
+    """
+    Ensure that concurrent mutations are coalesced into few transactions,
+    and that a failing mutation does not affect the rest of its batch.
+    """
+
+    write_queue = WriteQueue(app.config["DATABASE"], max_batch = 100, max_delay = 0.05)
+
+    def report(db, postid):
+        db.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = ?", (postid,))
+        return postid
+
+    def fail(db):
+        db.execute("UPDATE posts SET reportCount = 1000 WHERE id = 0")
+        raise ValueError("rolled back")
+
+    futures = [write_queue.submit(report, i % 10) for i in range(50)]
+    failed = write_queue.submit(fail)
+
+    assert [future.result(timeout = 5) for future in futures] == [i % 10 for i in range(50)]
+    with pytest.raises(ValueError):
+        failed.result(timeout = 5)
+
+    assert write_queue.commits < 5
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT reportCount FROM posts WHERE id = 0"
+        ).fetchone()[0] == 5
+
+def test_execute_write_batching(client, app, monkeypatch):
+    """
+    Ensure that handlers work with write batching enabled.
+    """
+
+    monkeypatch.setitem(app.config, "WRITE_BATCHING", True)
+
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    for _ in range(2):
+        response = client.put("/items/5/report", headers = {"Cookie": cookie})
+        assert response.status_code == 204
+
+    response = client.put("/items/9999/report", headers = {"Cookie": cookie})
+    assert response.status_code == 404
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT reportCount FROM posts WHERE id = 5"
+        ).fetchone()[0] == 1
+
+        assert get_write_queue().commits >= 2
+
+def test_statement_cache_stats(client, app, monkeypatch):
+    """
+    Ensure that statement cache hits are counted per request, and that
+    partial updates with fixed statements keep the fields not sent.
+    """
+
+    monkeypatch.setitem(app.config, "STATEMENT_CACHE_STATS", True)
+    monkeypatch.setattr(db, "_read_connections", threading.local())
+
+    client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+    with app.app_context():
+        description = get_db().execute(
+            "SELECT description FROM posts WHERE id = 1"
+        ).fetchone()[0]
+
+    headers = []
+
+    # Reads share the connection of the thread across requests
+    for _ in range(2):
+        response = client.get("/users/0/profile")
+        assert response.status_code == 200
+
+        headers.append(response.headers["X-Statement-Cache"])
+
+    # The second request only runs statements compiled by the first
+    assert headers[0].startswith("hits=0,")
+    assert headers[1] == "hits=1, misses=0"
+
+    response = client.put("/items/1", json = {"title": "Second"})
+    assert response.status_code == 204
+
+    response = client.put("/users/0/profile", json = {"phone": "123"})
+    assert response.status_code == 204
+
+    with app.app_context():
+        connection = get_db()
+
+        assert tuple(connection.execute(
+            "SELECT title, description FROM posts WHERE id = 1"
+        ).fetchone()) == ("Second", description)
+
+        name, phone = connection.execute(
+            "SELECT name, phone FROM profiles WHERE userid = 0"
+        ).fetchone()
+
+        assert name is not None
+        assert phone == "123"
+
+def test_statement_cache_stats_off(client, app):
+    """
+    Ensure that statements are only counted when `STATEMENT_CACHE_STATS` is
+    set, including by the writer thread.
+    """
+
+    with app.app_context():
+        assert type(get_db()) is sqlite3.Connection
+
+    response = client.get("/hello")
+    assert "X-Statement-Cache" not in response.headers
+
+    write_queue = WriteQueue(app.config["DATABASE"], statement_stats = True)
+
+    def report(db):
+        db.execute("UPDATE posts SET reportCount = reportCount + 1 WHERE id = 0")
+
+    for _ in range(2):
+        write_queue.submit(report).result(timeout = 5)
+
+    # The pragma of the connection, then BEGIN, SAVEPOINT, the update,
+    # RELEASE and COMMIT, compiled once each
+    assert write_queue.statement_cache == (5, 6)
+    assert WriteQueue(app.config["DATABASE"]).statement_cache is None
@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+
 from lostify import create_app
 
 def test_config():
@@ -10,4 +14,25 @@ def test_hello(client):
     """
 
     response = client.get('/hello')
-    assert response.data == b'Hello, world!'
\ No newline at end of file
+    assert response.data == b'Hello, world!'
+
+def test_startup_imports():
+    """
+    Importing the app does not import the email SDK, which is loaded on the
+    first send (see `benchmarks/bench_startup.py` for the import times).
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output = True, text = True, check = True
+    )
+
+    modules = [
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "[us]" not in line
+    ]
+
+    assert "lostify.auth" in modules
+    assert not [module for module in modules if module.startswith("azure")]
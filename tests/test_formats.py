@@ -0,0 +1,213 @@
+import sqlite3
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import formats
+from lostify.db import get_db
+
+def _row() -> sqlite3.Row:
+    db = sqlite3.connect(":memory:")
+    db.row_factory = sqlite3.Row
+    return db.execute("SELECT 1 AS id, 'x' AS title, CAST('abc' AS BLOB) AS image").fetchone()
+
+@pytest.mark.parametrize("backend", ("stdlib", "orjson"))
+def test_provider_serialises_rows(backend):
+    """
+    Both providers serialise `sqlite3.Row` objects and `bytes` directly.
+    """
+
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+
+    app = Flask(__name__)
+    app.config["JSON_BACKEND"] = backend
+    provider = formats.make_json_provider(app)
+
+    assert provider.name == backend
+    assert provider.loads(provider.dumps({"posts": [_row()]})) == {
+        "posts": [{"id": 1, "title": "x", "image": "abc"}]
+    }
+
+def test_provider_unknown_backend():
+    app = Flask(__name__)
+    app.config["JSON_BACKEND"] = "yaml"
+
+    with pytest.raises(ValueError):
+        formats.make_json_provider(app)
+
+def test_provider_missing_backend(monkeypatch):
+    monkeypatch.setattr(formats, "orjson", None)
+    app = Flask(__name__)
+
+    # 'auto' falls back to the standard library
+    app.config["JSON_BACKEND"] = "auto"
+    assert formats.make_json_provider(app).name == "stdlib"
+
+    app.config["JSON_BACKEND"] = "orjson"
+    with pytest.raises(RuntimeError):
+        formats.make_json_provider(app)
+
+def test_get_all_images(client: FlaskClient, app: Flask):
+    # Authenticate
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    client.put(
+        "/items/1",
+        json = {
+            "image": "aW1hZ2U="
+        },
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    response = client.get(
+        "/items/all",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.status_code == 200
+    posts = {post["id"]: post for post in response.json["posts"]}
+    assert posts[1]["image"] == "aW1hZ2U="
+    assert posts[0]["image"] is None
+
+@pytest.mark.parametrize(("mimetype", "module"), (
+    ("application/msgpack", "msgpack"),
+    ("application/cbor", "cbor2")
+))
+def test_binary_negotiation(client: FlaskClient, app: Flask, mimetype, module):
+    codec = pytest.importorskip(module)
+    loads = (lambda data: codec.unpackb(data, raw = False)) if module == "msgpack" else codec.loads
+    dumps = (lambda obj: codec.packb(obj, use_bin_type = True)) if module == "msgpack" else codec.dumps
+
+    # Authenticate
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    # Create a post with a binary body; the image is sent as raw bytes
+    response = client.post(
+        "/items/post",
+        data = dumps({
+            "type": 0,
+            "title": "Binary Item",
+            "location1": "Library",
+            "date": 1743769999,
+            "image": b"\x89PNG\r\n"
+        }),
+        headers = {
+            "Cookie": cookie,
+            "Content-Type": mimetype,
+            "Accept": mimetype
+        }
+    )
+
+    assert response.status_code == 201
+    assert response.mimetype == mimetype
+    post_id = loads(response.data)["id"]
+
+    with app.app_context():
+        # Images are stored as base64 text, as with JSON bodies
+        assert get_db().execute(
+            "SELECT image FROM posts WHERE id = ?", (post_id,)
+        ).fetchone()[0] == b"iVBORw0K"
+
+    # The image comes back as raw bytes
+    response = client.get(
+        f"/items/{post_id}",
+        headers = {
+            "Cookie": cookie,
+            "Accept": mimetype
+        }
+    )
+
+    assert response.mimetype == mimetype
+    assert "Accept" in response.vary
+    assert loads(response.data)["image"] == b"\x89PNG\r\n"
+
+    response = client.get(
+        "/items/all",
+        headers = {
+            "Cookie": cookie,
+            "Accept": mimetype
+        }
+    )
+
+    posts = {post["id"]: post for post in loads(response.data)["posts"]}
+    assert posts[post_id]["image"] == b"\x89PNG\r\n"
+
+    # JSON remains the default
+    response = client.get(
+        f"/items/{post_id}",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.mimetype == "application/json"
+    assert response.json["image"] == "iVBORw0K"
+
+def test_binary_request_body_invalid(client: FlaskClient):
+    pytest.importorskip("msgpack")
+
+    # Authenticate
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    response = client.put(
+        "/users/0/profile",
+        data = b"\xc1",
+        headers = {
+            "Cookie": cookie,
+            "Content-Type": "application/msgpack"
+        }
+    )
+
+    assert response.status_code == 400
+
+def test_stream_json(app: Flask):
+    with app.test_request_context():
+        # A character split across chunks, and characters to escape
+        chunks = ["é\"\\".encode()[:1], "é\"\\".encode()[1:], b"\nabc"]
+        response = formats.stream_json({"id": 1, "images": None}, "image", iter(chunks))
+
+        assert response.is_streamed
+        assert response.get_json() == {"id": 1, "images": None, "image": "é\"\\\nabc"}
+
+        response = formats.stream_json({}, "image", iter(()))
+
+        assert response.get_json() == {"image": ""}
+
+def test_limit_body(client: FlaskClient, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "BODY_MAX_SIZE", 100)
+
+    # Rejected before the body is read
+    response = client.post("/auth/login", json = {"username": "test", "password": "x" * 100})
+
+    assert response.status_code == 413
+    assert response.json["error"] == "Content Too Large"
+
+    assert client.post("/auth/login", json = {"username": "test", "password": "test"}).status_code == 200
+
+    # Endpoints that take images allow for them
+    response = client.put("/users/0/profile", json = {"name": "x" * 1000})
+
+    assert response.status_code == 204
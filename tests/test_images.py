@@ -0,0 +1,372 @@
+import base64
+import io
+import json
+import os
+import threading
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import images
+from lostify.db import get_db
+
+Image = pytest.importorskip("PIL.Image")
+
+def encoded_image(size: tuple[int, int], format: str = "PNG") -> str:
+    """
+    A base64-encoded image of the given size, as stored by the app.
+    """
+
+    buffer = io.BytesIO()
+    Image.new("RGBA" if format == "PNG" else "RGB", size, (200, 40, 40)).save(buffer, format)
+
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def login(client: FlaskClient):
+    client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+def test_render_variants():
+    variants = images.render_variants(base64.b64decode(encoded_image((1200, 600))))
+
+    assert set(variants) == set(images.VARIANTS)
+    assert Image.open(io.BytesIO(variants["medium"])).size == (512, 256)
+    assert Image.open(io.BytesIO(variants["thumbnail"])).size == (64, 32)
+
+    # Small images are not enlarged
+    variants = images.render_variants(base64.b64decode(encoded_image((40, 30), "JPEG")))
+
+    assert Image.open(io.BytesIO(variants["medium"])).size == (40, 30)
+
+def test_post_variants(client: FlaskClient, app: Flask):
+    login(client)
+
+    original = encoded_image((800, 800))
+    id = client.post("/items/post", json = {
+        "type": 1,
+        "title": "Umbrella",
+        "location1": "Library",
+        "date": 0,
+        "image": original
+    }).json["id"]
+
+    response = client.get(f"/items/{id}/image/thumbnail")
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert Image.open(io.BytesIO(response.data)).size == (64, 64)
+
+    response = client.get(f"/items/{id}/image/original")
+
+    assert response.mimetype == "image/png"
+    assert response.data == base64.b64decode(original)
+
+    assert client.get(f"/items/{id}").json["images"]["medium"] == f"/items/{id}/image/medium"
+
+    # List views get the URLs of the thumbnails instead of the images
+    posts = {post["id"]: post for post in client.get("/items/all?image=url").json["posts"]}
+
+    assert posts[id]["thumbnail"] == f"/items/{id}/image/thumbnail"
+    assert posts[0]["thumbnail"] is None
+    assert "image" not in posts[id]
+
+    assert client.get("/items/all?image=small").status_code == 400
+
+    # A new image replaces the variants
+    client.put(f"/items/{id}", json = {"image": encoded_image((100, 50))})
+
+    response = client.get(f"/items/{id}/image/medium")
+
+    assert Image.open(io.BytesIO(response.data)).size == (100, 50)
+
+    client.delete(f"/items/{id}")
+
+    with app.test_request_context():
+        assert not os.path.exists(images.variant_path("posts", id, "thumbnail"))
+
+def test_variant_fallback(client: FlaskClient, app: Flask):
+    assert client.get("/items/0/image/thumbnail").status_code == 401
+
+    login(client)
+
+    # Not decodable: the stored image is served in place of the variant
+    client.put("/items/0", json = {"image": "bm90IGFuIGltYWdl"})
+
+    response = client.get("/items/0/image/thumbnail")
+
+    assert response.status_code == 200
+    assert response.data == b"not an image"
+    assert "no-store" in response.headers["Cache-Control"]
+
+    assert client.get("/items/0/image/huge").status_code == 404
+    assert client.get("/items/1/image/thumbnail").status_code == 404
+    assert client.get("/items/999/image/original").status_code == 404
+
+def test_profile_variants(client: FlaskClient):
+    login(client)
+
+    assert client.put("/users/0/profile", json = {"image": encoded_image((300, 150))}).status_code == 204
+
+    assert client.get("/users/0/profile").json["images"]["thumbnail"] == "/users/0/image/thumbnail"
+
+    response = client.get("/users/0/image/thumbnail")
+
+    assert Image.open(io.BytesIO(response.data)).size == (64, 32)
+    assert client.get("/users/1/image/thumbnail").status_code == 404
+
+def test_worker_pool(app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "IMAGE_WORKERS", 2)
+    monkeypatch.setitem(app.config, "IMAGE_QUEUE", 1)
+    monkeypatch.setattr(images, "_pool", None)
+
+    # Holds the worker until both images are scheduled
+    release = threading.Event()
+    render_variants = images.render_variants
+    monkeypatch.setattr(images, "render_variants", lambda data: release.wait(5) and render_variants(data))
+
+    with app.test_request_context():
+        db = get_db()
+        db.execute("UPDATE posts SET image = ? WHERE id IN (0, 1)", (encoded_image((200, 200)).encode(),))
+        db.commit()
+
+        images.schedule("posts", 0)
+
+        # The queue is full: skipped, and generated on first request instead
+        images.schedule("posts", 1)
+        assert ("posts", 1) not in images._generations
+
+        release.set()
+        images._pool[1].shutdown(wait = True)
+
+        assert os.path.exists(images.variant_path("posts", 0, "thumbnail"))
+        assert not os.path.exists(images.variant_path("posts", 1, "thumbnail"))
+
+def test_blob_reader(app: Flask, monkeypatch):
+    monkeypatch.setattr(images, "CHUNK_SIZE", 8)
+
+    data = bytes(range(256)) * 3 + b"end"
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE posts SET image = ? WHERE id = 0", (base64.b64encode(data),))
+        db.execute("UPDATE posts SET image = ? WHERE id = 1", (b"not base64!",))
+        db.commit()
+
+        reader = images.open_original("posts", 0)
+
+        assert reader.encoded and reader.size == len(data)
+
+        # Reads at every alignment to the groups of base64
+        for start in range(0, 12):
+            reader.seek(start)
+            assert reader.read(10) == data[start:start + 10]
+
+        reader.seek(-5, io.SEEK_END)
+        assert reader.read() == data[-5:]
+
+        # Replaced by an image of another size
+        db.execute("UPDATE posts SET image = X'41414141' WHERE id = 0")
+        db.commit()
+
+        reader.seek(0)
+
+        with pytest.raises(OSError):
+            reader.read(1)
+
+        reader.close()
+
+        reader = images.open_original("posts", 1)
+
+        assert not reader.encoded
+        assert reader.read() == b"not base64!"
+
+        reader.close()
+
+        assert images.open_original("posts", 2) is None
+        assert images.open_original("posts", 999) is None
+
+def test_blob_reader_versions(app: Flask, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE posts SET image = ? WHERE id = 0", (base64.b64encode(b"first"),))
+        db.commit()
+
+        reader = images.open_original("posts", 0)
+        etag = reader.etag
+        reader.close()
+
+        # The encoding of a version is checked once
+        monkeypatch.setattr(images, "_is_base64", lambda blob: pytest.fail("BLOB read again"))
+
+        with images.open_original("posts", 0) as reader:
+            assert reader.etag == etag and reader.read() == b"first"
+
+        monkeypatch.undo()
+
+        # Another image of the same size
+        db.execute("UPDATE posts SET image = ? WHERE id = 0", (base64.b64encode(b"other"),))
+        db.commit()
+
+        with images.open_original("posts", 0) as reader:
+            assert reader.etag != etag and reader.read() == b"other"
+
+def test_range_requests(client: FlaskClient, app: Flask):
+    login(client)
+
+    original = encoded_image((300, 300))
+    data = base64.b64decode(original)
+    client.put("/items/0", json = {"image": original})
+
+    response = client.get("/items/0/image/original", headers = {"Range": "bytes=10-99"})
+
+    assert response.status_code == 206
+    assert response.data == data[10:100]
+    assert response.headers["Content-Range"] == f"bytes 10-99/{len(data)}"
+
+    response = client.head("/items/0/image/original")
+
+    assert response.status_code == 200
+    assert response.content_length == len(data)
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.data == b""
+
+    etag = response.headers["ETag"]
+
+    assert client.get("/items/0/image/original", headers = {"If-None-Match": etag}).status_code == 304
+
+    # A stale If-Range gets the whole image
+    response = client.get("/items/0/image/original", headers = {"Range": "bytes=0-9", "If-Range": '"stale"'})
+
+    assert response.status_code == 200
+    assert response.data == data
+
+    response = client.get("/items/0/image/original", headers = {"Range": f"bytes={len(data)}-"})
+
+    assert response.status_code == 416
+
+    # Edits of other fields keep the entity tag
+    assert client.put("/items/0", json = {"title": "Renamed"}).status_code == 204
+    assert client.head("/items/0/image/original").headers["ETag"] == etag
+
+    assert client.put("/users/0/profile", json = {"image": original}).status_code == 204
+
+    profile_etag = client.head("/users/0/image/original").headers["ETag"]
+
+    assert client.put("/users/0/profile", json = {"phone": "321"}).status_code == 204
+    assert client.put("/users/0/online", json = {"status": False}).status_code == 204
+    assert client.head("/users/0/image/original").headers["ETag"] == profile_etag
+
+    # Variant files
+    size = len(client.get("/items/0/image/thumbnail").data)
+    response = client.get("/items/0/image/thumbnail", headers = {"Range": "bytes=-10"})
+
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes {size - 10}-{size - 1}/{size}"
+
+def test_upload(client: FlaskClient, app: Flask, monkeypatch):
+    # Small chunks exercise the chunked encoding, writes and reads
+    monkeypatch.setattr(images, "UPLOAD_CHUNK_SIZE", 9)
+    monkeypatch.setattr(images, "CHUNK_SIZE", 8)
+
+    data = base64.b64decode(encoded_image((120, 90)))
+
+    assert client.put("/items/0/image", data = data, content_type = "image/png").status_code == 401
+
+    login(client)
+
+    assert client.put("/items/0/image", data = data, content_type = "image/png").status_code == 204
+
+    with app.app_context():
+        # Stored as base64, as with JSON bodies
+        assert get_db().execute("SELECT image FROM posts WHERE id = 0").fetchone()[0] == base64.b64encode(data)
+
+    assert client.get("/items/0/image/original").data == data
+    assert Image.open(io.BytesIO(client.get("/items/0/image/thumbnail").data)).size == (64, 48)
+
+    # The image of a post is streamed into its JSON
+    response = client.get("/items/0")
+
+    assert response.is_streamed
+    assert response.json["image"] == base64.b64encode(data).decode("ascii")
+    assert response.json["title"] == "Test Post"
+
+    assert client.put("/items/5/image", data = data, content_type = "image/png").status_code == 403
+    assert client.put("/items/999/image", data = data, content_type = "image/png").status_code == 404
+    assert client.put("/items/0/image", data = data, content_type = "text/plain").status_code == 415
+
+    # No body, hence no Content-Length
+    assert client.put("/items/0/image", content_type = "image/png").status_code == 411
+
+    monkeypatch.setitem(app.config, "IMAGE_MAX_SIZE", len(data) - 1)
+
+    assert client.put("/items/0/image", data = data, content_type = "image/png").status_code == 413
+
+def test_upload_profile(client: FlaskClient):
+    login(client)
+
+    data = b"\xff\xd8\xff" + bytes(range(100))
+
+    assert client.put("/users/1/image", data = data, content_type = "image/jpeg").status_code == 403
+    assert client.put("/users/0/image", data = data, content_type = "image/jpeg").status_code == 204
+
+    response = client.get("/users/0/profile")
+
+    assert base64.b64decode(response.json["image"]) == data
+    assert response.json["name"] == "test_name"
+    assert response.json["images"]["original"] == "/users/0/image/original"
+
+    response = client.get("/users/0/image/original")
+
+    assert response.mimetype == "image/jpeg"
+    assert response.data == data
+
+def test_multipart(client: FlaskClient, app: Flask, monkeypatch):
+    login(client)
+
+    data = base64.b64decode(encoded_image((90, 120)))
+    fields = json.dumps({"type": 0, "title": "Wallet", "location1": "Gym", "date": 0})
+
+    response = client.post("/items/post", data = {
+        "data": fields,
+        "image": (io.BytesIO(data), "wallet.png", "image/png")
+    })
+
+    assert response.status_code == 201
+
+    id = response.json["id"]
+
+    assert client.get(f"/items/{id}").json["title"] == "Wallet"
+    assert client.get(f"/items/{id}/image/original").data == data
+    assert Image.open(io.BytesIO(client.get(f"/items/{id}/image/thumbnail").data)).size == (48, 64)
+
+    # Only the image
+    assert client.put(f"/items/{id}", data = {"image": (io.BytesIO(b"GIF89a"), "a.gif")}).status_code == 204
+    assert client.get(f"/items/{id}/image/original").data == b"GIF89a"
+
+    response = client.put(f"/items/{id}", data = {
+        "data": json.dumps({"image": "R0lGODlh"}),
+        "image": (io.BytesIO(b"GIF89a"), "a.gif")
+    })
+
+    assert response.status_code == 400
+
+    assert client.put("/users/0/profile", data = {
+        "data": json.dumps({"phone": "999"}),
+        "image": (io.BytesIO(data), "me.png")
+    }).status_code == 204
+
+    profile = client.get("/users/0/profile").json
+
+    assert profile["phone"] == "999"
+    assert base64.b64decode(profile["image"]) == data
+
+    # Capped before the body is parsed
+    monkeypatch.setitem(app.config, "IMAGE_MAX_SIZE", 100)
+    monkeypatch.setitem(app.config, "BODY_MAX_SIZE", 100)
+
+    response = client.post("/items/post", data = {
+        "data": fields,
+        "image": (io.BytesIO(data), "wallet.png")
+    })
+
+    assert response.status_code == 413
+    assert client.put("/items/0/image", data = data, content_type = "image/png").status_code == 413
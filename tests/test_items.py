@@ -56,6 +56,7 @@ def test_create(client: FlaskClient, app: Flask):
 @pytest.mark.parametrize(('type', 'title', 'location1'), (
     (2, '', 'Test Location'),
     (1, 'Title', ''),
+    (1, 'Title', ' \t'),
     (0, 25, None)
 ))
 def test_create_validate_input(client: FlaskClient, type, title, location1):
@@ -221,6 +222,19 @@ def test_update(client: FlaskClient, app: Flask):
 
     assert response.status_code == 400
 
+    # Test a blank location
+    response = client.put(
+        '/items/1',
+        json = {
+            'location1': '  '
+        },
+        headers = {
+            'Cookie': cookie
+        }
+    )
+
+    assert response.status_code == 400
+
 def test_delete(client: FlaskClient, app: Flask):
     # Test deleting an item without authentication
     response = client.delete('/items/1')
@@ -678,4 +692,139 @@ def test_claim(client: FlaskClient, app: Flask):
         }
     )
 
-    assert response.status_code == 409
\ No newline at end of file
+    assert response.status_code == 409
+
+def test_bulk_create(client: FlaskClient, app: Flask, monkeypatch):
+    post = {
+        'type': 1,
+        'title': 'Umbrella',
+        'location1': 'Library',
+        'date': int(datetime.now().timestamp())
+    }
+
+    # Authenticate as a non-admin user
+    client.post('/auth/login', json = {'username': 'test', 'password': 'test'})
+
+    response = client.post('/items/bulk', json = [post])
+
+    assert response.status_code == 403
+
+    # Authenticate as admin
+    client.post('/auth/login', json = {'username': 'other', 'password': 'other'})
+
+    response = client.post('/items/bulk', json = [
+        post,
+        {**post, 'title': ''},
+        {**post, 'title': 'Bottle', 'image': 'aW1n'},
+        {'type': 1},
+        {**post, 'location1': ' '}
+    ])
+
+    assert response.status_code == 201
+    assert response.json['errors'] == [
+        {'index': 1, 'message': 'Item name is required.'},
+        {'index': 3, 'message': "Field 'title' is required"},
+        {'index': 4, 'message': 'Location 1 is required.'}
+    ]
+
+    ids = response.json['ids']
+
+    assert ids[1] is ids[3] is ids[4] is None
+    assert ids[2] == ids[0] + 1
+
+    with app.app_context():
+        rows = get_db().execute(
+            "SELECT id, title, creator, image FROM posts WHERE id IN (?, ?) ORDER BY id", (ids[0], ids[2])
+        ).fetchall()
+
+        assert [tuple(row) for row in rows] == [
+            (ids[0], 'Umbrella', 1, None),
+            (ids[2], 'Bottle', 1, b'aW1n')
+        ]
+
+    # NDJSON, with a line that is not JSON
+    response = client.post(
+        '/items/bulk',
+        data = '{"type": 0, "title": "Pen", "location1": "Hall", "date": 0}\n\nnot json\n',
+        content_type = 'application/x-ndjson'
+    )
+
+    assert response.status_code == 201
+    assert response.json['ids'][0] == ids[2] + 1
+    assert response.json['errors'] == [{'index': 1, 'message': 'Post must be an object'}]
+
+    # Nothing to insert
+    response = client.post('/items/bulk', json = [{'type': 1}])
+
+    assert response.status_code == 400
+
+    response = client.post('/items/bulk', json = post)
+
+    assert response.status_code == 400
+
+    # Too many posts
+    monkeypatch.setitem(app.config, 'BULK_POST_LIMIT', 2)
+
+    response = client.post('/items/bulk', json = [post] * 3)
+
+    assert response.status_code == 413
+
+def test_locations(client: FlaskClient, app: Flask, runner):
+    assert client.get('/items/locations').status_code == 401
+
+    client.post('/auth/login', json = {'username': 'test', 'password': 'test'})
+
+    def post(type: int, location1: str, date: int) -> int:
+        return client.post('/items/post', json = {
+            'type': type,
+            'title': 'Umbrella',
+            'location1': location1,
+            'date': date
+        }).json['id']
+
+    # Names differing in case and spacing resolve to the same location
+    found = post(1, 'Main Library', 100)
+    lost = post(0, 'main  library ', 200)
+    other = post(1, 'Gym', 300)
+
+    def counts() -> dict:
+        return {
+            location['name']: location['openPosts']
+            for location in client.get('/items/locations').json['locations']
+        }
+
+    assert counts() == {'Gym': 1, 'Main Library': 2}
+
+    response = client.get('/items/all?location=MAIN library')
+
+    # Newest first
+    assert [p['id'] for p in response.json['posts']] == [lost, found]
+
+    response = client.get('/items/all?location=main library&type=1')
+
+    assert [p['id'] for p in response.json['posts']] == [found]
+    assert client.get('/items/all?location=Nowhere').json['posts'] == []
+    assert client.get('/items/all?type=2').status_code == 400
+
+    # Moved, then closed
+    client.put(f'/items/{lost}', json = {'location1': 'gym'})
+
+    assert counts() == {'Gym': 2, 'Main Library': 1}
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE posts SET closedBy = 1 WHERE id = ?', (other,))
+        db.commit()
+
+    assert counts() == {'Gym': 1, 'Main Library': 1}
+
+    client.delete(f'/items/{found}')
+
+    assert counts() == {'Gym': 1, 'Main Library': 0}
+
+    # A name of another location merges it
+    result = runner.invoke(args = ('items', 'alias', 'Gym', 'Sports Complex'))
+
+    assert result.exit_code == 0
+    assert counts() == {'Main Library': 0, 'Sports Complex': 1}
+    assert [p['id'] for p in client.get('/items/all?location=gym').json['posts']] == [other, lost]
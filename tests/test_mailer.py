@@ -0,0 +1,94 @@
+from flask import Flask
+from lostify import mailer
+from lostify.mailer import send_otp, send_password
+
+def test_send_otp_fail(app: Flask):
+    """
+    Test the send_otp function with invalid parameters.
+    """
+
+    fail = False
+
+    try:
+        with app.app_context():
+            send_otp(1 + 7j, "invalid_email", "Test User")
+    except Exception as e:
+        fail = True
+
+    assert fail
+
+def test_send_password_fail(app: Flask):
+    """
+    Test the send_password function with invalid parameters.
+    """
+
+    fail = False
+
+    try:
+        with app.app_context():
+            send_password(1 + 7j, "invalid_email", "Test User")
+    except Exception as e:
+        fail = True
+
+    assert fail
+
+def test_client_reused(app: Flask, monkeypatch):
+    with app.app_context():
+        client = mailer.get_client()
+
+        assert mailer.get_client() is client
+
+        # A new connection string replaces the client
+        monkeypatch.setitem(
+            app.config, "AZURE_CONNECTION_STRING",
+            "endpoint=https://example.communication.azure.com/;accesskey=a2V5"
+        )
+
+        assert mailer.get_client() is not client
+
+def test_messages(app: Flask):
+    with app.app_context():
+        message = mailer.otp_message(7, "test@iitk.ac.in", "<Test>")
+
+        assert message["recipients"]["to"] == [{"address": "test@iitk.ac.in", "displayName": "<Test>"}]
+        assert message["senderAddress"] == app.config["AZURE_SENDER_EMAIL"]
+        assert "OTP for signup: 0007" in message["content"]["plainText"]
+
+        # Values are escaped in the HTML body
+        assert "Hello, &lt;Test&gt;!" in message["content"]["html"]
+        assert ">0007<" in message["content"]["html"]
+
+        message = mailer.password_message("a&b", "test@iitk.ac.in", "Test")
+
+        assert "<code>a&amp;b</code>" in message["content"]["html"]
+        assert "Your new password is: a&b" in message["content"]["plainText"]
+
+def test_registry_load(app: Flask):
+    # Every message type is compiled when the app is created
+    assert {"otp", "password"} <= set(mailer.templates._types)
+
+    subject, text, html = mailer.templates.get("otp")
+
+    assert subject == "Lostify: Sign up"
+    assert mailer.templates.get("otp")[2] is html
+
+def test_registry_new_type(tmp_path):
+    """
+    A message type is added with its two templates.
+    """
+
+    (tmp_path / "notice.txt").write_text('{% set subject = "Notice" %}Post {{ post }} was removed.')
+    (tmp_path / "notice.html").write_text("<p>{{ name }}: post <b>{{ post }}</b> was removed.</p>")
+
+    registry = mailer.TemplateRegistry(str(tmp_path))
+    registry.load()
+
+    rendered = list(registry.render_many("notice", (
+        {"name": "A", "post": 1},
+        {"name": "<B>", "post": 2},
+    )))
+
+    assert rendered == [
+        ("Notice", "Post 1 was removed.", "<p>A: post <b>1</b> was removed.</p>"),
+        ("Notice", "Post 2 was removed.", "<p>&lt;B&gt;: post <b>2</b> was removed.</p>"),
+    ]
@@ -0,0 +1,163 @@
+import pytest
+from flask import Flask
+from lostify import migrate
+from lostify.db import get_db
+
+@pytest.fixture
+def migrations(tmp_path, monkeypatch):
+    """
+    A temporary migrations directory, in place of `lostify/migrations`.
+    """
+
+    monkeypatch.setattr(migrate, "MIGRATIONS_PATH", str(tmp_path))
+    return tmp_path
+
+def test_init_db_version(app: Flask):
+    """
+    `init_db` leaves the database at the latest schema version.
+    """
+
+    with app.app_context():
+        migrations = migrate.discover()
+        latest = migrations[-1].version if migrations else migrate.BASELINE_VERSION
+
+        assert migrate.current_version(get_db()) == latest
+
+def test_upgrade(app: Flask, migrations):
+    (migrations / "0002_post_index.sql").write_text(
+        "CREATE INDEX idx_test_posts_date ON posts (date);"
+    )
+    (migrations / "0003_title_key.py").write_text(
+        "from lostify.migrate import add_column, backfill\n"
+        "\n"
+        "def upgrade(db):\n"
+        "    add_column(db, 'posts', 'titleKey', 'TEXT')\n"
+        "    backfill(db, 'posts', 'titleKey = lower(title)', 'titleKey IS NULL', batch_size = 3)\n"
+    )
+
+    with app.app_context():
+        db = get_db()
+        migrate.set_version(db, migrate.BASELINE_VERSION)
+        db.commit()
+
+        # Upgrade to an intermediate version
+        assert migrate.upgrade(db, target = 2) == 1
+        assert migrate.current_version(db) == 2
+        assert db.execute(
+            "SELECT 1 FROM sqlite_schema WHERE name = 'idx_test_posts_date'"
+        ).fetchone() is not None
+
+        assert migrate.upgrade(db) == 1
+        assert migrate.current_version(db) == 3
+        assert db.execute(
+            "SELECT count(*) FROM posts WHERE titleKey = lower(title)"
+        ).fetchone()[0] == 10
+
+        # Nothing left to apply
+        assert migrate.upgrade(db) == 0
+
+def test_upgrade_failure_rolls_back(app: Flask, migrations):
+    (migrations / "0002_broken.sql").write_text(
+        "CREATE INDEX idx_test_broken ON posts (date);\n"
+        "CREATE INDEX idx_test_broken ON posts (title);"
+    )
+
+    with app.app_context():
+        db = get_db()
+        migrate.set_version(db, migrate.BASELINE_VERSION)
+        db.commit()
+
+        with pytest.raises(Exception):
+            migrate.upgrade(db)
+
+        assert migrate.current_version(db) == migrate.BASELINE_VERSION
+        assert db.execute(
+            "SELECT 1 FROM sqlite_schema WHERE name = 'idx_test_broken'"
+        ).fetchone() is None
+
+def test_discover_out_of_sequence(migrations):
+    (migrations / "0003_gap.sql").write_text("SELECT 1;")
+
+    with pytest.raises(RuntimeError):
+        migrate.discover()
+
+def test_backfill_batches(app: Flask):
+    with app.app_context():
+        db = get_db()
+        migrate.add_column(db, "posts", "titleKey", "TEXT")
+
+        # Adding an existing column is a no-op
+        migrate.add_column(db, "posts", "titleKey", "TEXT")
+
+        assert migrate.backfill(
+            db, "posts", "titleKey = ?", "titleKey IS NULL", ("x",), batch_size = 4
+        ) == 10
+        assert not db.in_transaction
+
+def test_db_commands(runner, migrations):
+    (migrations / "0002_post_index.sql").write_text(
+        "CREATE INDEX idx_test_posts_date ON posts (date);"
+    )
+
+    with runner.app.app_context():
+        migrate.set_version(get_db(), migrate.BASELINE_VERSION)
+        get_db().commit()
+
+    result = runner.invoke(args = ("db", "status"))
+    assert "Schema version: 1 (latest: 2)" in result.output
+    assert "Pending: 0002_post_index.sql" in result.output
+
+    result = runner.invoke(args = ("db", "upgrade"))
+    assert "schema version 2" in result.output
+
+    result = runner.invoke(args = ("db", "status"))
+    assert "Pending" not in result.output
+
+def test_user_stats_backfill(app: Flask):
+    """
+    Migration 2 backfills the counters of existing users.
+    """
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO confirmations (postid, initid, otherid) VALUES (5, 1, 0)")
+        db.execute("UPDATE posts SET closedBy = 1 WHERE id = 0")
+        db.commit()
+
+        expected = db.execute("SELECT * FROM user_stats ORDER BY userid").fetchall()
+
+        # Back to the baseline schema
+        db.executescript("DROP TABLE user_stats; DROP INDEX idx_posts_creator;")
+        migrate.set_version(db, migrate.BASELINE_VERSION)
+        db.commit()
+
+        migrate.upgrade(db, target = 2)
+
+        assert db.execute("SELECT * FROM user_stats ORDER BY userid").fetchall() == expected
+        assert [tuple(row) for row in expected] == [(0, 5, 4, 1, 0, 1), (1, 5, 5, 0, 1, 0)]
+
+def test_locations_backfill(app: Flask):
+    """
+    Migration 4 resolves the locations of existing posts and counts the
+    open ones.
+    """
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE posts SET location1 = 'A ' WHERE id = 1")
+        db.execute("UPDATE posts SET closedBy = 1 WHERE id = 2")
+        db.commit()
+
+        # Rows of the test data are inserted without their locations
+        migrate.set_version(db, 3)
+        db.commit()
+
+        migrate.upgrade(db, target = 4)
+
+        assert db.execute("SELECT count(*) FROM posts WHERE location1_id IS NULL").fetchone()[0] == 0
+
+        counts = dict(db.execute("SELECT name, openPosts FROM locations").fetchall())
+
+        assert counts["a"] == 2
+        assert counts["c"] == 0
+        assert len(counts) == 9
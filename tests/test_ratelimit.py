@@ -0,0 +1,126 @@
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from lostify import ratelimit
+from lostify.ratelimit import Limit, MemoryStore, SQLiteStore
+
+@pytest.fixture
+def limited(app: Flask, monkeypatch):
+    """
+    The app with rate limiting enabled and a fresh store.
+    """
+
+    monkeypatch.setitem(app.config, "RATELIMIT_ENABLED", True)
+    monkeypatch.setitem(app.config, "RATELIMIT_DEFAULT", Limit(3, 60))
+    monkeypatch.setitem(app.config, "RATELIMITS", {"items.get_all": Limit(2, 60), "hello": None})
+    monkeypatch.setitem(app.extensions, "ratelimit", MemoryStore())
+
+    return app
+
+@pytest.mark.parametrize("store", ("memory", "sqlite"))
+def test_bucket(store, tmp_path):
+    store = MemoryStore() if store == "memory" else SQLiteStore(str(tmp_path / "buckets.db"))
+    limit = Limit(2, 10)
+
+    assert store.take("a", limit, 100) == 0
+    assert store.take("a", limit, 100) == 0
+
+    # Empty: a token is added every 5 seconds
+    assert store.take("a", limit, 101) == pytest.approx(4)
+    assert store.take("b", limit, 101) == 0
+
+    assert store.take("a", limit, 105) == 0
+    assert store.take("a", limit, 105) == pytest.approx(5)
+
+def test_memory_store_prune():
+    store = MemoryStore(max_keys = 10)
+    limit = Limit(1, 10)
+
+    store.take("refilled", limit, 0)
+
+    for i in range(10):
+        store.take(str(i), limit, 100)
+
+    # The refilled bucket goes first, then the least recently used
+    assert "refilled" not in store._buckets
+    assert len(store._buckets) == 9
+    assert "0" not in store._buckets and "9" in store._buckets
+
+def test_limit_request(client: FlaskClient, limited: Flask):
+    # Anonymous requests are charged to the client IP
+    for _ in range(3):
+        assert client.post("/auth/login", json = {"username": "test", "password": "wrong"}).status_code != 429
+
+    response = client.post("/auth/login", json = {"username": "test", "password": "test"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == 20
+    assert response.json["error"] == "Too Many Requests"
+
+    # Another client has its own bucket
+    response = client.post(
+        "/auth/login",
+        json = {"username": "test", "password": "test"},
+        environ_base = {"REMOTE_ADDR": "10.0.0.2"}
+    )
+
+    assert response.status_code == 200
+
+    # Logged-in requests are charged to the user, per endpoint budget
+    assert client.get("/items/all").status_code == 200
+    assert client.get("/items/all").status_code == 200
+    assert client.get("/items/all").status_code == 429
+
+    assert client.get("/items/0").status_code == 200
+
+    # Endpoints without a limit
+    for _ in range(5):
+        assert client.get("/hello").status_code == 200
+
+def test_proxy_address(client: FlaskClient, limited: Flask):
+    """
+    The client IP is taken from `X-Forwarded-For` through `ProxyFix`.
+    """
+
+    for address in ("10.0.0.3", "10.0.0.3", "10.0.0.3", "10.0.0.4"):
+        response = client.get("/items/0", headers = {"X-Forwarded-For": address})
+        assert response.status_code == 401
+
+    assert client.get("/items/0", headers = {"X-Forwarded-For": "10.0.0.3"}).status_code == 429
+    assert client.get("/items/0", headers = {"X-Forwarded-For": "10.0.0.4"}).status_code == 401
+
+def test_limit_username(client: FlaskClient, limited: Flask, monkeypatch):
+    """
+    Logins are also charged to the account named in the body, whatever the
+    address of the client.
+    """
+
+    monkeypatch.setitem(limited.config, "RATELIMITS", {"auth.login": Limit(10, 60)})
+    monkeypatch.setitem(limited.config, "RATELIMITS_BY_USERNAME", {"auth.login": Limit(2, 60)})
+
+    for address in ("10.0.0.5", "10.0.0.6"):
+        response = client.post(
+            "/auth/login",
+            json = {"username": "test", "password": "wrong"},
+            environ_base = {"REMOTE_ADDR": address}
+        )
+
+        assert response.status_code == 401
+
+    response = client.post(
+        "/auth/login",
+        json = {"username": " TEST", "password": "test"},
+        environ_base = {"REMOTE_ADDR": "10.0.0.7"}
+    )
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == 30
+
+    # Other accounts behind the same address are not affected
+    response = client.post(
+        "/auth/login",
+        json = {"username": "other", "password": "other"},
+        environ_base = {"REMOTE_ADDR": "10.0.0.5"}
+    )
+
+    assert response.status_code == 200
@@ -289,4 +289,268 @@ def test_update_online_status(client: FlaskClient, app: Flask):
     with app.app_context():
         assert get_db().execute(
             "SELECT online FROM profiles WHERE userid = 0"
-        ).fetchone()[0] == 0
\ No newline at end of file
+        ).fetchone()[0] == 0
+
+def test_stats(client: FlaskClient, app: Flask):
+    # Test fetching counters without authentication
+    response = client.get("/users/0/stats")
+
+    assert response.status_code == 401
+
+    # Authenticate
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    response = client.get(
+        "/users/0/stats",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json == {
+        "userid": 0, "posts": 5, "openPosts": 5, "closedPosts": 0, "claimed": 0, "pending": 0
+    }
+
+    # Test fetching counters of a non-existent user
+    response = client.get(
+        "/users/100/stats",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.status_code == 404
+
+def test_stats_maintained(client: FlaskClient, app: Flask):
+    """
+    The counters follow posts, claims and deletions.
+    """
+
+    def login(username: str) -> str:
+        return client.post(
+            "/auth/login",
+            json = {
+                "username": username,
+                "password": username
+            }
+        ).headers["Set-Cookie"]
+
+    def stats(id: int) -> dict:
+        return client.get(f"/users/{id}/stats", headers = {"Cookie": cookie}).json
+
+    cookie = login("test")
+
+    # A new post
+    client.post(
+        "/items/post",
+        json = {
+            "type": 1,
+            "title": "Umbrella",
+            "location1": "Library",
+            "date": 1743769999
+        },
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert stats(0)["posts"] == 6
+
+    # The creator initiates a claim (twice; the second replaces the first)
+    for _ in range(2):
+        client.post("/items/1/claim", json = {"otherid": 1}, headers = {"Cookie": cookie})
+
+    assert stats(1)["pending"] == 1
+
+    # The other party confirms
+    cookie = login("other")
+    client.post("/items/1/claim", headers = {"Cookie": cookie})
+
+    assert stats(0)["openPosts"] == 5
+    assert stats(0)["closedPosts"] == 1
+    assert stats(1)["claimed"] == 1
+    assert stats(1)["pending"] == 0
+
+    # Deleting the closed post
+    cookie = login("test")
+    client.delete("/items/1", headers = {"Cookie": cookie})
+
+    assert stats(0) == {
+        "userid": 0, "posts": 5, "openPosts": 5, "closedPosts": 0, "claimed": 0, "pending": 0
+    }
+    assert stats(1)["claimed"] == 0
+
+def test_confirmations(client: FlaskClient, app: Flask):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO confirmations (postid, initid, otherid) VALUES (?, ?, ?)",
+            ((0, 0, 1), (5, 1, 0), (6, 1, 0), (1, 0, 1))
+        )
+        db.commit()
+
+    # Test fetching confirmations without authentication
+    response = client.get("/users/0/confirmations")
+
+    assert response.status_code == 401
+
+    # Authenticate
+    cookie = client.post(
+        "/auth/login",
+        json = {
+            "username": "test",
+            "password": "test"
+        }
+    ).headers["Set-Cookie"]
+
+    # Test fetching another user's confirmations
+    response = client.get(
+        "/users/1/confirmations",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.status_code == 403
+
+    # Test fetching in pages of two, in (postid, initid) order
+    pages = []
+    after = None
+
+    while True:
+        response = client.get(
+            "/users/0/confirmations",
+            query_string = {"limit": 2, **({"after": after} if after else {})},
+            headers = {
+                "Cookie": cookie
+            }
+        )
+
+        assert response.status_code == 200
+
+        pages.append([(c["postid"], c["incoming"]) for c in response.json["confirmations"]])
+        after = response.json["next"]
+
+        if after is None:
+            break
+
+    assert pages == [[(0, False), (1, False)], [(5, True), (6, True)]]
+    assert response.json["confirmations"][0]["title"] is not None
+
+    # Test an invalid cursor
+    response = client.get(
+        "/users/0/confirmations?after=5",
+        headers = {
+            "Cookie": cookie
+        }
+    )
+
+    assert response.status_code == 400
+
+def test_confirmations_use_indexes(app: Flask):
+    with app.app_context():
+        plan = " ".join(
+            row["detail"] for row in get_db().execute(
+                "EXPLAIN QUERY PLAN "
+                "SELECT postid FROM confirmations WHERE otherid = 0 AND (postid, initid) > (-1, -1) "
+                "UNION "
+                "SELECT postid FROM confirmations WHERE initid = 0 AND (postid, initid) > (-1, -1)"
+            )
+        )
+
+    assert "idx_confirmations_otherid" in plan
+    assert "idx_confirmations_initid" in plan
+
+def test_import(runner, tmp_path):
+    roster = tmp_path / "roster.csv"
+    roster.write_text(
+        "username,name,roll,password,email,role\n"
+        "alice,Alice,100,secret,alice@example.com,\n"
+        "test,Duplicate,101,,,\n"
+        "bob,Bob,23829,x,,\n"
+        "carol,Carol,102,,,1\n"
+        "dave,Dave,roll,x,,\n"
+        "erin,Erin,103,,,\n"
+        "frank,Frank,104,x,,2\n"
+    )
+    credentials = tmp_path / "credentials.csv"
+
+    result = runner.invoke(args = (
+        "users", "import", str(roster), "--credentials", str(credentials), "--batch-size", "2", "--workers", "1"
+    ))
+
+    assert result.exit_code == 0, result.output
+    assert "3 users created, 4 skipped" in result.output
+
+    # Only the generated passwords of the users created are written
+    lines = credentials.read_text().splitlines()
+    assert lines[0] == "username,password"
+    assert [line.split(",")[0] for line in lines[1:]] == ["carol", "erin"]
+    assert credentials.stat().st_mode & 0o777 == 0o600
+
+    with runner.app.app_context():
+        db = get_db()
+
+        rows = db.execute(
+            "SELECT username, role, name, roll, email, online, posts FROM users "
+                "JOIN profiles ON profiles.userid = users.id "
+                "JOIN user_stats ON user_stats.userid = users.id "
+                "WHERE username IN ('alice', 'carol', 'erin') ORDER BY username"
+        ).fetchall()
+
+        assert [tuple(row) for row in rows] == [
+            ("alice", 0, "Alice", 100, "alice@example.com", 0, 0),
+            ("carol", 1, "Carol", 102, None, 0, 0),
+            ("erin", 0, "Erin", 103, None, 0, 0),
+        ]
+
+    # Users log in with the generated passwords
+    client = runner.app.test_client()
+    password = lines[1].split(",")[1]
+
+    assert client.post("/auth/login", json = {"username": "carol", "password": password}).status_code == 200
+
+def test_import_ndjson(runner, tmp_path):
+    roster = tmp_path / "roster.ndjson"
+    roster.write_text(
+        '{"username": "alice", "name": "Alice", "roll": 100, "password": "secret"}\n'
+        "\n"
+        '{"username": "bob", "name": "Bob", "roll": 101}\n'
+        '{"username": "carol", "name": "Carol", "roll": 102, "password": 1234}\n'
+    )
+
+    # Without --credentials, users without a password are skipped, as are
+    # passwords that are not strings
+    result = runner.invoke(args = ("users", "import", str(roster), "--workers", "1"))
+
+    assert result.exit_code == 0, result.output
+    assert "1 users created, 2 skipped" in result.output
+
+    client = runner.app.test_client()
+    assert client.post("/auth/login", json = {"username": "alice", "password": "secret"}).status_code == 200
+
+def test_import_ndjson_malformed(runner, tmp_path):
+    roster = tmp_path / "roster.ndjson"
+    roster.write_text(
+        '{"username": "alice", "name": "Alice", "roll": 100, "password": "secret"}\n'
+        "\n"
+        '{"username": "bob", "name": "Bob",\n'
+        '{"username": "carol", "name": "Carol", "roll": 102, "password": "secret"}\n'
+    )
+
+    # Batches of one, so that alice is committed before the malformed line is read
+    result = runner.invoke(args = ("users", "import", str(roster), "--workers", "1", "--batch-size", "1"))
+
+    assert result.exit_code == 0, result.output
+    assert "Skipped line 3: invalid" in result.output
+    assert "2 users created, 1 skipped" in result.output
+
+    client = runner.app.test_client()
+    assert client.post("/auth/login", json = {"username": "carol", "password": "secret"}).status_code == 200